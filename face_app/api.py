@@ -0,0 +1,296 @@
+"""
+HTTP recognition API
+JSON / multipart endpoints served by uvicorn, recognition work done in a process pool:
+    python api.py --workers 4 --port 8000 [--ui]
+
+    POST   /verify          image (multipart file field, or JSON {"image": "<base64>"})
+    POST   /register        name + image (+ append=true to add another photo of an existing user)
+    GET    /users           registered users (?prefix=&offset=&limit= for one page, X-Total-Count header)
+    DELETE /users/{name}
+    POST   /users/delete    JSON {"names": [...]}: several users in one write
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+import face_core as core
+from face_core.metrics import metrics
+
+API_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+API_TIMEOUT = 30.0        # seconds a request may spend in a worker
+API_QUEUE_TIMEOUT = 5.0   # seconds a request may wait for a free worker
+API_QUEUE_FACTOR = 4      # waiting requests allowed per concurrent slot
+
+# Worker process state: the gallery stays loaded between requests and is
+# reloaded only when the database snapshot changes
+_snapshot = None
+_candidates = []
+
+
+def _init_worker():
+    metrics.reset()  # a forked worker starts with a copy of the server's metrics, already counted there
+    core.warm_up(gallery=False)
+    _warm_gallery()
+
+
+def _warm_gallery():
+    global _snapshot, _candidates
+    if core.db.snapshot() is not _snapshot:
+        _candidates = core.load_gallery()
+        _snapshot = core.db.data
+    return _candidates
+
+
+def _decode(data):
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Image could not be decoded")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def _job(fn, *args):
+    # Runs in a worker: the result plus the metrics it recorded, merged into the server's registry
+    return fn(*args), metrics.drain()
+
+
+def verify_job(data):
+    """Worker: verify_image on encoded image bytes against the warm gallery"""
+    result = core.verify_image(_decode(data), _warm_gallery())
+    result["top"] = [{"name": name, "score": float(score)} for name, score in result["top"]]
+    if result["gap"] is not None:
+        result["gap"] = float(result["gap"])
+    return result
+
+
+def enroll_job(name, data):
+    """Worker: features, stored image and template of a new user (no database write)"""
+    return core.prepare_enrollment(name, _decode(data))
+
+
+class WorkerPool:
+    """Process pool behind a bounded admission queue
+
+    At most `concurrency` jobs are submitted to the pool at once; up to
+    `max_queue` more requests wait for a slot (429 beyond that, 503 after
+    waiting `queue_timeout`), and a job taking longer than `timeout` answers
+    504. A timed-out job keeps its slot until the worker actually finishes,
+    so the pool's own queue never grows. A pool broken by a crashed worker
+    is replaced with a fresh one and the job retried once (503 if the retry
+    breaks it too). Workers send back the metrics each job recorded, so
+    /metrics also covers the recognition stages.
+    """
+    def __init__(self, workers=API_WORKERS, concurrency=None, max_queue=None,
+                 timeout=API_TIMEOUT, queue_timeout=API_QUEUE_TIMEOUT):
+        self.workers = workers
+        self.concurrency = concurrency or workers
+        self.max_queue = self.concurrency * API_QUEUE_FACTOR if max_queue is None else max_queue
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.running = 0
+        self._slots = None
+        self._pool = None
+
+    def start(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+    def _restart(self, broken):
+        # Concurrent jobs all see the same broken pool; only the first replaces it
+        if self._pool is broken:
+            metrics.inc("api_pool_restarts_total")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _acquire(self):
+        if self.waiting >= self.max_queue:
+            metrics.inc("api_rejected_total", reason="queue_full")
+            raise HTTPException(429, "Too many requests queued", headers={"Retry-After": "1"})
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("api_rejected_total", reason="queue_timeout")
+            raise HTTPException(503, "No worker available", headers={"Retry-After": "2"})
+        finally:
+            self.waiting -= 1
+
+    def _release(self, _):
+        self.running -= 1
+        self._slots.release()
+
+    async def run(self, fn, *args):
+        await self._acquire()
+        self.running += 1
+        future = None
+        try:
+            for _ in range(2):
+                pool = self._pool
+                try:
+                    future = asyncio.get_running_loop().run_in_executor(pool, _job, fn, *args)
+                    result, delta = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+                except BrokenProcessPool:
+                    self._restart(pool)
+                    continue
+                metrics.merge(delta)
+                return result
+            metrics.inc("api_rejected_total", reason="broken_pool")
+            raise HTTPException(503, "Worker pool unavailable", headers={"Retry-After": "2"})
+        except asyncio.TimeoutError:
+            metrics.inc("api_rejected_total", reason="timeout")
+            raise HTTPException(504, "Recognition timed out")
+        finally:
+            # The slot stays taken until the last submitted job really finishes
+            if future is not None and not future.done():
+                future.add_done_callback(self._release)
+            else:
+                self._release(None)
+
+
+async def _read_request(request, need_name=False):
+    """(name, image bytes, append flag) from a multipart form or a JSON body"""
+    if request.headers.get("content-type", "").startswith("multipart/"):
+        form = await request.form()
+        upload = form.get("image") or form.get("file")
+        data = await upload.read() if upload is not None and hasattr(upload, "read") else None
+        name = form.get("name")
+        append = str(form.get("append", "")).lower() in ("1", "true", "yes", "on")
+    else:
+        try:
+            body = await request.json()
+            data = base64.b64decode(body["image"]) if body.get("image") else None
+        except (ValueError, TypeError, AttributeError):
+            raise HTTPException(400, "Expected multipart form data or a JSON body with a base64 'image'")
+        name = body.get("name")
+        append = body.get("append") in (True, 1, "1", "true")
+    if not data:
+        raise HTTPException(400, "Missing image")
+    if need_name and (not name or not str(name).strip()):
+        raise HTTPException(400, "Missing name")
+    return (str(name).strip() if name else None), data, append
+
+
+def create_api(pool: WorkerPool, ui: bool = False):
+    """FastAPI app with the recognition endpoints (and the Gradio UI at /ui if requested)"""
+    @asynccontextmanager
+    async def lifespan(_):
+        pool.start()
+        try:
+            yield
+        finally:
+            pool.shutdown()
+
+    api = FastAPI(title="Face Recognition API", lifespan=lifespan)
+
+    @api.get("/health")
+    async def health():
+        return {"status": "ok", "workers": pool.workers, "running": pool.running, "waiting": pool.waiting}
+
+    @api.get("/metrics")
+    async def metrics_endpoint():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    @api.post("/verify")
+    async def verify(request: Request):
+        _, data, _ = await _read_request(request)
+        with metrics.timer("api_verify"):
+            try:
+                result = await pool.run(verify_job, data)
+            except ValueError as e:
+                raise HTTPException(400, str(e))
+        metrics.inc("api_verify_outcomes_total", outcome=result["outcome"])
+        result["name"] = result["top"][0]["name"] if result["outcome"] in ("granted", "uncertain") else None
+        return result
+
+    @api.post("/register")
+    async def register(request: Request):
+        name, data, append = await _read_request(request, need_name=True)
+        with metrics.timer("api_register"):
+            try:
+                entry, rejection = await pool.run(enroll_job, name, data)
+            except ValueError as e:
+                raise HTTPException(400, str(e))
+            if rejection is not None:
+                return JSONResponse({"registered": False, "reason": rejection}, status_code=422)
+            # Database writes happen here (FaceDatabase serializes them); workers only read
+            await asyncio.get_running_loop().run_in_executor(None, _commit_user, entry, append)
+        return {"registered": True, "name": name, "appended": append}
+
+    @api.get("/users")
+    async def users(response: Response, prefix: str = None, offset: int = 0, limit: int = None):
+        if prefix is None and not offset and limit is None:
+            # Everyone, in registration order
+            rows = await asyncio.get_running_loop().run_in_executor(None, core.db.get_all_users)
+            total = len(rows)
+        else:
+            if offset < 0 or (limit is not None and limit < 0):
+                raise HTTPException(400, "offset and limit must not be negative")
+            total, rows = await asyncio.get_running_loop().run_in_executor(
+                None, core.db.list_users, prefix or "", offset, limit)
+        response.headers["X-Total-Count"] = str(total)
+        return [{"name": name, "registered_at": registered_at} for name, registered_at, _ in rows]
+
+    @api.delete("/users/{name}")
+    async def delete(name: str):
+        deleted = await asyncio.get_running_loop().run_in_executor(None, core.db.delete_user, name)
+        if not deleted:
+            raise HTTPException(404, f"User '{name}' not found")
+        return {"deleted": name}
+
+    @api.post("/users/delete")
+    async def delete_many(request: Request):
+        try:
+            names = (await request.json())["names"]
+        except (ValueError, TypeError, KeyError):
+            raise HTTPException(400, "Expected a JSON body with a 'names' list")
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise HTTPException(400, "Expected a JSON body with a 'names' list")
+        deleted = await asyncio.get_running_loop().run_in_executor(None, core.db.delete_users, names)
+        found = {name.lower() for name in deleted}
+        return {"deleted": deleted, "missing": [name for name in names if name.lower() not in found]}
+
+    if ui:
+        import gradio as gr
+        import app_perfect
+        api = gr.mount_gradio_app(api, app_perfect.app, path="/ui")
+    return api
+
+
+def _commit_user(entry, append=False):
+    core.db.add_users([entry], append=append)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="recognition processes")
+    parser.add_argument("--concurrency", type=int, help="jobs in flight at once (default: workers)")
+    parser.add_argument("--max-queue", type=int, help="requests allowed to wait for a slot before 429")
+    parser.add_argument("--timeout", type=float, default=API_TIMEOUT, help="per-request processing timeout (s)")
+    parser.add_argument("--queue-timeout", type=float, default=API_QUEUE_TIMEOUT, help="max wait for a slot before 503 (s)")
+    parser.add_argument("--ui", action="store_true", help="also serve the Gradio UI at /ui")
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    pool = WorkerPool(args.workers, args.concurrency, args.max_queue, args.timeout, args.queue_timeout)
+    uvicorn.run(create_api(pool, ui=args.ui), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,335 +2,78 @@
 Face Recognition System - Perfect User Flow
 Real auto-capture + Smart registration + Admin panel
 """
-import cv2
-import numpy as np
-import gradio as gr
-import os
+import sys
 import json
-from datetime import datetime
-import warnings
 import logging
+import threading
 import time
-import asyncio
-
-# Suppress warnings
-warnings.filterwarnings("ignore", category=RuntimeWarning)
-logging.getLogger("asyncio").setLevel(logging.ERROR)
-
-# Database Manager
-class FaceDatabase:
-    def __init__(self, db_path: str = "faces.json"):
-        self.db_path = db_path
-        self.data = self.load_database()
-    
-    def load_database(self):
-        if os.path.exists(self.db_path):
-            with open(self.db_path, 'r') as f:
-                return json.load(f)
-        return {"users": []}
-    
-    def save_database(self):
-        with open(self.db_path, 'w') as f:
-            json.dump(self.data, f, indent=2)
-    
-    def add_user(self, name: str, image_path: str, features: dict):
-        # Remove existing user if present (and delete old image)
-        existing_user = next((u for u in self.data["users"] if u["name"].lower() == name.lower()), None)
-        if existing_user and os.path.exists(existing_user["image"]):
-            try:
-                os.remove(existing_user["image"])
-            except:
-                pass
-        
-        self.data["users"] = [u for u in self.data["users"] if u["name"].lower() != name.lower()]
-        
-        # Add new user with pre-computed features
-        self.data["users"].append({
-            "name": name,
-            "image": image_path,
-            "registered_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "features": {
-                "lbp_hist": features["lbp_hist"].tolist(),
-                "hog_hist": features["hog_hist"].tolist(),
-                "color_hist": features["color_hist"].tolist(),
-                "gray_hist": features["gray_hist"].tolist(),
-                "edges_hist": features["edges_hist"].tolist()
-            }
-        })
-        self.save_database()
-    
-    def delete_user(self, name: str):
-        user = next((u for u in self.data["users"] if u["name"] == name), None)
-        if user and os.path.exists(user["image"]):
-            os.remove(user["image"])
-        self.data["users"] = [u for u in self.data["users"] if u["name"] != name]
-        self.save_database()
-    
-    def get_all_users(self):
-        # Reload database to get fresh data
-        self.data = self.load_database()
-        return [(u["name"], u.get("registered_at", "Unknown"), u["image"]) for u in self.data["users"]]
-
-# Initialize
-db = FaceDatabase()
-FACES_DIR = "faces"
-os.makedirs(FACES_DIR, exist_ok=True)
 
-def detect_face(image):
-    """Advanced face detection"""
-    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-    gray = cv2.equalizeHist(gray)
-    
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    
-    # Primary detection
-    faces = face_cascade.detectMultiScale(
-        gray, 
-        scaleFactor=1.05,
-        minNeighbors=5,
-        minSize=(120, 120),
-        flags=cv2.CASCADE_SCALE_IMAGE
-    )
-    
-    # Fallback detection
-    if len(faces) == 0:
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4, minSize=(100, 100))
-    
-    return faces
+_import_start = time.perf_counter()
+import gradio as gr
+_ui_import = time.perf_counter() - _import_start
 
-def extract_advanced_features(face_img):
-    """Extract comprehensive facial features"""
-    face_img = cv2.resize(face_img, (160, 160))
-    gray = cv2.cvtColor(face_img, cv2.COLOR_RGB2GRAY)
-    gray = cv2.equalizeHist(gray)
-    denoised = cv2.fastNlMeansDenoising(gray, None, 10, 7, 21)
-    
-    features = {}
-    
-    # 1. LBP
-    def compute_lbp(img, radius=1):
-        lbp = np.zeros_like(img, dtype=np.uint8)
-        for i in range(radius, img.shape[0]-radius):
-            for j in range(radius, img.shape[1]-radius):
-                center = img[i, j]
-                code = 0
-                points = [
-                    (i-radius, j-radius), (i-radius, j), (i-radius, j+radius),
-                    (i, j+radius), (i+radius, j+radius), (i+radius, j),
-                    (i+radius, j-radius), (i, j-radius)
-                ]
-                for idx, (pi, pj) in enumerate(points):
-                    if img[pi, pj] >= center:
-                        code |= (1 << idx)
-                lbp[i, j] = code
-        return lbp
-    
-    lbp1 = compute_lbp(denoised, 1)
-    lbp2 = compute_lbp(denoised, 2)
-    hist_lbp1 = cv2.calcHist([lbp1], [0], None, [256], [0, 256])
-    hist_lbp2 = cv2.calcHist([lbp2], [0], None, [256], [0, 256])
-    features['lbp_hist'] = np.concatenate([hist_lbp1.flatten(), hist_lbp2.flatten()])
-    features['lbp_hist'] = features['lbp_hist'] / (np.sum(features['lbp_hist']) + 1e-7)
-    
-    # 2. HOG
-    gx = cv2.Sobel(denoised, cv2.CV_32F, 1, 0, ksize=3)
-    gy = cv2.Sobel(denoised, cv2.CV_32F, 0, 1, ksize=3)
-    mag, angle = cv2.cartToPolar(gx, gy, angleInDegrees=True)
-    bins = 36
-    hog_hist = np.zeros(bins)
-    for i in range(angle.shape[0]):
-        for j in range(angle.shape[1]):
-            bin_idx = int(angle[i, j] / (360.0 / bins)) % bins
-            hog_hist[bin_idx] += mag[i, j]
-    features['hog_hist'] = hog_hist / (np.sum(hog_hist) + 1e-7)
-    
-    # 3. Color
-    hsv = cv2.cvtColor(face_img, cv2.COLOR_RGB2HSV)
-    h, w = hsv.shape[:2]
-    regions = [
-        hsv[0:h//2, 0:w//2], hsv[0:h//2, w//2:w],
-        hsv[h//2:h, 0:w//2], hsv[h//2:h, w//2:w], hsv
-    ]
-    color_hists = []
-    for region in regions:
-        hist_h = cv2.calcHist([region], [0], None, [16], [0, 180])
-        hist_s = cv2.calcHist([region], [1], None, [16], [0, 256])
-        color_hists.extend([hist_h.flatten(), hist_s.flatten()])
-    features['color_hist'] = np.concatenate(color_hists)
-    features['color_hist'] = features['color_hist'] / (np.sum(features['color_hist']) + 1e-7)
-    
-    # 4. Gray
-    gray_regions = [
-        gray[0:h//2, 0:w//2], gray[0:h//2, w//2:w],
-        gray[h//2:h, 0:w//2], gray[h//2:h, w//2:w], gray
-    ]
-    gray_hists = []
-    for region in gray_regions:
-        hist = cv2.calcHist([region], [0], None, [32], [0, 256])
-        gray_hists.append(hist.flatten())
-    features['gray_hist'] = np.concatenate(gray_hists)
-    features['gray_hist'] = features['gray_hist'] / (np.sum(features['gray_hist']) + 1e-7)
-    
-    # 5. Edges
-    edges = cv2.Canny(denoised, 50, 150)
-    edge_regions = [
-        edges[0:h//2, 0:w//2], edges[0:h//2, w//2:w],
-        edges[h//2:h, 0:w//2], edges[h//2:h, w//2:w]
-    ]
-    edge_densities = [np.sum(region > 0) / region.size for region in edge_regions]
-    edge_hist = cv2.calcHist([edges], [0], None, [32], [0, 256])
-    features['edges_hist'] = np.concatenate([edge_hist.flatten(), edge_densities])
-    features['edges_hist'] = features['edges_hist'] / (np.sum(features['edges_hist']) + 1e-7)
-    features['face_normalized'] = denoised
-    
-    return features
+_import_start = time.perf_counter()
+import face_core as core
+from face_core import database
+from face_core.metrics import metrics
+from face_core.recognition import (BASE_THRESHOLD, ann_recall_report, prepare_enrollment, verify_image)
+from face_core.streaming import StreamProcessor
+core.record_startup("core_import", time.perf_counter() - _import_start)
+core.record_startup("ui_import", _ui_import)
 
-def compare_advanced_features(feat1, feat2):
-    """Compare features"""
-    scores = []
-    
-    lbp_corr = np.corrcoef(feat1['lbp_hist'], feat2['lbp_hist'])[0, 1]
-    lbp_chi = cv2.compareHist(
-        feat1['lbp_hist'].astype(np.float32).reshape(-1, 1),
-        feat2['lbp_hist'].astype(np.float32).reshape(-1, 1),
-        cv2.HISTCMP_CHISQR
-    )
-    lbp_score = (lbp_corr + (1 - min(lbp_chi / 100, 1))) / 2
-    scores.append(lbp_score * 0.30)
-    
-    hog_corr = np.corrcoef(feat1['hog_hist'], feat2['hog_hist'])[0, 1]
-    scores.append(max(0, hog_corr) * 0.25)
-    
-    color_corr = np.corrcoef(feat1['color_hist'], feat2['color_hist'])[0, 1]
-    scores.append(max(0, color_corr) * 0.15)
-    
-    gray_corr = np.corrcoef(feat1['gray_hist'], feat2['gray_hist'])[0, 1]
-    scores.append(max(0, gray_corr) * 0.10)
-    
-    edges_corr = np.corrcoef(feat1['edges_hist'], feat2['edges_hist'])[0, 1]
-    scores.append(max(0, edges_corr) * 0.10)
-    
-    result = cv2.matchTemplate(
-        feat1['face_normalized'],
-        feat2['face_normalized'],
-        cv2.TM_CCOEFF_NORMED
-    )
-    template_score = max(0, result[0][0])
-    scores.append(template_score * 0.10)
-    
-    final_score = sum(scores)
-    return min(max(final_score, 0), 1)
+# Suppress warnings
+logging.getLogger("asyncio").setLevel(logging.ERROR)
 
 def verify_user_auto(image):
     """Auto-verify after capture with quality checks"""
     if image is None:
         return "⏳ Waiting for capture...", None, gr.update(visible=False), gr.update(visible=False), ""
     
-    # Enhance image quality
-    enhanced_image = enhance_image_quality(image)
-    
-    # Detect face
-    faces = detect_face(enhanced_image)
+    result = verify_image(image)
+    outcome = result["outcome"]
     
-    if len(faces) == 0:
+    if outcome == "no_face":
         return "❌ **NO FACE DETECTED**\n\n💡 Please:\n• Face camera directly\n• Better lighting\n• Position in green guide", None, gr.update(visible=True), gr.update(visible=False), "✅ Ready for capture"
     
-    if len(faces) > 1:
+    if outcome == "multiple_faces":
         return "❌ **MULTIPLE FACES**\n\nOnly one person should be visible.", None, gr.update(visible=True), gr.update(visible=False), "✅ Ready for capture"
     
-    # Extract face
-    (x, y, w, h) = faces[0]
-    face_img = enhanced_image[y:y+h, x:x+w]
-    
-    # Check face size (quality)
-    if w < 150 or h < 150:
+    if outcome == "face_too_small":
+        (x, y, w, h) = result["box"]
         return "❌ **FACE TOO SMALL**\n\nPlease move closer to camera", None, gr.update(visible=True), gr.update(visible=False), f"⚠️ Face Size: {w}x{h} (Need >150x150)"
     
-    # Reload database to get latest users
-    db.data = db.load_database()
-    
-    # Check database
-    if len(db.data["users"]) == 0:
+    if outcome == "no_users":
         return "❓ **NO USERS IN DATABASE**\n\nWould you like to register?", None, gr.update(visible=False), gr.update(visible=True), "✅ Image Quality: Good"
     
-    # Extract features
-    try:
-        captured_features = extract_advanced_features(face_img)
-    except Exception as e:
-        return f"❌ Error: {str(e)}", None, gr.update(visible=True), gr.update(visible=False), "⚠️ Processing Error"
-    
-    # Compare with all users
-    best_match = None
-    best_score = 0
-    all_scores = []
-    
-    for user in db.data["users"]:
-        try:
-            stored_features = {
-                'lbp_hist': np.array(user['features']['lbp_hist']),
-                'hog_hist': np.array(user['features']['hog_hist']),
-                'color_hist': np.array(user['features']['color_hist']),
-                'gray_hist': np.array(user['features']['gray_hist']),
-                'edges_hist': np.array(user['features']['edges_hist'])
-            }
-            
-            if os.path.exists(user['image']):
-                stored_img = cv2.imread(user['image'])
-                stored_img = cv2.cvtColor(stored_img, cv2.COLOR_BGR2RGB)
-                
-                # Enhance stored image too
-                stored_img = enhance_image_quality(stored_img)
-                
-                stored_faces = detect_face(stored_img)
-                
-                if len(stored_faces) > 0:
-                    (sx, sy, sw, sh) = stored_faces[0]
-                    stored_face = stored_img[sy:sy+sh, sx:sx+sw]
-                    stored_face_resized = cv2.resize(stored_face, (160, 160))
-                    stored_gray = cv2.cvtColor(stored_face_resized, cv2.COLOR_RGB2GRAY)
-                    stored_gray = cv2.equalizeHist(stored_gray)
-                    stored_gray = cv2.fastNlMeansDenoising(stored_gray, None, 10, 7, 21)
-                    stored_features['face_normalized'] = stored_gray
-                else:
-                    continue
-            else:
-                continue
-            
-            score = compare_advanced_features(captured_features, stored_features)
-            all_scores.append((user["name"], score))
-            
-            if score > best_score:
-                best_score = score
-                best_match = user["name"]
-        
-        except Exception as e:
-            print(f"Error comparing with {user['name']}: {e}")
-            continue
+    if outcome == "error":
+        return f"❌ Error: {result['error']}", None, gr.update(visible=True), gr.update(visible=False), "⚠️ Processing Error"
     
-    BASE_THRESHOLD = 0.60  # Lowered from 0.68 for better recognition
+    if outcome == "no_match":
+        return "❌ **NO MATCH**", None, gr.update(visible=True), gr.update(visible=True), "✅ Ready for capture"
     
-    if best_score >= BASE_THRESHOLD:
-        confidence = best_score * 100
-        
-        if len(all_scores) >= 2:
-            sorted_scores = sorted(all_scores, key=lambda x: x[1], reverse=True)
-            gap = sorted_scores[0][1] - sorted_scores[1][1]
-            
-            if gap < 0.05:
-                return f"⚠️ **UNCERTAIN**\n\nBest: {best_match} ({confidence:.1f}%)\nToo close to call.", None, gr.update(visible=False), gr.update(visible=False), "✅ Verification Complete"
-        
+    top_matches = result["top"]
+    best_match, best_score = top_matches[0]
+    confidence = best_score * 100
+    
+    if outcome == "uncertain":
+        return f"⚠️ **UNCERTAIN**\n\nBest: {best_match} ({confidence:.1f}%)\nToo close to call.", None, gr.update(visible=False), gr.update(visible=False), "✅ Verification Complete"
+    
+    if outcome == "granted":
         return f"✅ **ACCESS GRANTED**\n\n🎉 Welcome, **{best_match}**!\n\n📊 Confidence: {confidence:.1f}%", best_match, gr.update(visible=False), gr.update(visible=False), f"✅ Verified Successfully"
     
-    else:
-        if all_scores:
-            top_matches = sorted(all_scores, key=lambda x: x[1], reverse=True)[:2]
-            details = "\n".join([f"  • {name}: {score*100:.1f}%" for name, score in top_matches])
-            return f"❌ **NOT RECOGNIZED**\n\n📊 Best matches:\n{details}\n\n🔒 Required: {BASE_THRESHOLD*100:.0f}%", None, gr.update(visible=True), gr.update(visible=True), f"✅ Image Quality: Good"
-        else:
-            return "❌ **NO MATCH**", None, gr.update(visible=True), gr.update(visible=True), "✅ Ready for capture"
+    details = "\n".join([f"  • {name}: {score*100:.1f}%" for name, score in top_matches])
+    return f"❌ **NOT RECOGNIZED**\n\n📊 Best matches:\n{details}\n\n🔒 Required: {BASE_THRESHOLD*100:.0f}%", None, gr.update(visible=True), gr.update(visible=True), f"✅ Image Quality: Good"
 
-def register_user(name, image):
-    """Register new user"""
+REJECTION_MESSAGES = {
+    "no_face": "❌ **NO FACE DETECTED**",
+    "multiple_faces": "❌ **MULTIPLE FACES**",
+    "face_too_small": "❌ **FACE TOO SMALL**"
+}
+
+@metrics.traced("register")
+@metrics.timed("register")
+def register_user(name, image, add_sample=False):
+    """Register new user (or, with add_sample, another photo of an existing one)"""
     if not name or name.strip() == "":
         return "❌ Please enter a name.", gr.update()
     
@@ -338,136 +81,85 @@ def register_user(name, image):
         return "❌ No image captured.", gr.update()
     
     name = name.strip()
-    faces = detect_face(image)
-    
-    if len(faces) == 0:
-        return "❌ **NO FACE DETECTED**", gr.update()
-    
-    if len(faces) > 1:
-        return "❌ **MULTIPLE FACES**", gr.update()
-    
-    (x, y, w, h) = faces[0]
-    face_img = image[y:y+h, x:x+w]
-    
-    if w < 120 or h < 120:
-        return "❌ **FACE TOO SMALL**", gr.update()
-    
     try:
-        features = extract_advanced_features(face_img)
+        entry, rejection = prepare_enrollment(name, image)
     except Exception as e:
+        metrics.outcome("register", "error")
         return f"❌ Error: {str(e)}", gr.update()
     
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{name.replace(' ', '_')}_{timestamp}.jpg"
-    filepath = os.path.join(FACES_DIR, filename)
-    
-    img_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-    cv2.imwrite(filepath, img_bgr)
+    if rejection is not None:
+        metrics.outcome("register", rejection)
+        return REJECTION_MESSAGES[rejection], gr.update()
     
-    db.add_user(name, filepath, features)
+    database.db.add_users([entry], append=add_sample)
+    metrics.outcome("register", "sample_added" if add_sample else "registered")
     
     return f"✅ **REGISTERED!**\n\n👤 {name}\n📸 Saved successfully\n\n🔐 You can now verify!", gr.update(visible=False)
 
-def get_users_list():
-    """Get formatted users list for admin"""
-    users = db.get_all_users()
-    if not users:
-        return "No users registered yet."
-    
-    output = f"**📋 Registered Users ({len(users)}):**\n\n"
-    for i, (name, reg_time, img_path) in enumerate(users, 1):
+ADMIN_PAGE_SIZE = 25  # users rendered per admin page
+
+def get_users_list(prefix="", page=1):
+    """Formatted page of the users list for admin: (markdown, names on the page, page shown)"""
+    prefix = (prefix or "").strip()
+    page = max(1, int(page or 1))
+    total, users = database.db.list_users(prefix, (page - 1) * ADMIN_PAGE_SIZE, ADMIN_PAGE_SIZE)
+    pages = max(1, -(-total // ADMIN_PAGE_SIZE))
+    if page > pages:
+        page = pages
+        total, users = database.db.list_users(prefix, (page - 1) * ADMIN_PAGE_SIZE, ADMIN_PAGE_SIZE)
+    if not total:
+        return (f"No users matching '{prefix}'." if prefix else "No users registered yet."), [], page
+    
+    matching = f" matching '{prefix}'" if prefix else ""
+    output = f"**📋 Registered Users{matching} ({total}) - page {page} of {pages}:**\n\n"
+    first = (page - 1) * ADMIN_PAGE_SIZE + 1
+    for i, (name, reg_time, img_path) in enumerate(users, first):
         output += f"{i}. **{name}**\n   📅 Registered: {reg_time}\n\n"
-    return output
+    return output, [name for name, _, _ in users], page
 
-def delete_user_func(name):
-    """Delete user from admin panel"""
-    if not name:
-        return "❌ Please enter a name to delete.", gr.update()
-    
-    user = next((u for u in db.data["users"] if u["name"] == name), None)
-    if not user:
-        return f"❌ User '{name}' not found.", gr.update()
-    
-    db.delete_user(name)
-    return f"✅ User '{name}' deleted successfully.", get_users_list()
+def show_users_page(prefix, page):
+    """Admin listing outputs: page markdown, selectable names, page number"""
+    output, names, page = get_users_list(prefix, page)
+    return output, gr.update(choices=names, value=[]), page
+
+def delete_user_func(names_text, selected, prefix, page):
+    """Delete the typed (one per line) and selected users from admin panel"""
+    names = [name.strip() for name in (names_text or "").splitlines() if name.strip()] + list(selected or [])
+    if not names:
+        return ("❌ Please enter or select a name to delete.",) + show_users_page(prefix, page)
+    
+    deleted = database.db.delete_users(names)
+    missing = sorted({name for name in names if name.lower() not in {d.lower() for d in deleted}})
+    if not deleted:
+        message = f"❌ User '{missing[0]}' not found." if len(missing) == 1 else f"❌ Users not found: {', '.join(missing)}"
+    else:
+        message = f"✅ Deleted {len(deleted)} user(s): {', '.join(deleted)}"
+        if missing:
+            message += f"\n\n❌ Not found: {', '.join(missing)}"
+    return (message,) + show_users_page(prefix, page)
 
 # Auto-capture state
 auto_capture_active = False
 
-def stream_feedback(image):
-    """Provide real-time feedback on camera stream"""
+@metrics.timed("stream_feedback")
+def stream_feedback(image, processor=None):
+    """Provide real-time feedback on camera stream
+    
+    `processor` is the per-session StreamProcessor (kept in a gr.State).
+    """
+    if processor is None:
+        processor = StreamProcessor()
     if image is None:
-        return "💡 Waiting for camera..."
-    
-    # Enhance image quality
-    enhanced_image = enhance_image_quality(image)
-    
-    # Detect face
-    faces = detect_face(enhanced_image)
-    
-    if len(faces) == 0:
-        return "❌ No face detected - Position yourself in frame"
-    
-    if len(faces) > 1:
-        return "⚠️ Multiple faces detected - Only one person should be visible"
-    
-    # Extract face
-    (x, y, w, h) = faces[0]
-    
-    # Check face size
-    if w < 150 or h < 150:
-        return f"⚠️ Face too small ({w}x{h}) - Move closer to camera"
-    
-    # Check blur
-    face_img = enhanced_image[y:y+h, x:x+w]
-    gray_face = cv2.cvtColor(face_img, cv2.COLOR_RGB2GRAY)
-    blur_score = cv2.Laplacian(gray_face, cv2.CV_64F).var()
-    
-    if blur_score < 100:
-        return f"⚠️ Image blurry (score: {blur_score:.0f}) - Hold still"
+        return "💡 Waiting for camera...", processor
     
-    # Check brightness
-    brightness = np.mean(gray_face)
-    if brightness < 60:
-        return "⚠️ Too dark - Improve lighting"
-    if brightness > 200:
-        return "⚠️ Too bright - Reduce lighting"
-    
-    # All checks passed
-    return f"✅ Face detected! Good quality - Click 'Capture & Verify' (Face: {w}x{h}, Clarity: {blur_score:.0f})"
-
-def detect_blur(image):
-    """Detect if image is blurry using Laplacian variance"""
-    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-    return laplacian_var
-
-def enhance_image_quality(image):
-    """Enhance image for better recognition"""
-    # Convert to LAB color space
-    lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB)
-    l, a, b = cv2.split(lab)
-    
-    # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-    l = clahe.apply(l)
-    
-    # Merge channels
-    enhanced_lab = cv2.merge([l, a, b])
-    enhanced = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2RGB)
-    
-    # Denoise
-    enhanced = cv2.fastNlMeansDenoisingColored(enhanced, None, 10, 10, 7, 21)
-    
-    # Sharpen
-    kernel = np.array([[-1,-1,-1],
-                       [-1, 9,-1],
-                       [-1,-1,-1]])
-    enhanced = cv2.filter2D(enhanced, -1, kernel)
-    
-    return enhanced
+    status = processor.process(image)
+    stats = processor.stats()
+    if stats["p50_ms"] is not None:
+        status += f"\n\n⏱️ {stats['p50_ms']:.0f} ms/frame · {stats['drop_rate']*100:.0f}% frames skipped"
+    return status, processor
 
 # Create Gradio Interface
+_ui_start = time.perf_counter()
 with gr.Blocks(title="Face Recognition", theme=gr.themes.Soft(), css="""
     .big-button { 
         font-size: 18px !important; 
@@ -532,6 +224,7 @@ with gr.Blocks(title="Face Recognition", theme=gr.themes.Soft(), css="""
                     capture_btn = gr.Button("🎯 Capture & Verify", variant="primary", size="lg", elem_classes=["big-button"])
                     
                     quality_status = gr.Markdown("💡 **Tip:** Click 'Capture & Verify' when your face is aligned", elem_classes=["status-good"])
+                    stream_state = gr.State(None)
                 
                 with gr.Column(scale=1):
                     result_box = gr.Markdown("", label="Result")
@@ -547,6 +240,10 @@ with gr.Blocks(title="Face Recognition", theme=gr.themes.Soft(), css="""
                             label="Enter Your Full Name",
                             placeholder="e.g., John Smith"
                         )
+                        reg_add_sample = gr.Checkbox(
+                            label="Add as another photo of an existing user",
+                            value=False
+                        )
                         reg_btn = gr.Button("✅ Register Me", variant="primary", size="lg")
                         reg_result = gr.Markdown("")
             
@@ -573,25 +270,34 @@ with gr.Blocks(title="Face Recognition", theme=gr.themes.Soft(), css="""
             
             with gr.Row():
                 with gr.Column():
-                    users_display = gr.Markdown(value=get_users_list())
-                    refresh_btn = gr.Button("🔄 Refresh List", variant="secondary")
+                    with gr.Row():
+                        users_search = gr.Textbox(label="Search", placeholder="Name starts with...")
+                        users_page = gr.Number(value=1, precision=0, label="Page", minimum=1)
+                    users_display = gr.Markdown("")
+                    with gr.Row():
+                        prev_btn = gr.Button("◀ Previous", variant="secondary")
+                        refresh_btn = gr.Button("🔄 Refresh List", variant="secondary")
+                        next_btn = gr.Button("Next ▶", variant="secondary")
                 
                 with gr.Column():
-                    gr.Markdown("### ➖ Delete User")
+                    gr.Markdown("### ➖ Delete Users")
+                    delete_selected = gr.CheckboxGroup(label="Select users on this page", choices=[])
                     delete_name = gr.Textbox(
-                        label="User Name to Delete",
-                        placeholder="Enter exact name"
+                        label="User Names to Delete",
+                        placeholder="One name per line",
+                        lines=3
                     )
-                    delete_btn = gr.Button("🗑️ Delete User", variant="stop")
+                    delete_btn = gr.Button("🗑️ Delete Users", variant="stop")
                     delete_result = gr.Markdown("")
     
     # Event Handlers
     # Real-time feedback on camera stream
     user_camera.stream(
         fn=stream_feedback,
-        inputs=[user_camera],
-        outputs=[quality_status],
-        show_progress=False
+        inputs=[user_camera, stream_state],
+        outputs=[quality_status, stream_state],
+        show_progress=False,
+        concurrency_limit=1
     )
     
     # Capture button triggers verification
@@ -608,22 +314,83 @@ with gr.Blocks(title="Face Recognition", theme=gr.themes.Soft(), css="""
     
     reg_btn.click(
         fn=register_user,
-        inputs=[reg_name_input, user_camera],
+        inputs=[reg_name_input, user_camera, reg_add_sample],
         outputs=[reg_result, register_box]
     )
     
+    # Admin listing: only the visible page is rendered, first on page load
+    listing = [users_display, delete_selected, users_page]
+    app.load(
+        fn=show_users_page,
+        inputs=[users_search, users_page],
+        outputs=listing
+    )
     refresh_btn.click(
-        fn=get_users_list,
-        outputs=[users_display]
+        fn=show_users_page,
+        inputs=[users_search, users_page],
+        outputs=listing
+    )
+    users_search.submit(
+        fn=lambda prefix: show_users_page(prefix, 1),
+        inputs=[users_search],
+        outputs=listing
+    )
+    users_page.submit(
+        fn=show_users_page,
+        inputs=[users_search, users_page],
+        outputs=listing
+    )
+    prev_btn.click(
+        fn=lambda prefix, page: show_users_page(prefix, (page or 1) - 1),
+        inputs=[users_search, users_page],
+        outputs=listing
+    )
+    next_btn.click(
+        fn=lambda prefix, page: show_users_page(prefix, (page or 1) + 1),
+        inputs=[users_search, users_page],
+        outputs=listing
     )
     
     delete_btn.click(
         fn=delete_user_func,
-        inputs=[delete_name],
-        outputs=[delete_result, users_display]
+        inputs=[delete_name, delete_selected, users_search, users_page],
+        outputs=[delete_result] + listing
     )
+core.record_startup("ui_build", time.perf_counter() - _ui_start)
+
+def create_server():
+    """FastAPI app serving the Gradio UI at / and Prometheus metrics at /metrics"""
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+    
+    server = FastAPI()
+    
+    @server.get("/metrics")
+    def metrics_endpoint():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+    
+    app.show_error = True
+    return gr.mount_gradio_app(server, app, path="/")
 
 if __name__ == "__main__":
+    if "--migrate-templates" in sys.argv:
+        # One-shot migration of faces.json entries registered before the template cache
+        rebuilt = database.db.refresh_templates()
+        print(f"✅ Templates ready for {len(database.db.data['users'])} users ({rebuilt} built)")
+        sys.exit(0)
+    
+    if "--ann-report" in sys.argv:
+        print(json.dumps(ann_recall_report(), indent=2))
+        sys.exit(0)
+    
+    if "--compact-report" in sys.argv:
+        print(json.dumps(core.compact_report(), indent=2))
+        sys.exit(0)
+    
+    if "--probe-cache-report" in sys.argv:
+        print(json.dumps(core.probe_cache_report(), indent=2))
+        sys.exit(0)
+    
     print("=" * 60)
     print("🔐 FACE RECOGNITION SYSTEM")
     print("=" * 60)
@@ -633,11 +400,15 @@ if __name__ == "__main__":
     print("=" * 60)
     print("🌐 Starting...")
     print("🏠 http://127.0.0.1:7860")
+    print("📈 http://127.0.0.1:7860/metrics")
     print("=" * 60)
     
-    app.launch(
-        server_name="127.0.0.1", 
-        server_port=7860,
-        inbrowser=True,
-        show_error=True
-    )
+    # Pay for the first-use work now rather than on the first capture
+    core.warm_up()
+    print("⏱️ Startup: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in core.STARTUP.items()))
+    
+    # Gradio UI at / and Prometheus metrics at /metrics on the same server
+    import uvicorn
+    import webbrowser
+    threading.Timer(1.5, webbrowser.open, args=("http://127.0.0.1:7860",)).start()
+    uvicorn.run(create_server(), host="127.0.0.1", port=7860, log_level="warning")
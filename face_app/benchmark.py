@@ -0,0 +1,943 @@
+"""
+Headless benchmarks for the recognition pipeline
+No webcam or browser needed: python benchmark.py detect --images <dir>
+                               python benchmark.py enhance --images <dir>
+                               python benchmark.py suite [--baseline old.json]
+                               python benchmark.py startup
+                               python benchmark.py hammer [--processes 4 --threads 2]
+                               python benchmark.py compact [--users 1000]
+                               python benchmark.py shards [--users 20000 --max-workers 8]
+                               python benchmark.py cascade [--sizes 100 1000 10000]
+                               python benchmark.py crowd [--counts 1 2 4 8]
+                               python benchmark.py frames [--repeat 20]
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows: no peak RSS, tracemalloc peaks are still reported
+    resource = None
+
+import cv2
+import numpy as np
+
+import face_core as core
+
+
+def _legacy_detect_face(image):
+    """detect_face as it was before FaceDetector (baseline for comparisons)"""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    gray = cv2.equalizeHist(gray)
+    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.05, minNeighbors=5, minSize=(120, 120), flags=cv2.CASCADE_SCALE_IMAGE)
+    if len(faces) == 0:
+        faces = face_cascade.detectMultiScale(gray, 1.1, 4, minSize=(100, 100))
+    return faces
+
+
+def load_images(directory):
+    """All images in a directory as RGB arrays, with their file names"""
+    paths = sorted(
+        path for pattern in ("*.jpg", "*.jpeg", "*.png", "*.bmp")
+        for path in glob.glob(os.path.join(directory, pattern))
+    )
+    images = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is not None:
+            images.append((os.path.basename(path), cv2.cvtColor(image, cv2.COLOR_BGR2RGB)))
+    return images
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = inter_w * inter_h
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def _timed(fn, *args, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return result, float(np.median(times))
+
+
+def _matched(boxes, reference):
+    """Number of reference boxes overlapped (IoU >= 0.5) by one of `boxes`"""
+    return sum(any(_iou(r, b) >= 0.5 for b in boxes) for r in reference)
+
+
+def bench_detect(images, truth=None, repeat=3, detector=None):
+    """Latency and accuracy of detect_face vs the legacy detector
+
+    With `truth` (image name -> list of [x, y, w, h]) both detectors are
+    scored against it; otherwise the new boxes are compared with the legacy
+    ones. A box matches when IoU >= 0.5.
+    """
+    detect = detector.detect if detector is not None else core.detect_face
+    legacy_ms, current_ms, rows = [], [], []
+    for name, image in images:
+        reference, legacy_time = _timed(_legacy_detect_face, image, repeat=repeat)
+        faces, current_time = _timed(detect, image, repeat=repeat)
+        legacy_ms.append(legacy_time * 1000)
+        current_ms.append(current_time * 1000)
+        row = {
+            "image": name,
+            "legacy_faces": len(reference),
+            "faces": len(faces),
+            "legacy_ms": round(legacy_ms[-1], 2),
+            "ms": round(current_ms[-1], 2)
+        }
+        if truth is not None:
+            expected = truth.get(name, [])
+            row["true_faces"] = len(expected)
+            row["legacy_hits"] = _matched(reference, expected)
+            row["hits"] = _matched(faces, expected)
+        else:
+            row["matched_legacy"] = _matched(faces, reference)
+        rows.append(row)
+
+    report = {
+        "images": len(rows),
+        "legacy_p50_ms": float(np.median(legacy_ms)) if rows else None,
+        "p50_ms": float(np.median(current_ms)) if rows else None,
+        "legacy_mean_ms": float(np.mean(legacy_ms)) if rows else None,
+        "mean_ms": float(np.mean(current_ms)) if rows else None,
+        "speedup": float(np.median(legacy_ms) / np.median(current_ms)) if rows else None,
+    }
+    if truth is not None:
+        true_faces = sum(r["true_faces"] for r in rows)
+        for prefix, hits, found in (("legacy_", "legacy_hits", "legacy_faces"), ("", "hits", "faces")):
+            tp = sum(r[hits] for r in rows)
+            report[prefix + "recall"] = tp / true_faces if true_faces else None
+            report[prefix + "false_positives"] = sum(r[found] - r[hits] for r in rows)
+    else:
+        # Legacy detections with no overlapping new box
+        report["missed_vs_legacy"] = sum(r["legacy_faces"] - r["matched_legacy"] for r in rows)
+        report["same_face_count"] = sum(r["legacy_faces"] == r["faces"] for r in rows)
+    report["per_image"] = rows
+    return report
+
+
+def _mode_features(image, mode):
+    """(probe features, gallery template) of the first face under an enhancement mode"""
+    faces, source = core.detect_faces(image, mode)
+    if len(faces) == 0:
+        return None, None
+    face_img = core.face_crop(source, faces[0], mode)
+    return core.extract_advanced_features(face_img), core.normalize_face(face_img)
+
+
+def bench_enhance(images, modes=("legacy", "tiered")):
+    """Latency and recognition scores of enhancement modes against the first one
+
+    Every image is enrolled (register path, unenhanced histograms, template
+    from the mode) and probed (verify path) under each mode; the resulting
+    probe x gallery score matrices are compared with the baseline mode's.
+    """
+    baseline = modes[0]
+    per_mode = {}
+    for mode in modes:
+        probes, templates, hists, latencies = [], [], [], []
+        for _, image in images:
+            start = time.perf_counter()
+            features, template = _mode_features(image, mode)
+            latencies.append((time.perf_counter() - start) * 1000)
+            enrolled, _ = _mode_features(image, "none")
+            probes.append(features)
+            templates.append(template if enrolled is not None else None)
+            hists.append(enrolled)
+        per_mode[mode] = {"probes": probes, "templates": templates, "hists": hists, "ms": latencies}
+
+    # Only images every mode found a face in, so the matrices line up
+    usable = [i for i in range(len(images))
+              if all(per_mode[m]["probes"][i] is not None and per_mode[m]["templates"][i] is not None for m in modes)]
+    report = {"images": len(images), "usable": len(usable), "modes": {}}
+    matrices = {}
+    for mode in modes:
+        data = per_mode[mode]
+        if usable:
+            gallery = {field: np.stack([np.asarray(data["hists"][i][field]).ravel() for i in usable])
+                       for field in core.FaceDatabase.HIST_FIELDS}
+            gallery["face_normalized"] = np.stack([data["templates"][i] for i in usable])
+            gallery["face_normalized_norm"] = core.centered_norms(gallery["face_normalized"])
+            matrices[mode] = np.stack([
+                core.score_gallery(data["probes"][i], gallery) for i in usable
+            ])
+        latencies = np.array(data["ms"])
+        report["modes"][mode] = {
+            "faces_found": sum(p is not None for p in data["probes"]),
+            "p50_ms": float(np.median(latencies)) if len(latencies) else None,
+            "mean_ms": float(np.mean(latencies)) if len(latencies) else None,
+        }
+
+    for mode in modes[1:]:
+        entry = report["modes"][mode]
+        entry["speedup"] = (report["modes"][baseline]["p50_ms"] / entry["p50_ms"]) if entry["p50_ms"] else None
+        if not usable:
+            continue
+        diff = np.abs(matrices[mode] - matrices[baseline])
+        entry["score_mean_abs_diff"] = float(diff.mean())
+        entry["score_max_abs_diff"] = float(diff.max())
+        entry["genuine_mean_score"] = float(np.mean(np.diag(matrices[mode])))
+        entry["baseline_genuine_mean_score"] = float(np.mean(np.diag(matrices[baseline])))
+        entry["rank1_agreement"] = float(np.mean(matrices[mode].argmax(axis=1) == matrices[baseline].argmax(axis=1)))
+        entry["decision_agreement"] = float(np.mean((matrices[mode] >= core.BASE_THRESHOLD) == (matrices[baseline] >= core.BASE_THRESHOLD)))
+    return report
+
+
+SUITE_SIZES = (1, 10, 100, 1000, 10000)
+SUITE_METRIC = "p50_ms"        # compared by the regression gate
+SUITE_MAX_REGRESSION = 0.25    # fail when a stage is more than 25% slower than the baseline
+SUITE_MIN_DELTA_MS = 0.5       # ...and slower by at least this much (sub-ms stages are noisy)
+
+
+def synthetic_face(seed, size=480):
+    """RGB frame with one drawn face the Haar cascade detects
+
+    Skin-toned ellipse with darker eye, brow and mouth regions on a flat
+    background, blurred and with sensor-like noise. Seeds vary the colours,
+    position and face size.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((size, size, 3), rng.integers(40, 120, 3), np.uint8)
+    cx, cy = size // 2 + int(rng.integers(-20, 20)), size // 2 + int(rng.integers(-20, 20))
+    fw = int(size * rng.uniform(0.2, 0.26))
+    fh = int(fw * 1.3)
+    skin = np.array(rng.integers([170, 130, 100], [235, 190, 160]), dtype=float)
+    cv2.ellipse(image, (cx, cy), (fw, fh), 0, 0, 360, tuple(skin), -1)
+    ey, ex = cy - fh // 5, int(fw * 0.42)
+    for side in (-1, 1):
+        cv2.ellipse(image, (cx + side * ex, ey), (fw // 4, fw // 8), 0, 0, 360, tuple(skin * 0.35), -1)
+        cv2.ellipse(image, (cx + side * ex, ey - fw // 4), (fw // 4, fw // 16), 0, 0, 360, tuple(skin * 0.3), -1)
+    cv2.ellipse(image, (cx, cy + fh // 10), (fw // 10, fh // 6), 0, 0, 360, tuple(skin * 0.85), -1)
+    cv2.ellipse(image, (cx, cy + fh // 2 - fh // 6), (fw // 3, fw // 9), 0, 0, 360, tuple(skin * 0.45), -1)
+    image = cv2.GaussianBlur(image, (0, 0), size / 160)
+    return np.clip(image + rng.normal(0, 6, image.shape), 0, 255).astype(np.uint8)
+
+
+def synthetic_faces(n, size=480, seed=0):
+    return [(f"synthetic_{seed + i:04d}.png", synthetic_face(seed + i, size)) for i in range(n)]
+
+
+def _summary(times_ms):
+    times_ms = np.asarray(times_ms, dtype=np.float64)
+    return {
+        "n": int(len(times_ms)),
+        "p50_ms": float(np.percentile(times_ms, 50)),
+        "p95_ms": float(np.percentile(times_ms, 95)),
+        "p99_ms": float(np.percentile(times_ms, 99)),
+        "mean_ms": float(times_ms.mean()),
+        "throughput_per_s": float(1000.0 / times_ms.mean()) if times_ms.mean() > 0 else None,
+    }
+
+
+def _measure(fn, inputs, warmup=1):
+    """Latency summary of fn over inputs, plus the traced allocation peak of one call
+
+    tracemalloc sees Python and numpy allocations, including the arrays
+    OpenCV returns, but not OpenCV's internal scratch memory. It runs in a
+    separate untimed call so it does not skew the latencies.
+    """
+    for item in inputs[:warmup]:
+        fn(item)
+    times = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        times.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    try:
+        fn(inputs[0])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    report = _summary(times)
+    report["peak_alloc_mb"] = peak / 2 ** 20
+    return report
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _face_crops(frames):
+    crops = []
+    for _, frame in frames:
+        faces = core.detect_face(frame)
+        if len(faces):
+            x, y, w, h = faces[0]
+            crops.append(frame[y:y+h, x:x+w])
+    return crops
+
+
+def _jittered(features, rng, noise=0.15):
+    """Another synthetic identity close to `features`"""
+    record = {}
+    for field in core.FaceDatabase.HIST_FIELDS:
+        hist = np.asarray(features[field], dtype=np.float64).ravel()
+        hist = hist * rng.uniform(1 - noise, 1 + noise, hist.shape)
+        record[field] = hist / (hist.sum() + 1e-7)
+    face = features["face_normalized"].astype(np.int16) + rng.integers(-25, 26, features["face_normalized"].shape)
+    record["face_normalized"] = np.clip(face, 0, 255).astype(np.uint8)
+    return record
+
+
+class SyntheticGallery:
+    """Temporary FaceDatabase of up to max(sizes) synthetic users
+
+    Users are jittered copies of the enrolled sample faces, all sharing the
+    sample images (with valid templates), so building a 10k gallery does not
+    need 10k feature extractions. `use(n)` exposes the first n users as the
+    app's database.
+    """
+    def __init__(self, frames, max_users, seed=0):
+        self.root = tempfile.mkdtemp(prefix="face_bench_")
+        self.db = core.FaceDatabase(os.path.join(self.root, "faces.json"), os.path.join(self.root, "gallery"))
+        rng = np.random.default_rng(seed)
+        samples = []
+        for i, (_, frame) in enumerate(frames):
+            path = os.path.join(self.root, f"sample_{i}.jpg")
+            cv2.imwrite(path, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+            meta, face_normalized = core.build_template(path)
+            faces = core.detect_face(frame)
+            if face_normalized is None or len(faces) == 0:
+                continue
+            x, y, w, h = faces[0]
+            features = core.extract_advanced_features(frame[y:y+h, x:x+w])
+            features["face_normalized"] = face_normalized
+            samples.append((path, meta, features))
+        if not samples:
+            raise RuntimeError("No face found in any sample image, cannot build a gallery")
+
+        records, self.users = [], []
+        for i in range(max_users):
+            path, meta, features = samples[i % len(samples)]
+            records.append(_jittered(features, rng) if i >= len(samples) else
+                           {field: features[field] for field in core.FaceDatabase.HIST_FIELDS + ("face_normalized",)})
+            self.users.append({"name": f"user{i:05d}", "image": path, "registered_at": "benchmark", "template": dict(meta)})
+        for user, row in zip(self.users, self.db.store.append_many(records)):
+            user["row"] = row
+
+    def use(self, n_users):
+        self.db.data = dict(self.db.data, users=self.users[:n_users])
+        self.db.save_database()
+        core.database.db = self.db
+
+    def close(self):
+        self.db.store = None
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def bench_suite(frames, sizes=SUITE_SIZES, verify_repeat=5):
+    """Per-stage latency, throughput and memory of the whole pipeline
+
+    Stages run on the given frames (and their face crops); the gallery scan
+    and end-to-end verify_image run once per gallery size.
+    """
+    crops = _face_crops(frames)
+    if not crops:
+        raise RuntimeError("No face found in the benchmark images")
+    images = [frame for _, frame in frames]
+    features = [core.extract_advanced_features(crop) for crop in crops]
+    normalized = []
+    for crop in crops:
+        face = cv2.equalizeHist(cv2.cvtColor(cv2.resize(crop, (160, 160)), cv2.COLOR_RGB2GRAY))
+        normalized.append((cv2.resize(crop, (160, 160)), face, cv2.fastNlMeansDenoising(face, None, 10, 7, 21)))
+    pairs = [(features[i], features[(i + 1) % len(features)]) for i in range(len(features))]
+
+    stages = {
+        "detect_face": _measure(core.detect_face, images),
+        "enhance_fast_frame": _measure(lambda image: core.enhance_image_quality(image, "fast"), images),
+        "enhance_full_frame": _measure(core.enhance_image_quality, images),
+        "enhance_full_crop": _measure(core.enhance_image_quality, crops),
+        "extract": _measure(core.extract_advanced_features, crops),
+        "extract.nlm": _measure(lambda item: cv2.fastNlMeansDenoising(item[1], None, 10, 7, 21), normalized),
+        "extract.lbp": _measure(lambda item: core.lbp_features(item[2]), normalized),
+        "extract.hog": _measure(lambda item: core.hog_features(item[2]), normalized),
+        "extract.color": _measure(lambda item: core.color_features(item[0]), normalized),
+        "extract.gray": _measure(lambda item: core.gray_features(item[1]), normalized),
+        "extract.edges": _measure(lambda item: core.edge_features(item[2]), normalized),
+        "compare": _measure(lambda pair: core.compare_advanced_features(*pair), pairs),
+    }
+
+    # The app database, only if something already opened it
+    app_db = vars(core.database).get("db")
+    gallery = SyntheticGallery(frames, max(sizes))
+    # Repeated frames would otherwise be answered by the probe cache
+    cache_ttl, core.probe_cache.probe_cache.ttl = core.probe_cache.probe_cache.ttl, 0
+    try:
+        for n_users in sizes:
+            gallery.use(n_users)
+            matrices = gallery.db.gallery()
+            rows = np.array([u["row"] for u in gallery.db.data["users"]])
+            stages[f"score_gallery@{n_users}"] = _measure(lambda probe: core.score_gallery(probe, matrices, rows), features)
+            verify = _measure(core.verify_image, (images * verify_repeat)[:max(verify_repeat, len(images))])
+            verify["gallery_size"] = n_users
+            stages[f"verify@{n_users}"] = verify
+    finally:
+        core.probe_cache.probe_cache.ttl = cache_ttl
+        if app_db is None:
+            vars(core.database).pop("db", None)
+        else:
+            core.database.db = app_db
+        gallery.close()
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "images": len(images),
+        "faces": len(crops),
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": stages,
+    }
+
+
+def gate(report, baseline, metric=SUITE_METRIC, max_regression=SUITE_MAX_REGRESSION, min_delta_ms=SUITE_MIN_DELTA_MS):
+    """Stages slower than the baseline report by more than max_regression (and min_delta_ms)"""
+    failures = []
+    for name, stage in report["stages"].items():
+        before = baseline.get("stages", {}).get(name, {}).get(metric)
+        current = stage.get(metric)
+        if before and current is not None and current > before * (1 + max_regression) and current - before >= min_delta_ms:
+            failures.append({"stage": name, "baseline": before, "current": current,
+                             "regression": current / before - 1})
+    return failures
+
+
+# Run in a fresh interpreter by bench_startup: "core" imports the headless
+# core and warms it up, "ui" builds the Gradio app and its server first
+_STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+phases = {}
+if sys.argv[1] == "ui":
+    import app_perfect
+    step = time.perf_counter()
+    app_perfect.create_server()
+    phases["create_server"] = time.perf_counter() - step
+import face_core as core
+phases["import"] = time.perf_counter() - start
+core.warm_up()
+phases.update(core.STARTUP, ready=time.perf_counter() - start)
+print(json.dumps({"phases": phases, "gradio_imported": "gradio" in sys.modules}))
+"""
+
+
+def bench_startup(repeat=5, data_dir=None):
+    """Cold-start time of the headless core and of the UI, each in fresh interpreters
+
+    Phases are seconds from the probe's first line: "import" (everything
+    imported), the STARTUP phases recorded by face_core and app_perfect, and
+    "ready" (warm-up done); "process" is the whole interpreter run. The
+    probes run in `data_dir`, whose gallery the warm-up loads (default: an
+    empty temporary directory).
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    workdir = data_dir or tempfile.mkdtemp(prefix="startup_")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (here, os.environ.get("PYTHONPATH")))))
+    report = {"repeat": repeat, "targets": {}}
+    try:
+        for target in ("core", "ui"):
+            runs, gradio_imported = [], False
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = subprocess.run([sys.executable, "-c", _STARTUP_PROBE, target], cwd=workdir, env=env,
+                                        capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise RuntimeError(f"{target} startup probe failed:\n{result.stderr[-2000:]}")
+                probe = json.loads(result.stdout.strip().splitlines()[-1])
+                runs.append(dict(probe["phases"], process=time.perf_counter() - start))
+                gradio_imported |= probe["gradio_imported"]
+            report["targets"][target] = {
+                "gradio_imported": gradio_imported,
+                "phases": {phase: {"p50_ms": float(np.percentile([run[phase] * 1000 for run in runs], 50)),
+                                   "max_ms": float(max(run[phase] * 1000 for run in runs))}
+                           for phase in runs[0]}
+            }
+    finally:
+        if not data_dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def bench_cascade(frames, sizes=(100, 1000, 10000), top_k=3):
+    """Cascaded vs full gallery scan: latency, work skipped and agreement, per gallery size
+
+    Probes are the sample faces (enrolled, high scores) and unseen faces
+    (low scores). "identical" counts probes whose top-k and gap equal the
+    full scan's. The floor variant also drops rows that cannot reach
+    BASE_THRESHOLD - UNCERTAIN_GAP; it only has to keep the decisions.
+    """
+    unseen = synthetic_faces(len(frames), seed=1000)
+    probes = [core.extract_advanced_features(crop) for crop in _face_crops(frames) + _face_crops(unseen)]
+    if not probes:
+        raise RuntimeError("No face found in the benchmark images")
+    floor = core.BASE_THRESHOLD - core.UNCERTAIN_GAP
+
+    def decision(match):
+        return core.decide(match["top"][0][1], match["gap"]) if match["top"] else "not_recognized"
+
+    app_db = vars(core.database).get("db")
+    gallery = SyntheticGallery(frames, max(sizes))
+    report = {"probes": len(probes), "top_k": top_k, "floor": floor, "sizes": {}}
+    try:
+        for n_users in sizes:
+            gallery.use(n_users)
+            matrices = gallery.db.gallery()
+            rows = np.array([u["row"] for u in gallery.db.data["users"]])
+            full = [core.match_gallery(probe, matrices, rows, top_k=top_k) for probe in probes]
+            cascade = [core.match_gallery_cascade(probe, matrices, rows, top_k=top_k) for probe in probes]
+            floored = [core.match_gallery_cascade(probe, matrices, rows, top_k=top_k, floor=floor) for probe in probes]
+            report["sizes"][n_users] = {
+                "full": _measure(lambda probe: core.match_gallery(probe, matrices, rows, top_k=top_k), probes),
+                "cascade": _measure(lambda probe: core.match_gallery_cascade(probe, matrices, rows, top_k=top_k),
+                                    probes),
+                "work_skipped": float(np.mean([match["work_skipped"] for match in cascade])),
+                "identical": sum(a["top"] == b["top"] and a["gap"] == b["gap"] for a, b in zip(full, cascade)),
+                "floor_work_skipped": float(np.mean([match["work_skipped"] for match in floored])),
+                "floor_same_decisions": sum(decision(a) == decision(b) for a, b in zip(full, floored)),
+            }
+    finally:
+        if app_db is None:
+            vars(core.database).pop("db", None)
+        else:
+            core.database.db = app_db
+        gallery.close()
+    return report
+
+
+def bench_shards(frames, n_users=20000, max_workers=None, repeat=5):
+    """Latency of one exact gallery scan, in-process and sharded over 1..max_workers processes
+
+    Speedups are relative to the in-process match_gallery scan; "agrees"
+    checks that the sharded top-k is the in-process one.
+    """
+    crops = _face_crops(frames)
+    if not crops:
+        raise RuntimeError("No face found in the benchmark images")
+    probes = [core.extract_advanced_features(crop) for crop in crops] * repeat
+    max_workers = max_workers or os.cpu_count() or 1
+    app_db = vars(core.database).get("db")
+    gallery = SyntheticGallery(frames, n_users)
+    try:
+        gallery.use(n_users)
+        db = gallery.db
+        rows = np.array([u["row"] for u in db.data["users"]])
+        matrices = db.gallery()
+        expected = [core.match_gallery(probe, matrices, rows, top_k=5)["top"] for probe in probes[:len(crops)]]
+        report = {"users": n_users, "cpus": os.cpu_count(), "probes": len(probes),
+                  "in_process": _measure(lambda probe: core.match_gallery(probe, matrices, rows, top_k=5), probes),
+                  "workers": {}}
+        baseline = report["in_process"]["p50_ms"]
+        for workers in range(1, max_workers + 1):
+            scorer = core.ShardedScorer(workers, db)
+            try:
+                scorer.warm_up()
+                timing = _measure(lambda probe: scorer.match(probe, rows, top_k=5), probes)
+                timing["speedup"] = baseline / timing["p50_ms"]
+                tops = [scorer.match(probe, rows, top_k=5)["top"] for probe in probes[:len(crops)]]
+                timing["agrees"] = all([pos for pos, _ in a] == [pos for pos, _ in b] and np.allclose(
+                    [score for _, score in a], [score for _, score in b]) for a, b in zip(tops, expected))
+                report["workers"][workers] = timing
+            finally:
+                scorer.close()
+        return report
+    finally:
+        if app_db is None:
+            vars(core.database).pop("db", None)
+        else:
+            core.database.db = app_db
+        gallery.close()
+
+
+def bench_crowd(frames, counts=(1, 2, 4, 8), n_users=1000, repeat=5, seed=0):
+    """Faces per second of crowd mode vs face-by-face recognition, as faces per frame grow
+
+    A "frame" is `count` face crops drawn with replacement from the samples,
+    so some frames show the same person twice. Face by face runs
+    extract_advanced_features and identify() per crop; crowd mode runs
+    extract_features_batch and identify_crowd once per frame. Detection
+    costs the same in both and is left out. "shared_identity_frames" counts
+    frames where two faces were given the same recognized identity.
+    """
+    crops = _face_crops(frames)
+    if not crops:
+        raise RuntimeError("No face found in the benchmark images")
+    rng = np.random.default_rng(seed)
+    app_db = vars(core.database).get("db")
+    gallery = SyntheticGallery(frames, n_users)
+    try:
+        gallery.use(n_users)
+        candidates = gallery.db.data["users"]
+        gallery.db.gallery()
+
+        def shared(results):
+            names = [result["top"][0][0] for result in results if result["decision"] != "not_recognized"]
+            return len(names) != len(set(names))
+
+        def single(frame):
+            return [core.identify(core.extract_advanced_features(crop), candidates) for crop in frame]
+
+        def crowd(frame):
+            return core.identify_crowd(core.extract_features_batch(frame), candidates)
+
+        report = {"users": n_users, "frames_per_count": repeat, "opencv_threads": cv2.getNumThreads(), "counts": {}}
+        for count in counts:
+            batch = [[crops[i] for i in rng.integers(0, len(crops), count)] for _ in range(repeat)]
+            entry = {}
+            for mode, fn in (("single", single), ("crowd", crowd)):
+                timing = _measure(fn, batch)
+                timing["faces_per_second"] = count * 1000 / timing["mean_ms"]
+                timing["shared_identity_frames"] = sum(shared(fn(frame)) for frame in batch)
+                entry[mode] = timing
+            entry["speedup"] = entry["single"]["mean_ms"] / entry["crowd"]["mean_ms"]
+            report["counts"][count] = entry
+        return report
+    finally:
+        if app_db is None:
+            vars(core.database).pop("db", None)
+        else:
+            core.database.db = app_db
+        gallery.close()
+
+
+def bench_frames(frames, repeat=20):
+    """Per-frame latency and allocations of the verify frame path, fresh arrays vs reused buffers
+
+    Each frame goes through the verify mode's detection, face crop and
+    feature extraction, first with buffers.REUSE_BUFFERS off (new arrays
+    and CLAHE objects on every call, the original behaviour), then on.
+    "alloc_peak_kb" is the mean traced allocation peak of one frame after
+    warm-up, "buffer_grows" the buffer reallocations during the timed frames
+    (0 once the context has settled).
+    """
+    images = [frame for _, frame in frames] * repeat
+    mode = core.ENHANCEMENT_MODES["verify"]
+
+    def process(image):
+        boxes, source = core.detect_faces(image, mode)
+        return [core.extract_advanced_features(core.face_crop(source, box, mode)) for box in boxes]
+
+    reuse = core.buffers.REUSE_BUFFERS
+    report = {"frames": len(images), "modes": {}}
+    try:
+        for name, enabled in (("fresh", False), ("reused", True)):
+            core.buffers.REUSE_BUFFERS = enabled
+            context = core.frame_context()
+            for image in images[:len(frames)]:
+                process(image)
+            grows = context.grows
+            timing = _measure(process, images, warmup=0)
+            timing["buffer_grows"] = context.grows - grows
+            peaks = []
+            tracemalloc.start()
+            try:
+                for image in images[:len(frames) * 2]:
+                    tracemalloc.reset_peak()
+                    before, _ = tracemalloc.get_traced_memory()
+                    process(image)
+                    peaks.append(tracemalloc.get_traced_memory()[1] - before)
+            finally:
+                tracemalloc.stop()
+            timing["alloc_peak_kb"] = float(np.mean(peaks)) / 2 ** 10
+            timing["context"] = context.stats()
+            report["modes"][name] = timing
+    finally:
+        core.buffers.REUSE_BUFFERS = reuse
+    fresh, reused = report["modes"]["fresh"], report["modes"]["reused"]
+    report["p99_change"] = reused["p99_ms"] / fresh["p99_ms"] - 1
+    report["alloc_peak_change"] = reused["alloc_peak_kb"] / fresh["alloc_peak_kb"] - 1
+    return report
+
+
+HAMMER_OPS = {"add": 0.3, "append": 0.15, "delete": 0.2, "verify": 0.2, "list": 0.15}  # operation mix
+HAMMER_NAMES = 8  # names per client, so adds, appends and deletes of one client keep colliding
+
+
+def _hammer_client(db, client, root, samples, probes, ops, seed):
+    """One client's random operations; returns the users it expects to exist and its timings
+
+    Each client owns its names, so whatever the other clients do, the final
+    database must hold exactly the users (and sample counts) it expects.
+    """
+    rng = random.Random(seed)
+    expected, errors = {}, []
+    times = {op: [] for op in HAMMER_OPS}
+    for i in range(ops):
+        op = rng.choices(list(HAMMER_OPS), weights=list(HAMMER_OPS.values()))[0]
+        name = f"{client}_user{rng.randrange(HAMMER_NAMES)}"
+        start = time.perf_counter()
+        try:
+            if op in ("add", "append"):
+                path, features, template, face_normalized = rng.choice(samples)
+                image = os.path.join(root, "faces", f"{name}_{i}.png")
+                # copy2 keeps the mtime, so the precomputed template stays current
+                shutil.copy2(path, image)
+                db.add_users([(name, image, features, dict(template), face_normalized)], append=op == "append")
+                expected[name] = expected.get(name, 0) + 1 if op == "append" else 1
+            elif op == "delete":
+                if db.delete_user(name) != (name in expected):
+                    errors.append(f"delete {name}: existence disagrees with this client's own writes")
+                expected.pop(name, None)
+            elif op == "verify":
+                outcome = core.verify_image(rng.choice(probes))["outcome"]
+                if outcome == "error":
+                    errors.append(f"verify {i}: error outcome")
+            else:
+                # Paged, prefix-searched listing, as the admin panel reads it
+                total, rows = db.list_users(f"{client}_", 0, HAMMER_NAMES)
+                if total != len(rows):
+                    errors.append(f"list {i}: {total} users matched, {len(rows)} listed")
+                # Readers of the raw file must never see a partial write
+                with open(db.db_path, 'r') as f:
+                    json.load(f)
+        except Exception as e:
+            errors.append(f"{op} {i}: {type(e).__name__}: {e}")
+        times[op].append((time.perf_counter() - start) * 1000)
+    return {"expected": expected, "times": times, "errors": errors}
+
+
+def _hammer_process(process, threads, root, samples, probes, ops, seed):
+    """Worker process: `threads` clients sharing one FaceDatabase, as the app and the API do"""
+    db = core.FaceDatabase(os.path.join(root, "faces.json"), os.path.join(root, "gallery"))
+    core.database.db = db
+    results = [None] * threads
+    
+    def run(t):
+        results[t] = _hammer_client(db, f"p{process}t{t}", root, samples, probes, ops, seed * 1000 + process * 100 + t)
+    
+    clients = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return results
+
+
+def bench_hammer(frames, processes=4, threads=2, ops=200, seed=0):
+    """Concurrent add/append/delete/verify/list clients on one temporary database
+
+    `processes` worker processes run `threads` clients each. Afterwards the
+    database must hold exactly the users the clients expect, with no
+    duplicate names, every referenced image and row present and no orphaned
+    images; any difference (or a client error) is listed in "violations".
+    """
+    root = tempfile.mkdtemp(prefix="face_hammer_")
+    try:
+        os.makedirs(os.path.join(root, "faces"))
+        samples = []
+        for i, (_, frame) in enumerate(frames):
+            features, rejection = core.enrollment_features(frame)
+            if rejection is not None:
+                continue
+            path = os.path.join(root, f"sample_{i}.png")
+            cv2.imwrite(path, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+            template, face_normalized = core.build_template(path)
+            samples.append((path, features, template, face_normalized))
+        if not samples:
+            raise RuntimeError("No face found in any sample image, cannot enroll")
+        probes = [frame for _, frame in frames]
+        
+        start = time.perf_counter()
+        with multiprocessing.Pool(processes=processes) as pool:
+            results = pool.starmap(_hammer_process, [(p, threads, root, samples, probes, ops, seed)
+                                                     for p in range(processes)])
+        elapsed = time.perf_counter() - start
+        clients = [client for process in results for client in process]
+        
+        violations = [error for client in clients for error in client["errors"]]
+        expected = {name: count for client in clients for name, count in client["expected"].items()}
+        db = core.FaceDatabase(os.path.join(root, "faces.json"), os.path.join(root, "gallery"))
+        users = db.snapshot()["users"]
+        names = [u["name"] for u in users]
+        if len(names) != len({name.lower() for name in names}):
+            violations.append("duplicate user names")
+        actual = {u["name"]: len(db.samples(u)) for u in users}
+        for name in sorted(set(expected) | set(actual)):
+            if expected.get(name) != actual.get(name):
+                violations.append(f"{name}: expected {expected.get(name, 0)} samples, found {actual.get(name, 0)}")
+        images = {sample["image"] for u in users for sample in db.samples(u)}
+        rows = [u["row"] for u in users] + [s["row"] for u in users for s in u.get("samples", ())]
+        violations += [f"missing image {path}" for path in sorted(images) if not os.path.exists(path)]
+        violations += [f"orphaned image {name}" for name in sorted(os.listdir(os.path.join(root, "faces")))
+                       if os.path.join(root, "faces", name) not in images]
+        if rows and max(rows) >= db.store.rows:
+            violations.append(f"row {max(rows)} beyond the store ({db.store.rows} rows)")
+        db.store = None
+        
+        total = processes * threads * ops
+        return {
+            "processes": processes,
+            "threads": threads,
+            "ops_per_client": ops,
+            "ops_per_second": total / elapsed,
+            "seconds": elapsed,
+            "final_users": len(users),
+            "version": db.data.get("version", 0),
+            "operations": {op: _summary([ms for client in clients for ms in client["times"][op]])
+                           for op in HAMMER_OPS if any(client["times"][op] for client in clients)},
+            "violations": violations[:50]
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    detect = sub.add_parser("detect", help="detect_face latency and accuracy vs the legacy detector")
+    detect.add_argument("--images", required=True, help="directory of reference images")
+    detect.add_argument("--truth", help="JSON of image name -> [[x, y, w, h], ...] ground-truth boxes")
+    detect.add_argument("--single-pass", action="store_true", help="answer all detection stages from one cascade pass")
+    detect.add_argument("--repeat", type=int, default=3)
+    detect.add_argument("--output", help="write the JSON report here instead of stdout")
+    enhance = sub.add_parser("enhance", help="tiered vs legacy enhancement: latency and recognition scores")
+    enhance.add_argument("--images", required=True, help="directory of reference images")
+    enhance.add_argument("--modes", nargs="+", default=["legacy", "tiered"],
+                         help="enhancement modes to compare, the first is the baseline")
+    enhance.add_argument("--output", help="write the JSON report here instead of stdout")
+    suite = sub.add_parser("suite", help="per-stage latency/memory report with an optional regression gate")
+    suite.add_argument("--images", help="directory of face images (default: synthetic faces)")
+    suite.add_argument("--samples", type=int, default=10, help="number of synthetic faces")
+    suite.add_argument("--sizes", type=int, nargs="+", default=list(SUITE_SIZES), help="gallery sizes to sweep")
+    suite.add_argument("--baseline", help="earlier suite report to gate against")
+    suite.add_argument("--metric", default=SUITE_METRIC, choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"])
+    suite.add_argument("--max-regression", type=float, default=SUITE_MAX_REGRESSION,
+                       help="allowed slowdown per stage as a fraction (0.25 = 25%%)")
+    suite.add_argument("--output", help="write the JSON report here instead of stdout")
+    startup = sub.add_parser("startup", help="cold-start time of the headless core and the UI (fresh processes)")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.add_argument("--data-dir", help="directory with the faces.json/gallery to load (default: empty)")
+    startup.add_argument("--output", help="write the JSON report here instead of stdout")
+    hammer = sub.add_parser("hammer", help="concurrent writers and readers on one database, with consistency checks")
+    hammer.add_argument("--images", help="directory of face images (default: synthetic faces)")
+    hammer.add_argument("--samples", type=int, default=6, help="number of synthetic faces")
+    hammer.add_argument("--processes", type=int, default=4)
+    hammer.add_argument("--threads", type=int, default=2, help="clients per process")
+    hammer.add_argument("--ops", type=int, default=200, help="operations per client")
+    hammer.add_argument("--seed", type=int, default=0)
+    hammer.add_argument("--output", help="write the JSON report here instead of stdout")
+    cascade = sub.add_parser("cascade", help="cascaded early-rejection scan vs full scan: work skipped, agreement")
+    cascade.add_argument("--images", help="directory of face images (default: synthetic faces)")
+    cascade.add_argument("--samples", type=int, default=6, help="number of synthetic faces")
+    cascade.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="gallery sizes to sweep")
+    cascade.add_argument("--output", help="write the JSON report here instead of stdout")
+    shards = sub.add_parser("shards", help="sharded exact gallery scan: scaling over 1..N worker processes")
+    shards.add_argument("--images", help="directory of face images (default: synthetic faces)")
+    shards.add_argument("--samples", type=int, default=4, help="number of synthetic faces")
+    shards.add_argument("--users", type=int, default=20000, help="synthetic gallery size")
+    shards.add_argument("--max-workers", type=int, help="largest pool to try (default: CPU count)")
+    shards.add_argument("--repeat", type=int, default=5, help="scans per probe")
+    shards.add_argument("--output", help="write the JSON report here instead of stdout")
+    per_frame = sub.add_parser("frames", help="per-frame latency and allocations, fresh arrays vs reused buffers")
+    per_frame.add_argument("--images", help="directory of face images (default: synthetic faces)")
+    per_frame.add_argument("--samples", type=int, default=4, help="number of synthetic faces")
+    per_frame.add_argument("--repeat", type=int, default=20, help="passes over the images")
+    per_frame.add_argument("--output", help="write the JSON report here instead of stdout")
+    crowd = sub.add_parser("crowd", help="batched multi-face recognition: faces/sec over faces per frame")
+    crowd.add_argument("--images", help="directory of face images (default: synthetic faces)")
+    crowd.add_argument("--samples", type=int, default=6, help="number of synthetic faces")
+    crowd.add_argument("--counts", type=int, nargs="+", default=[1, 2, 4, 8], help="faces per frame to sweep")
+    crowd.add_argument("--users", type=int, default=1000, help="synthetic gallery size")
+    crowd.add_argument("--repeat", type=int, default=5, help="frames per face count")
+    crowd.add_argument("--output", help="write the JSON report here instead of stdout")
+    compact = sub.add_parser("compact", help="memory and score changes of compact galleries vs full precision")
+    compact.add_argument("--images", help="directory of face images (default: synthetic faces)")
+    compact.add_argument("--samples", type=int, default=10, help="number of synthetic faces")
+    compact.add_argument("--users", type=int, default=1000, help="synthetic gallery size")
+    compact.add_argument("--queries", type=int, default=100)
+    compact.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.command == "detect":
+        truth = None
+        if args.truth:
+            with open(args.truth, 'r') as f:
+                truth = json.load(f)
+        detector = core.FaceDetector(single_pass=True) if args.single_pass else None
+        report = bench_detect(load_images(args.images), truth, args.repeat, detector)
+    elif args.command == "enhance":
+        report = bench_enhance(load_images(args.images), tuple(args.modes))
+    elif args.command == "suite":
+        frames = load_images(args.images) if args.images else synthetic_faces(args.samples)
+        report = bench_suite(frames, tuple(args.sizes))
+        if args.baseline:
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+            failures = gate(report, baseline, args.metric, args.max_regression)
+            report["gate"] = {"baseline": args.baseline, "metric": args.metric,
+                              "max_regression": args.max_regression, "failures": failures}
+    elif args.command == "startup":
+        report = bench_startup(args.repeat, args.data_dir)
+    elif args.command == "hammer":
+        frames = load_images(args.images) if args.images else synthetic_faces(args.samples)
+        report = bench_hammer(frames, args.processes, args.threads, args.ops, args.seed)
+    elif args.command == "cascade":
+        frames = load_images(args.images) if args.images else synthetic_faces(args.samples)
+        report = bench_cascade(frames, tuple(args.sizes))
+    elif args.command == "shards":
+        frames = load_images(args.images) if args.images else synthetic_faces(args.samples)
+        report = bench_shards(frames, args.users, args.max_workers, args.repeat)
+    elif args.command == "frames":
+        report = bench_frames(load_images(args.images) if args.images else synthetic_faces(args.samples), args.repeat)
+    elif args.command == "crowd":
+        frames = load_images(args.images) if args.images else synthetic_faces(args.samples)
+        report = bench_crowd(frames, tuple(args.counts), args.users, args.repeat)
+    elif args.command == "compact":
+        frames = load_images(args.images) if args.images else synthetic_faces(args.samples)
+        gallery = SyntheticGallery(frames, args.users)
+        try:
+            gallery.use(args.users)
+            report = core.compact_report(n_queries=args.queries)
+        finally:
+            gallery.close()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if report.get("gate", {}).get("failures"):
+        for failure in report["gate"]["failures"]:
+            print(f"REGRESSION {failure['stage']}: {failure['baseline']:.2f} -> {failure['current']:.2f} "
+                  f"({failure['regression'] * 100:+.0f}%)", file=sys.stderr)
+        return 1
+    for violation in report.get("violations", ()):
+        print(f"VIOLATION {violation}", file=sys.stderr)
+    if report.get("violations"):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Headless bulk enrollment
+Registers many users from a directory or a manifest, without the webcam UI:
+    python enroll.py --dir photos/              (photos/<name>.jpg or photos/<name>/<images>)
+    python enroll.py --manifest people.csv      (CSV with name,image columns)
+Several images of one person (a folder, or repeated manifest names) become one multi-sample user.
+"""
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import cv2
+
+import face_core as core
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp")
+PROGRESS_FILE = "enroll_progress.jsonl"
+COMMIT_EVERY = 500  # images per batched database write
+
+
+def _images_in(directory):
+    return sorted(
+        path for pattern in IMAGE_PATTERNS
+        for path in glob.glob(os.path.join(directory, pattern))
+    )
+
+
+def scan_directory(directory):
+    """(name, image path) pairs: <dir>/<name>.<ext> files and every image of <dir>/<name>/ folders"""
+    pairs = [(os.path.splitext(os.path.basename(path))[0], path) for path in _images_in(directory)]
+    for entry in sorted(os.listdir(directory)):
+        folder = os.path.join(directory, entry)
+        if os.path.isdir(folder):
+            pairs.extend((entry, image) for image in _images_in(folder))
+    return pairs
+
+
+def read_manifest(path):
+    """(name, image path) pairs from a CSV with `name` and `image` columns
+
+    Relative image paths are resolved against the manifest's directory.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    if rows and not {"name", "image"} <= set(rows[0]):
+        raise ValueError(f"Manifest {path} needs 'name' and 'image' columns, found {sorted(rows[0])}")
+    return [(row["name"], os.path.join(base, row["image"])) for row in rows]
+
+
+def load_progress(path):
+    """(image paths already handled by an earlier run, lower-case names it enrolled)"""
+    done, enrolled = set(), set()
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                    done.add(result["image"])
+                except (ValueError, KeyError):
+                    # Torn last line from an interrupted run
+                    continue
+                if result.get("status") == "enrolled":
+                    enrolled.add(result["name"].lower())
+    return done, enrolled
+
+
+def enroll_one(job):
+    """Worker: checks, features and gallery template of one (name, image path)
+
+    Returns a result dict with "status" "enrolled" (and the database entry)
+    or "rejected" with a "reason".
+    """
+    name, source_path = job
+    result = {"name": name, "image": source_path}
+    image = cv2.imread(source_path)
+    if image is None:
+        return dict(result, status="rejected", reason="unreadable")
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    try:
+        features, rejection = core.enrollment_features(image)
+        if rejection is not None:
+            return dict(result, status="rejected", reason=rejection)
+
+        # Keep the original file as the stored image, like register_user's capture
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        stem, extension = os.path.splitext(os.path.basename(source_path))
+        # The source file name keeps several samples of one person apart
+        filepath = os.path.join(core.FACES_DIR, f"{name.replace(' ', '_')}_{timestamp}_{stem}{extension.lower() or '.jpg'}")
+        shutil.copyfile(source_path, filepath)
+        template, face_normalized = core.build_template(filepath)
+    except Exception as e:
+        return dict(result, status="rejected", reason="error", error=str(e))
+    return dict(result, status="enrolled", entry=(name, filepath, features, template, face_normalized))
+
+
+def _commit(pending, progress, committed):
+    """Batched database write for the pending results, then record them as done
+
+    Names in `committed` (enrolled by an earlier batch or run) get their new
+    images added as extra samples instead of replacing the user.
+    """
+    if not pending:
+        return
+    extra = [result["entry"] for result in pending if result["name"].lower() in committed]
+    core.db.add_users(result["entry"] for result in pending if result["name"].lower() not in committed)
+    core.db.add_users(extra, append=True)
+    for result in pending:
+        committed.add(result["name"].lower())
+        progress.write(json.dumps({"image": result["image"], "name": result["name"], "status": "enrolled"}) + "\n")
+    progress.flush()
+    pending.clear()
+
+
+def bulk_enroll(pairs, workers=None, progress_path=PROGRESS_FILE, commit_every=COMMIT_EVERY, quiet=False):
+    """Enroll (name, image path) pairs across a process pool, returns a summary report
+
+    Results are committed to the database in batches of `commit_every` images;
+    images sharing a name become samples of one user. Every committed or
+    rejected image is appended to the progress file, and images listed there
+    are skipped, so an interrupted run can be resumed.
+    """
+    done, committed = load_progress(progress_path)
+    jobs, seen, skipped_duplicates = [], set(), []
+    for name, path in pairs:
+        name = name.strip()
+        if path in done:
+            continue
+        if not name or path in seen:
+            skipped_duplicates.append({"name": name, "image": path, "status": "rejected",
+                                       "reason": "missing_name" if not name else "duplicate_image"})
+            continue
+        seen.add(path)
+        jobs.append((name, path))
+
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(core.FACES_DIR, exist_ok=True)
+    reasons = {}
+    enrolled = 0
+    start = time.perf_counter()
+    with open(progress_path, 'a', encoding='utf-8') as progress:
+        for result in skipped_duplicates:
+            reasons[result["reason"]] = reasons.get(result["reason"], 0) + 1
+            progress.write(json.dumps(result) + "\n")
+
+        pending = []
+        with multiprocessing.Pool(processes=workers) as pool:
+            for i, result in enumerate(pool.imap_unordered(enroll_one, jobs, chunksize=4), 1):
+                if result["status"] == "enrolled":
+                    pending.append(result)
+                    enrolled += 1
+                    if len(pending) >= commit_every:
+                        _commit(pending, progress, committed)
+                else:
+                    reasons[result["reason"]] = reasons.get(result["reason"], 0) + 1
+                    progress.write(json.dumps(result) + "\n")
+                if not quiet and (i % 50 == 0 or i == len(jobs)):
+                    rate = i / (time.perf_counter() - start)
+                    print(f"  {i}/{len(jobs)} images · {enrolled} enrolled · {rate:.1f} images/s", file=sys.stderr)
+        _commit(pending, progress, committed)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "inputs": len(pairs),
+        "already_done": len(pairs) - len(jobs) - len(skipped_duplicates),
+        "processed": len(jobs),
+        "enrolled": enrolled,
+        "rejected": sum(reasons.values()),
+        "rejection_reasons": reasons,
+        "workers": workers,
+        "seconds": elapsed,
+        "images_per_second": len(jobs) / elapsed if elapsed > 0 else None,
+        "progress_file": progress_path
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="directory of <name>.<ext> images or <name>/ folders")
+    source.add_argument("--manifest", help="CSV with name,image columns")
+    parser.add_argument("--workers", type=int, help="process pool size (default: CPU count)")
+    parser.add_argument("--progress", default=PROGRESS_FILE, help="resume file (delete it to start over)")
+    parser.add_argument("--commit-every", type=int, default=COMMIT_EVERY, help="images per batched database write")
+    args = parser.parse_args(argv)
+
+    pairs = scan_directory(args.dir) if args.dir else read_manifest(args.manifest)
+    report = bulk_enroll(pairs, args.workers, args.progress, args.commit_every)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
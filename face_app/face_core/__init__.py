@@ -0,0 +1,93 @@
+"""
+Headless face recognition core
+Detection, features, matching and the gallery database, importable without the UI:
+    import face_core as core
+    core.warm_up()
+    core.verify_image(rgb_image)
+
+Importing the package is cheap: the pipeline modules (OpenCV, NumPy) are
+imported on first attribute access and the database is opened on first use
+of `core.db`. Tunables are module globals of the submodules and must be set
+there (e.g. core.detection.DETECTION_MAX_SIDE), not on the package.
+"""
+import importlib
+import sys
+import time
+import types
+import warnings
+
+# Suppress warnings
+warnings.filterwarnings("ignore", category=RuntimeWarning)
+
+_MODULES = ("metrics", "buffers", "features", "detection", "matching", "compact", "probe_cache", "database", "sharding", "recognition", "crowd", "streaming", "tracking")
+
+# Seconds spent in each startup phase of this process ("core_import",
+# "warm_up" and, when the UI is built, "ui_import" and "ui_build")
+STARTUP = {}
+
+_exports = None
+
+
+def record_startup(phase: str, seconds: float):
+    """Note a startup phase in STARTUP and the startup_seconds gauge"""
+    from .metrics import metrics
+    STARTUP[phase] = seconds
+    metrics.set("startup_seconds", seconds, phase=phase)
+
+
+def _load():
+    """Import the pipeline modules once; returns {public name: defining module}"""
+    global _exports
+    if _exports is None:
+        start = time.perf_counter()
+        fresh = f"{__name__}.recognition" not in sys.modules
+        modules = [importlib.import_module(f".{name}", __name__) for name in _MODULES]
+        exports = {}
+        for module in modules:
+            for name, value in vars(module).items():
+                if not name.startswith("_") and not isinstance(value, types.ModuleType) and name not in exports:
+                    exports[name] = module
+        exports["db"] = modules[_MODULES.index("database")]
+        _exports = exports
+        if fresh:
+            record_startup("core_import", time.perf_counter() - start)
+    return _exports
+
+
+def __getattr__(name):
+    if name in _MODULES:
+        return importlib.import_module(f".{name}", __name__)
+    module = _load().get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # Looked up on every access, so swapping e.g. database.db is seen here too
+    return getattr(module, name)
+
+
+def warm_up(gallery: bool = True):
+    """Do the first-use work before the first request
+
+    Imports the pipeline, loads the calling thread's face cascade, runs one
+    dummy frame through detection and feature extraction and, with
+    `gallery`, opens the database and builds the gallery caches. Returns
+    the seconds spent per step.
+    """
+    start = time.perf_counter()
+    _load()
+    import numpy as np
+    from . import detection, features, recognition
+    timings = {"import": time.perf_counter() - start}
+
+    step = time.perf_counter()
+    frame = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    mode = detection.ENHANCEMENT_MODES["verify"]
+    _, source = detection.detect_faces(frame, mode)
+    features.extract_advanced_features(detection.face_crop(source, (0, 0, 160, 160), mode))
+    timings["pipeline"] = time.perf_counter() - step
+
+    if gallery:
+        step = time.perf_counter()
+        recognition.load_gallery()
+        timings["gallery"] = time.perf_counter() - step
+    record_startup("warm_up", time.perf_counter() - start)
+    return timings
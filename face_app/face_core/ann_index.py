@@ -0,0 +1,159 @@
+"""
+Approximate nearest-neighbour index for large face galleries
+IVF (k-means partitioned) candidate search over concatenated histogram descriptors
+"""
+import os
+import numpy as np
+
+
+def ann_vectors(hists, weights):
+    """Concatenated descriptor whose dot product is the weighted sum of correlations
+
+    Each histogram is centered and L2-normalized (so a dot product equals its
+    Pearson correlation) and scaled by sqrt(weight).
+    """
+    parts = []
+    for field, weight in weights.items():
+        matrix = np.asarray(hists[field], dtype=np.float64)
+        matrix = matrix.reshape(len(matrix), -1)
+        centered = matrix - matrix.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(centered, axis=1, keepdims=True)
+        parts.append(np.sqrt(weight) * centered / np.maximum(norms, 1e-12))
+    return np.concatenate(parts, axis=1).astype(np.float32)
+
+
+def _kmeans(vectors, n_clusters, iterations=20, seed=0):
+    """Spherical k-means (dot-product assignment), k-means++ style seeding"""
+    rng = np.random.default_rng(seed)
+    centroids = [vectors[rng.integers(len(vectors))]]
+    closest = np.full(len(vectors), np.inf)
+    for _ in range(1, n_clusters):
+        closest = np.minimum(closest, np.sum((vectors - centroids[-1]) ** 2, axis=1))
+        total = closest.sum()
+        index = rng.choice(len(vectors), p=closest / total) if total > 0 else rng.integers(len(vectors))
+        centroids.append(vectors[index])
+    centroids = np.array(centroids, dtype=np.float32)
+
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = vectors[assignment == cluster]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[cluster] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index keyed by gallery row
+
+    Vectors are partitioned by their nearest k-means centroid; a query only
+    scans the `n_probe` closest partitions and returns a shortlist of rows for
+    exact re-ranking. Below `min_train` rows the index is a flat scan. Rows can
+    be added and removed without retraining; the centroids are retrained when
+    the gallery outgrows the size they were trained on by `retrain_factor`.
+    """
+    def __init__(self, n_probe: int = 8, min_train: int = 1024, retrain_factor: int = 4):
+        self.n_probe = n_probe
+        self.min_train = min_train
+        self.retrain_factor = retrain_factor
+        self.centroids = None
+        self.trained_size = 0
+        self.rows = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.assignment = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def train(self, vectors):
+        n_lists = int(np.clip(np.sqrt(len(vectors)), 1, 1024))
+        sample = vectors
+        if len(vectors) > 50 * n_lists:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), 50 * n_lists, replace=False)]
+        self.centroids = _kmeans(sample, n_lists)
+        self.trained_size = len(vectors)
+        self.assignment = self._assign(self.vectors)
+
+    def _assign(self, vectors):
+        if self.centroids is None or len(vectors) == 0:
+            return np.zeros(len(vectors), dtype=np.int64)
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def add(self, rows, vectors):
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(self.rows) == 0:
+            self.vectors = np.empty((0, vectors.shape[1]), dtype=np.float32)
+        self.remove(rows)
+        self.rows = np.concatenate([self.rows, rows])
+        self.vectors = np.concatenate([self.vectors, vectors])
+        self.assignment = np.concatenate([self.assignment, self._assign(vectors)])
+        if len(self.rows) >= self.min_train and (
+                self.centroids is None or len(self.rows) > self.retrain_factor * self.trained_size):
+            self.train(self.vectors)
+
+    def remove(self, rows):
+        keep = ~np.isin(self.rows, np.asarray(rows, dtype=np.int64))
+        if not keep.all():
+            self.rows, self.vectors, self.assignment = self.rows[keep], self.vectors[keep], self.assignment[keep]
+
+    def remap(self, mapping):
+        """Apply an old row -> new row mapping (feature store compaction)"""
+        keep = np.array([row in mapping for row in self.rows], dtype=bool)
+        self.rows, self.vectors, self.assignment = self.rows[keep], self.vectors[keep], self.assignment[keep]
+        self.rows = np.array([mapping[row] for row in self.rows], dtype=np.int64)
+
+    def search(self, vector, k: int, n_probe: int = None):
+        """Rows of the k most similar indexed vectors among the probed partitions"""
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        candidates = np.arange(len(self.rows))
+        if self.centroids is not None:
+            n_probe = min(n_probe or self.n_probe, len(self.centroids))
+            lists = np.argsort(-(self.centroids @ vector))[:n_probe]
+            candidates = np.flatnonzero(np.isin(self.assignment, lists))
+        similarity = self.vectors[candidates] @ vector
+        if len(candidates) > k:
+            best = np.argpartition(-similarity, k)[:k]
+            candidates, similarity = candidates[best], similarity[best]
+        return self.rows[candidates[np.argsort(-similarity, kind='stable')]]
+
+    def save(self, path: str, generation: int = 0):
+        """Persist centroids and assignments (vectors are rebuilt from the store)"""
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids if self.centroids is not None else np.empty((0, 0), dtype=np.float32),
+            rows=self.rows, assignment=self.assignment,
+            meta=np.array([generation, self.trained_size, self.n_probe, self.min_train, self.retrain_factor])
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, vectors_for_rows, generation: int = 0):
+        """Load a saved index, or None if missing or from another store generation
+
+        `vectors_for_rows(rows)` recomputes the descriptors of the given rows.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as saved:
+            meta = saved["meta"]
+            if int(meta[0]) != generation:
+                return None
+            index = cls(n_probe=int(meta[2]), min_train=int(meta[3]), retrain_factor=int(meta[4]))
+            index.trained_size = int(meta[1])
+            index.centroids = saved["centroids"] if saved["centroids"].size else None
+            index.rows = saved["rows"].astype(np.int64)
+            index.assignment = saved["assignment"].astype(np.int64)
+        index.vectors = vectors_for_rows(index.rows)
+        return index
+
+
+def recall_at_k(approx_rows, exact_rows, k: int):
+    """Mean fraction of the exact top-k rows that the shortlists contain"""
+    hits = [len(set(np.asarray(exact)[:k]) & set(np.asarray(approx))) / min(k, len(exact))
+            for approx, exact in zip(approx_rows, exact_rows) if len(exact)]
+    return float(np.mean(hits)) if hits else 1.0
@@ -0,0 +1,72 @@
+"""
+Per-worker frame buffers
+Reusable OpenCV output buffers and long-lived OpenCV objects, one set per thread
+"""
+import threading
+
+import cv2
+import numpy as np
+
+
+# Reuse buffers and CLAHE objects across frames; False gives every call fresh
+# arrays and objects, as the pipeline originally did
+REUSE_BUFFERS = True
+BUFFER_GROWTH = 1.25  # a buffer that has to grow gets this much headroom, so varying crop sizes settle
+
+
+class FrameContext:
+    """Scratch memory and OpenCV objects of one worker thread
+
+    `buffer(name, shape, dtype)` returns a C-contiguous array to pass as an
+    OpenCV `dst=`. Each name has one backing allocation that only grows, so
+    once the largest frame or face crop has been seen, processing allocates
+    no new pixel buffers. A buffer's content is only valid until the next
+    request for the same name: pipeline functions use buffers for their
+    temporaries and return fresh arrays. Not thread-safe; use frame_context()
+    for the calling thread's instance.
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.grows = 0
+        self._backing = {}
+        self._clahe = {}
+
+    def buffer(self, name: str, shape, dtype=np.uint8):
+        """Reusable array of `shape` for `name` (None when disabled, so OpenCV allocates)"""
+        if not self.enabled:
+            return None
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        backing = self._backing.get(name)
+        if backing is None or backing.nbytes < nbytes:
+            backing = self._backing[name] = np.empty(int(nbytes * BUFFER_GROWTH) + 1, dtype=np.uint8)
+            self.grows += 1
+        return backing[:nbytes].view(dtype).reshape(shape)
+
+    def clahe(self, clip_limit: float, tile_grid=(8, 8)):
+        """CLAHE object with these parameters, created once per context"""
+        key = (clip_limit, tuple(tile_grid))
+        if not self.enabled:
+            return cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=key[1])
+        if key not in self._clahe:
+            self._clahe[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=key[1])
+        return self._clahe[key]
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "buffers": len(self._backing),
+            "bytes": int(sum(backing.nbytes for backing in self._backing.values())),
+            "grows": self.grows,
+        }
+
+
+_local = threading.local()
+
+
+def frame_context():
+    """The calling thread's FrameContext (recreated when REUSE_BUFFERS changes)"""
+    context = getattr(_local, "context", None)
+    if context is None or context.enabled != REUSE_BUFFERS:
+        context = _local.context = FrameContext(REUSE_BUFFERS)
+    return context
@@ -0,0 +1,94 @@
+"""
+Compact gallery descriptors
+Quantized histograms and downsampled face templates, held in RAM for matching
+"""
+import os
+
+import numpy as np
+
+from .features import downsample_face
+from .matching import centered_norms
+
+
+HIST_PRECISIONS = ("float64", "float16", "uint8")
+
+# Configured from the environment, so API worker processes inherit it:
+# FACE_GALLERY_PRECISION=float16|uint8 quantizes the histograms,
+# FACE_GALLERY_FACE_SIZE=80 downsamples the 160x160 face templates
+GALLERY_PRECISION = os.environ.get("FACE_GALLERY_PRECISION", "float64")
+GALLERY_FACE_SIZE = int(os.environ.get("FACE_GALLERY_FACE_SIZE", "0")) or None
+
+
+def compact_enabled():
+    return GALLERY_PRECISION != "float64" or GALLERY_FACE_SIZE is not None
+
+
+def quantize_rows(matrix, precision):
+    """(quantized matrix, per-row scales or None) of a (N, bins) histogram matrix
+
+    uint8 rows are scaled so their largest bin is 255; correlations are
+    unaffected by the scale, so only the chi-square term needs it back.
+    """
+    if precision not in HIST_PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {HIST_PRECISIONS}")
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if precision != "uint8":
+        return matrix.astype(precision), None
+    peak = matrix.max(axis=1) if matrix.size else np.zeros(len(matrix))
+    scale = np.where(peak > 0, peak / 255, 1.0)
+    quantized = np.clip(np.rint(matrix / scale[:, None]), 0, 255).astype(np.uint8)
+    return quantized, scale.astype(np.float32)
+
+
+def compact_gallery(gallery, precision=None, face_size=None):
+    """Compact copy of gallery matrices (as returned by FaceDatabase.gallery), ready for score_gallery"""
+    precision = precision or GALLERY_PRECISION
+    compact = {}
+    for name, matrix in gallery.items():
+        if name == "face_normalized":
+            faces = np.asarray(matrix)
+            if face_size:
+                faces = np.array([downsample_face(face, (face_size, face_size)) for face in faces],
+                                 dtype=np.uint8).reshape(-1, face_size, face_size)
+            compact[name] = faces
+            compact["face_normalized_norm"] = centered_norms(faces)
+        elif not name.endswith("_norm"):
+            compact[name], scale = quantize_rows(matrix, precision)
+            if scale is not None:
+                compact[f"{name}_scale"] = scale
+    return compact
+
+
+def gallery_bytes(gallery):
+    return int(sum(np.asarray(matrix).nbytes for matrix in gallery.values()))
+
+
+class CompactGallery:
+    """Compact copy of the store's gallery, extended as rows are appended
+
+    Store rows never change once written, so only rows appended since the
+    last update are quantized; a new store generation starts over.
+    """
+    def __init__(self, precision=None, face_size=None):
+        self.precision = precision or GALLERY_PRECISION
+        self.face_size = face_size
+        self.generation = None
+        self.rows = 0
+        self.matrices = {}
+
+    def matches(self, precision, face_size):
+        return (self.precision, self.face_size) == (precision, face_size)
+
+    def update(self, gallery, generation):
+        """Compact matrices covering every row of `gallery` (full-precision store matrices)"""
+        if generation != self.generation:
+            self.generation, self.rows, self.matrices = generation, 0, {}
+        total = len(gallery["face_normalized"])
+        if total > self.rows:
+            added = compact_gallery({name: matrix[self.rows:total] for name, matrix in gallery.items()},
+                                    self.precision, self.face_size)
+            self.matrices = added if not self.matrices else {
+                name: np.concatenate([self.matrices[name], added[name]]) for name in added
+            }
+            self.rows = total
+        return dict(self.matrices)
@@ -0,0 +1,166 @@
+"""
+Crowd mode
+Every face of a frame recognized in one batch, with at most one face per identity
+"""
+import numpy as np
+
+from . import database
+from .detection import ENHANCEMENT_MODES, detect_faces, face_crop
+from .features import extract_features_batch
+from .matching import ANN_MIN_GALLERY, BASE_THRESHOLD, CASCADE_MIN_ROWS, match_gallery_cascade, score_matrix
+from .metrics import metrics
+from .recognition import VERIFY_MIN_FACE, ann_shortlist, decide, gallery_candidates
+
+
+def linear_assignment(weights):
+    """Maximum-weight matching of rows to distinct columns: the column of every row (-1 for none)
+
+    Hungarian algorithm with potentials, O(rows^2 * columns); each step is
+    vectorized over the columns. With more rows than columns, the extra
+    rows get -1.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.shape[0] > weights.shape[1]:
+        return _assign_rows(linear_assignment(weights.T), weights.shape[0])
+    n, m = weights.shape
+    cost = -weights
+    u, v = np.zeros(n + 1), np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.int64)  # 1-based row holding each column, 0 = free
+    way = np.zeros(m + 1, dtype=np.int64)
+    for row in range(1, n + 1):
+        owner[0] = row
+        column = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while owner[column]:
+            used[column] = True
+            current = owner[column]
+            free = ~used[1:]
+            slack = cost[current - 1] - u[current] - v[1:]
+            better = free & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = column
+            candidates = np.where(free, min_slack[1:], np.inf)
+            column = int(np.argmin(candidates)) + 1
+            delta = candidates[column - 1]
+            u[owner[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+        # Flip the augmenting path back to the root
+        while column:
+            previous = way[column]
+            owner[column] = owner[previous]
+            column = previous
+    assignment = np.full(n, -1, dtype=np.int64)
+    held = np.flatnonzero(owner[1:])
+    assignment[owner[held + 1] - 1] = held
+    return assignment
+
+
+def _assign_rows(column_rows, n_rows):
+    # Inverts a column -> row assignment
+    assignment = np.full(n_rows, -1, dtype=np.int64)
+    held = np.flatnonzero(column_rows >= 0)
+    assignment[column_rows[held]] = held
+    return assignment
+
+
+def identify_crowd(features_list, candidates):
+    """identify() for every face of one frame, no identity given to two faces
+
+    All probes are scored against the candidates in one score_matrix pass
+    (in large galleries, against the union of each face's cascaded top-k).
+    Identities are then assigned one-to-one, maximizing the summed score of
+    the faces that reach BASE_THRESHOLD; a face whose best match is claimed
+    by a better-matching face falls back to its best unclaimed identity. A
+    face's gap is taken to its best unclaimed runner-up. Multi-sample users
+    are matched on their aggregate template only (no sample fallback).
+
+    Returns one {"decision", "top", "gap"} per face, as identify() does.
+    """
+    db = database.db
+    if not len(features_list):
+        return []
+    with metrics.timer("crowd_match"):
+        if len(candidates) >= ANN_MIN_GALLERY:
+            shortlist = {id(u) for features in features_list
+                         for u in ann_shortlist(features, candidates, len(features_list) + 1)}
+            candidates = [u for u in candidates if id(u) in shortlist]
+        gallery = db.gallery()
+        rows = np.array([u["row"] for u in candidates], dtype=np.int64)
+        n_faces = len(features_list)
+        if len(rows) >= CASCADE_MIN_ROWS:
+            # Each face's top n_faces + 1 holds every identity the assignment and the gaps can
+            # use, so only their union is scored (the cascade finds them without a full scan)
+            shortlist = set()
+            for features in features_list:
+                shortlist.update(i for i, _ in match_gallery_cascade(features, gallery, rows, top_k=n_faces + 1)["top"])
+            shortlist = sorted(shortlist)
+            candidates, rows = [candidates[i] for i in shortlist], rows[shortlist]
+        scores = score_matrix(features_list, gallery, rows)
+
+        # Each face's top n_faces identities always contain an optimal assignment
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :n_faces]
+        columns = np.unique(order)
+        subset = scores[:, columns]
+        assigned = linear_assignment(np.where(subset >= BASE_THRESHOLD, subset, 0.0))
+        claimed = [int(columns[column]) if column >= 0 and subset[face, column] >= BASE_THRESHOLD else None
+                   for face, column in enumerate(assigned)]
+
+    results = []
+    for face in range(n_faces):
+        available = scores[face].copy()
+        others = [column for other, column in enumerate(claimed) if other != face and column is not None]
+        available[others] = -np.inf
+        ranked = [int(i) for i in np.argsort(-available, kind='stable')[:2] if np.isfinite(available[i])]
+        if claimed[face] is not None:
+            # The assignment may skip the face's best free identity only to free it for another face
+            ranked = [claimed[face]] + [i for i in ranked if i != claimed[face]][:1]
+        top = [(candidates[i]["name"], float(scores[face, i])) for i in ranked]
+        if not top:
+            results.append({"decision": "not_recognized", "top": [], "gap": None})
+            continue
+        gap = top[0][1] - top[1][1] if len(top) >= 2 else None
+        decision = decide(top[0][1], gap) if claimed[face] is not None else "not_recognized"
+        results.append({"decision": decision, "top": top, "gap": gap})
+    metrics.inc("crowd_faces_total", n_faces)
+    return results
+
+
+@metrics.timed("verify_crowd")
+def verify_crowd(image, candidates=None):
+    """Headless verification of every face in one RGB image
+
+    Returns {"outcome", "faces"}; outcome is no_face, no_users or faces,
+    and each face is {"box", "outcome", "top", "gap"} with outcome
+    face_too_small, no_match, granted, uncertain or not_recognized.
+    Features of all faces are extracted as one batch and identities are
+    assigned by identify_crowd.
+    """
+    db = database.db
+    mode = ENHANCEMENT_MODES["verify"]
+    boxes, source = detect_faces(image, mode)
+    if len(boxes) == 0:
+        metrics.outcome("verify_crowd", "no_face")
+        return {"outcome": "no_face", "faces": []}
+    users = (db.snapshot() if candidates is None else db.data)["users"]
+    if len(users) == 0:
+        metrics.outcome("verify_crowd", "no_users")
+        return {"outcome": "no_users", "faces": []}
+
+    faces = [{"box": [int(v) for v in box], "outcome": "face_too_small", "top": [], "gap": None} for box in boxes]
+    large = [i for i, (x, y, w, h) in enumerate(boxes) if w >= VERIFY_MIN_FACE and h >= VERIFY_MIN_FACE]
+    features_list = extract_features_batch([face_crop(source, boxes[i], mode) for i in large])
+    if candidates is None:
+        candidates = gallery_candidates()
+    if candidates:
+        matches = identify_crowd(features_list, candidates)
+    else:
+        matches = [{"decision": "no_match", "top": [], "gap": None}] * len(large)
+    for i, match in zip(large, matches):
+        faces[i].update(outcome=match["decision"], top=match["top"], gap=match["gap"])
+    metrics.outcome("verify_crowd", "faces")
+    return {"outcome": "faces", "faces": faces}
+
+
+metrics.describe("crowd_faces_total", "Faces recognized in crowd mode")
@@ -0,0 +1,686 @@
+"""
+Face gallery database
+User metadata in faces.json, descriptors and face templates in the binary feature store
+"""
+import bisect
+import copy
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from . import compact
+from .ann_index import IVFIndex, ann_vectors
+from .detection import ENHANCEMENT_MODES, detect_faces, face_crop
+from .feature_store import FeatureStore
+from .filelock import FileLock
+from .features import normalize_face
+from .matching import ANN_WEIGHTS, centered_norms
+from .metrics import metrics
+
+
+# Gallery templates
+# Bump PIPELINE_VERSION whenever enhancement, detection or face normalization
+# changes, so stored templates get rebuilt from the stored images.
+PIPELINE_VERSION = 4
+FACE_SIZE = (160, 160)
+
+def pipeline_key():
+    """Pipeline version stamped on templates (includes the verify enhancement mode)"""
+    return f"{PIPELINE_VERSION}/{ENHANCEMENT_MODES['verify']}"
+
+def _file_digest(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def build_template(image_path: str):
+    """Compute the gallery template of a stored image
+    
+    Returns (metadata, face_normalized). face_normalized is None when no face is
+    found; `has_face` records that so we don't retry on every verify.
+    """
+    stat = os.stat(image_path)
+    face_normalized = build_gallery_template(image_path)
+    meta = {
+        "has_face": face_normalized is not None,
+        "image_sha1": _file_digest(image_path),
+        "image_size": stat.st_size,
+        "image_mtime": stat.st_mtime_ns,
+        "pipeline_version": pipeline_key()
+    }
+    return meta, face_normalized
+
+def template_is_current(meta, image_path: str):
+    """Stat-only check: template built by this pipeline from the image as it is on disk"""
+    if not meta or meta.get("pipeline_version") != pipeline_key():
+        return False
+    stat = os.stat(image_path)
+    return stat.st_size == meta["image_size"] and stat.st_mtime_ns == meta["image_mtime"]
+
+def template_is_valid(meta, image_path: str):
+    """Check template metadata against the stored image and pipeline version"""
+    if not meta or meta.get("pipeline_version") != pipeline_key():
+        return False
+    if template_is_current(meta, image_path):
+        return True
+    stat = os.stat(image_path)
+    # Touched but possibly unchanged: only the content hash decides
+    if _file_digest(image_path) != meta["image_sha1"]:
+        return False
+    meta["image_size"], meta["image_mtime"] = stat.st_size, stat.st_mtime_ns
+    return True
+
+def build_gallery_template(image_path):
+    """face_normalized of a stored gallery image, or None if no face is found"""
+    stored_img = cv2.imread(image_path)
+    if stored_img is None:
+        return None
+    stored_img = cv2.cvtColor(stored_img, cv2.COLOR_BGR2RGB)
+    mode = ENHANCEMENT_MODES["verify"]
+    stored_faces, source = detect_faces(stored_img, mode)
+    if len(stored_faces) == 0:
+        return None
+    return normalize_face(face_crop(source, stored_faces[0], mode))
+
+# User directory
+class UserDirectory:
+    """Case-insensitive name index over one snapshot's users
+    
+    Lookups are dict hits and a sorted key list answers prefix searches with
+    two bisections, so neither scans the users. `data` is the snapshot the
+    index describes; after a write, apply() carries it over to the new
+    snapshot with the user entries the write added and removed. Writes only
+    touch dicts: keys added and dropped since are merged into the sorted list
+    on the next prefix search, in one linear pass.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.users = {}
+        self.positions = {}
+        for i, user in enumerate(data["users"]):
+            key = user["name"].lower()
+            self.users[key] = user
+            self.positions[key] = i
+        self._keys = sorted(self.users)
+        self._added = set()
+        self._dropped = set()
+    
+    def get(self, name: str):
+        return self.users.get(name.lower())
+    
+    @property
+    def keys(self):
+        """Sorted keys of all users"""
+        if self._added or self._dropped:
+            keys = [key for key in self._keys if key not in self._dropped] if self._dropped else self._keys
+            keys.extend(sorted(self._added))
+            keys.sort()  # two sorted runs: a merge
+            self._keys, self._added, self._dropped = keys, set(), set()
+        return self._keys
+    
+    def take(self, users, entries):
+        """Remove these entries of self.data from `users`, a copy of its users list, in place
+        
+        Each freed slot is filled with the last user rather than shifting the
+        rest, so the list does not stay in registration order.
+        """
+        for i in sorted((self.positions[user["name"].lower()] for user in entries), reverse=True):
+            last = users.pop()
+            if i < len(users):
+                users[i] = last
+    
+    def _add(self, user):
+        key = user["name"].lower()
+        if key not in self.users:
+            self._added.add(key)
+        self.users[key] = user
+    
+    def _remove(self, user):
+        key = user["name"].lower()
+        if self.users.get(key) is not user:
+            return None
+        del self.users[key]
+        if key in self._added:
+            self._added.discard(key)
+        else:
+            self._dropped.add(key)
+        return self.positions.pop(key)
+    
+    def apply(self, data, added, removed):
+        """Follow a write from self.data to `data` that added and removed these entries; False if rebuilding is cheaper
+        
+        The write may fill the slots it freed (take(), in-place replacement)
+        and append; only those positions are re-indexed.
+        """
+        users = data["users"]
+        if len(removed) + len(added) > len(users) // 2:
+            return False
+        freed = [i for i in map(self._remove, removed) if i is not None]
+        for user in added:
+            self._add(user)
+        for i in freed + list(range(len(self.data["users"]) - len(freed), len(users))):
+            if i < len(users):
+                self.positions[users[i]["name"].lower()] = i
+        self.data = data
+        return all(users[self.positions[user["name"].lower()]] is user for user in added)
+    
+    def page(self, prefix: str = "", offset: int = 0, limit: int = None):
+        """(number of users whose name starts with prefix, those users from offset on, name order)"""
+        prefix = prefix.lower()
+        keys = self.keys
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + "\U0010ffff") if prefix else len(keys)
+        stop = end if limit is None else min(end, start + offset + limit)
+        return end - start, [self.users[key] for key in keys[start + offset:stop]]
+
+# Database Manager
+class FaceDatabase:
+    """User metadata in faces.json, descriptors in a binary FeatureStore
+    
+    Each user entry references a row of the store. Adds append rows, deletes
+    leave a tombstoned row behind, and the store is compacted once dead rows
+    outnumber live ones.
+    
+    `data` is a snapshot of faces.json that snapshot() reloads only when the
+    file changed on disk. Writes are serialized across threads and processes
+    by a lock file next to faces.json: each one re-reads the latest data,
+    applies its change to a copy and atomically replaces the file (temp file
+    + rename), so readers never wait and never see a partial file. Writes
+    replace snapshots and user entries, they never modify them in place.
+    """
+    HIST_FIELDS = ("lbp_hist", "hog_hist", "color_hist", "gray_hist", "edges_hist")
+    COMPACT_MIN_DEAD = 64
+    REFRESH_BATCH = 32   # stale templates rebuilt per write, so other writers get a turn
+    REPLACE_RETRIES = 20 # Windows refuses to replace a file a reader has open
+    
+    def __init__(self, db_path: str = "faces.json", store_dir: str = "gallery"):
+        self.db_path = db_path
+        self.store_dir = store_dir
+        self.store = None
+        self._face_norms = np.empty(0)
+        self._face_norms_generation = None
+        self._index = None
+        self._index_generation = None
+        self._compact = None
+        self._directory = None
+        self._directory_lock = threading.Lock()
+        self._user_changes = None
+        self._lock = FileLock(db_path + ".lock")
+        self._signature = None
+        self.data = None
+        self.snapshot()
+        self.import_json()
+    
+    @metrics.timed("load_database")
+    def load_database(self):
+        if os.path.exists(self.db_path):
+            with open(self.db_path, 'r') as f:
+                data = json.load(f)
+        else:
+            data = {"users": []}
+        # Follow compactions done by another process
+        generation = data.get("store_generation", 0)
+        if self.store is None:
+            self.store = FeatureStore(self.store_dir, generation)
+        elif generation != self.store.generation or not self.store.fields:
+            # ...or the first rows, written by another process
+            self.store.reload(generation)
+        return data
+    
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.db_path)
+        except FileNotFoundError:
+            return None
+        # Every write renames a new file into place, so the inode changes too
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    
+    def snapshot(self):
+        """Current data, re-read only if faces.json changed since it was loaded
+        
+        Costs one stat when nothing changed. The returned dict stays valid
+        (and unchanged) for as long as the caller holds it.
+        """
+        signature = self._file_signature()
+        if self.data is None or signature != self._signature:
+            data = self.load_database()
+            self.data, self._signature = data, signature
+        return self.data
+    
+    def snapshot_id(self):
+        """Identity of the current snapshot: changes with every write, by any process"""
+        return (self.data.get("version", 0), self._signature)
+    
+    def _write(self, data, generation=None):
+        """Atomically replace faces.json with `data` and make it the snapshot (lock held)"""
+        data["store_generation"] = self.store.generation if generation is None else generation
+        data["version"] = data.get("version", 0) + 1
+        tmp_path = f"{self.db_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        for attempt in range(self.REPLACE_RETRIES):
+            try:
+                os.replace(tmp_path, self.db_path)
+                break
+            except PermissionError:
+                if attempt == self.REPLACE_RETRIES - 1:
+                    raise
+                time.sleep(0.01 * (attempt + 1))
+        self.data, self._signature = data, self._file_signature()
+    
+    @metrics.timed("save_database")
+    def save_database(self):
+        """Write self.data as it is, replacing whatever is on disk"""
+        with self._lock:
+            self._write(self.data)
+    
+    @contextmanager
+    def _transaction(self):
+        """Serialized read-modify-write of the database
+        
+        Yields a copy of the latest data, re-read under the lock. On normal
+        exit it is written (if it changed) and becomes the snapshot, then the
+        store is compacted if needed. The users list is new, the user entries are
+        shared with the previous snapshot: replace them, do not modify them.
+        A writer that sets self._user_changes = (added, removed) entries keeps
+        the user directory up to date; after other writes it is rebuilt on
+        next use.
+        """
+        with self._lock:
+            latest = self.snapshot()
+            data = dict(latest, users=list(latest["users"]))
+            self._user_changes = None
+            yield data
+            changes, self._user_changes = self._user_changes, None
+            if data == latest:
+                # Nothing changed (e.g. deleting a missing user): no write, same snapshot
+                return
+            self._write(data)
+            with self._directory_lock:
+                if self._directory is not None and (
+                        self._directory.data is not latest or changes is None or not self._directory.apply(data, *changes)):
+                    self._directory = None
+            self._maybe_compact()
+            if self._index is not None:
+                self._sync_index()
+    
+    def import_json(self):
+        """Move descriptors stored inline in faces.json into the feature store
+        
+        Upgrades entries written before the binary store (float lists under
+        "features", templates as .npy files). A backup of the original file is
+        kept as faces.json.bak. Returns the number of imported users.
+        """
+        if not any("features" in u for u in self.data["users"]):
+            return 0
+        with self._transaction() as data:
+            data["users"] = copy.deepcopy(data["users"])
+            legacy = [u for u in data["users"] if "features" in u]
+            if legacy:
+                shutil.copyfile(self.db_path, self.db_path + ".bak")
+            
+            records = []
+            for user in legacy:
+                record = {field: np.array(user["features"][field], dtype=np.float64) for field in self.HIST_FIELDS}
+                record["face_normalized"] = np.zeros(FACE_SIZE, dtype=np.uint8)
+                meta = user.get("template")
+                if meta and meta.get("path") and os.path.exists(meta["path"]):
+                    record["face_normalized"] = np.load(meta["path"])
+                    meta["has_face"] = True
+                elif meta and "path" in meta and meta["path"] is None:
+                    meta["has_face"] = False
+                else:
+                    # No usable template: rebuilt on first verify or --migrate-templates
+                    meta = None
+                records.append(record)
+                user["template"] = meta
+            
+            for user, row in zip(legacy, self.store.append_many(records)):
+                old_template = (user["template"] or {}).pop("path", None)
+                if old_template:
+                    try:
+                        os.remove(old_template)
+                    except OSError:
+                        pass
+                del user["features"]
+                user["row"] = row
+        return len(legacy)
+    
+    def gallery(self):
+        """Stacked descriptor matrices of the store, indexed by user["row"]
+        
+        Includes the centered norms of the face templates. Rows are immutable
+        once written, so the norms are only computed for newly appended rows.
+        With a compact gallery configured (compact.GALLERY_PRECISION /
+        GALLERY_FACE_SIZE) the matrices are its in-memory compact copy.
+        """
+        rows = max(self._live_rows(), default=-1) + 1
+        gallery = self.store.matrices(rows)
+        if not gallery:
+            return gallery
+        if compact.compact_enabled():
+            if self._compact is None or not self._compact.matches(compact.GALLERY_PRECISION, compact.GALLERY_FACE_SIZE):
+                self._compact = compact.CompactGallery(compact.GALLERY_PRECISION, compact.GALLERY_FACE_SIZE)
+            return self._compact.update(gallery, self.store.generation)
+        faces = gallery['face_normalized']
+        if self._face_norms_generation != self.store.generation:
+            self._face_norms = np.empty(0)
+            self._face_norms_generation = self.store.generation
+        if len(self._face_norms) < len(faces):
+            self._face_norms = np.concatenate([self._face_norms, centered_norms(faces[len(self._face_norms):])])
+        gallery['face_normalized_norm'] = self._face_norms[:len(faces)]
+        return gallery
+    
+    def _row_vectors(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        gallery = self.store.matrices(int(rows.max()) + 1 if len(rows) else 0)
+        return ann_vectors({field: gallery[field][rows] for field in self.HIST_FIELDS}, ANN_WEIGHTS)
+    
+    def _save_index(self):
+        # Readers only persist their index updates when no writer holds the lock
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._index.save(os.path.join(self.store_dir, "ann_index.npz"), self.store.generation)
+        finally:
+            self._lock.release()
+    
+    def _sync_index(self):
+        """Bring the ANN index in line with the live rows, saving it if it changed"""
+        live = np.array([u["row"] for u in self.data["users"]], dtype=np.int64)
+        stale = np.setdiff1d(self._index.rows, live)
+        missing = np.setdiff1d(live, self._index.rows)
+        if len(stale):
+            self._index.remove(stale)
+        if len(missing):
+            self._index.add(missing, self._row_vectors(missing))
+        if len(stale) or len(missing):
+            self._save_index()
+    
+    def ann_index(self):
+        """IVF candidate index over the live rows
+        
+        Loaded from gallery/ann_index.npz (or built) on first use, then updated
+        incrementally for rows added or removed since, by any process.
+        """
+        if self._index is None or self._index_generation != self.store.generation:
+            path = os.path.join(self.store_dir, "ann_index.npz")
+            self._index = IVFIndex.load(path, self._row_vectors, self.store.generation) or IVFIndex()
+            self._index_generation = self.store.generation
+        self._sync_index()
+        return self._index
+    
+    def get_features(self, user: dict):
+        """Stored descriptors of a user (histograms + face_normalized)"""
+        return {name: np.asarray(value) for name, value in self.store.get(user["row"]).items()}
+    
+    @staticmethod
+    def samples(user: dict):
+        """Enrollment samples of a user ({"image", "row", "template"} dicts)
+        
+        Single-sample users are their own only sample; multi-sample users keep
+        them under "samples" while "row" holds the aggregate template.
+        """
+        return user.get("samples") or [user]
+    
+    def _live_rows(self):
+        rows = []
+        for user in self.data["users"]:
+            rows.append(user["row"])
+            rows.extend(sample["row"] for sample in user.get("samples", ()))
+        return rows
+    
+    def _aggregate_record(self, samples):
+        """(record, medoid) of the aggregate template: mean histograms + medoid face
+        
+        The medoid is the sample face with the highest total correlation to
+        the others; its image and template metadata stand for the user.
+        """
+        stored = [self.store.get(sample["row"]) for sample in samples]
+        record = {
+            field: np.mean([np.asarray(row[field], dtype=np.float64) for row in stored], axis=0)
+            for field in self.HIST_FIELDS
+        }
+        with_face = [i for i, sample in enumerate(samples) if sample["template"]["has_face"]] or list(range(len(samples)))
+        faces = np.stack([np.asarray(stored[i]["face_normalized"], dtype=np.float64).ravel() for i in with_face])
+        centered = faces - faces.mean(axis=1, keepdims=True)
+        centered /= np.maximum(np.linalg.norm(centered, axis=1, keepdims=True), 1e-12)
+        medoid = with_face[int(np.argmax((centered @ centered.T).sum(axis=1)))]
+        record["face_normalized"] = np.asarray(stored[medoid]["face_normalized"])
+        return record, medoid
+    
+    @staticmethod
+    def _use_aggregate(user, row, medoid):
+        sample = user["samples"][medoid]
+        user["row"] = row
+        user["image"] = sample["image"]
+        user["template"] = dict(sample["template"])
+    
+    def refresh_template(self, user: dict):
+        """Rebuild the user's template if the image or pipeline changed
+        
+        The new template is appended as a fresh row. Returns True when the user
+        entry changed and the database needs saving. For multi-sample users
+        every sample is checked and the aggregate is rebuilt if one changed.
+        Updates `user` in place, so it must be an entry the caller owns (see
+        refresh_templates for the users of the snapshot).
+        """
+        if "samples" in user:
+            rows = [sample["row"] for sample in user["samples"]]
+            changed = False
+            for sample in user["samples"]:
+                if os.path.exists(sample["image"]):
+                    changed |= self.refresh_template(sample)
+            if rows != [sample["row"] for sample in user["samples"]]:
+                record, medoid = self._aggregate_record(user["samples"])
+                self._use_aggregate(user, self.store.append(record), medoid)
+            return changed
+        meta = user.get("template")
+        before = dict(meta) if meta else None
+        if template_is_valid(meta, user["image"]):
+            return meta != before
+        meta, face_normalized = build_template(user["image"])
+        record = self.get_features(user)
+        record["face_normalized"] = face_normalized if face_normalized is not None else np.zeros(FACE_SIZE, dtype=np.uint8)
+        user["row"] = self.store.append(record)
+        user["template"] = meta
+        return True
+    
+    def _template_stale(self, user):
+        try:
+            return any(
+                os.path.exists(sample["image"]) and not template_is_current(sample.get("template"), sample["image"])
+                for sample in self.samples(user)
+            )
+        except OSError:
+            # Image removed while checking: the user is skipped as a candidate anyway
+            return False
+    
+    def refresh_templates(self):
+        """Rebuild the stale templates of the snapshot's users, returns the number of users updated
+        
+        Checking costs a stat per image. Stale users are rebuilt on copies and
+        written REFRESH_BATCH at a time; a user replaced by another writer
+        meanwhile is left to that writer's (fresh) template.
+        """
+        stale = [user for user in self.snapshot()["users"] if self._template_stale(user)]
+        updated = 0
+        for start in range(0, len(stale), self.REFRESH_BATCH):
+            with self._transaction() as data:
+                directory = self._user_directory()
+                added, removed = [], []
+                for user in stale[start:start + self.REFRESH_BATCH]:
+                    current = directory.get(user["name"])
+                    if current is None or current != user:
+                        continue
+                    i = directory.positions[user["name"].lower()]
+                    fresh = copy.deepcopy(user)
+                    self.refresh_template(fresh)
+                    removed.append(data["users"][i])
+                    data["users"][i] = fresh
+                    added.append(fresh)
+                    updated += 1
+                self._user_changes = (added, removed)
+        return updated
+    
+    def _maybe_compact(self):
+        live_rows = self._live_rows()
+        dead = self.store.rows - len(live_rows)
+        if dead <= max(self.COMPACT_MIN_DEAD, len(live_rows)):
+            return
+        def commit(mapping, generation):
+            # Metadata first: a crash before the layout switch is recovered on load
+            data = copy.deepcopy(self.data)
+            for user in data["users"]:
+                user["row"] = mapping[user["row"]]
+                for sample in user.get("samples", ()):
+                    sample["row"] = mapping[sample["row"]]
+            self._write(data, generation)
+        mapping = self.store.compact(live_rows, commit)
+        if self._index is not None:
+            self._index.remap(mapping)
+            self._index_generation = self.store.generation
+            self._save_index()
+    
+    def add_user(self, name: str, image_path: str, features: dict):
+        template, face_normalized = build_template(image_path)
+        self.add_users([(name, image_path, features, template, face_normalized)])
+    
+    def add_users(self, entries, append: bool = False):
+        """Add (or replace) users with one store write and one save
+        
+        `entries` are (name, image_path, features, template, face_normalized)
+        tuples, the last two as returned by build_template. Several entries
+        with the same name become one multi-sample user with an aggregate
+        template; with `append` they are added to the user's existing samples
+        instead of replacing the user.
+        """
+        entries = list(entries)
+        if not entries:
+            return
+        groups = {}
+        for entry in entries:
+            groups.setdefault(entry[0].lower(), []).append(entry)
+        records = []
+        for name, image_path, features, template, face_normalized in entries:
+            record = {field: features[field] for field in self.HIST_FIELDS}
+            record["face_normalized"] = face_normalized if face_normalized is not None else np.zeros(FACE_SIZE, dtype=np.uint8)
+            records.append(record)
+        
+        with self._transaction() as data:
+            directory = self._user_directory()
+            existing = {key: directory.get(key) for key in groups if directory.get(key) is not None}
+            
+            # Remove existing users if present (and delete old images), unless appending samples
+            kept_samples = {}
+            for key, existing_user in existing.items():
+                if append:
+                    kept_samples[key] = [
+                        {"image": s["image"], "row": s["row"], "template": s["template"]}
+                        for s in self.samples(existing_user)
+                    ]
+                    continue
+                for sample in self.samples(existing_user):
+                    if os.path.exists(sample["image"]):
+                        try:
+                            os.remove(sample["image"])
+                        except:
+                            pass
+            
+            directory.take(data["users"], existing.values())
+            
+            # Add new users with pre-computed features and gallery templates
+            new_samples = {}
+            for (name, image_path, _, template, _), row in zip(entries, self.store.append_many(records)):
+                new_samples.setdefault(name.lower(), []).append({"image": image_path, "row": row, "template": template})
+            
+            registered_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            aggregates = []
+            added = []
+            for key, group in groups.items():
+                samples = kept_samples.get(key, []) + new_samples[key]
+                user = {"name": group[-1][0], "registered_at": existing[key]["registered_at"] if key in kept_samples else registered_at}
+                if len(samples) == 1:
+                    user.update(samples[0])
+                else:
+                    user["samples"] = samples
+                    aggregates.append((user,) + self._aggregate_record(samples))
+                data["users"].append(user)
+                added.append(user)
+            rows = self.store.append_many(record for _, record, _ in aggregates)
+            for (user, _, medoid), row in zip(aggregates, rows):
+                self._use_aggregate(user, row, medoid)
+            self._user_changes = (added, list(existing.values()))
+    
+    def delete_user(self, name: str):
+        """Remove a user and their stored images, returns False if there is no such user"""
+        return bool(self.delete_users([name]))
+    
+    def delete_users(self, names):
+        """Remove several users (names are case-insensitive) in one write, returns the names removed"""
+        with self._transaction() as data:
+            directory = self._user_directory()
+            found = {}
+            for name in names:
+                user = directory.get(name)
+                if user is not None:
+                    found[id(user)] = user
+            for user in found.values():
+                for sample in self.samples(user):
+                    if os.path.exists(sample["image"]):
+                        os.remove(sample["image"])
+            directory.take(data["users"], found.values())
+            self._user_changes = ([], list(found.values()))
+        return [user["name"] for user in found.values()]
+    
+    def _user_directory(self):
+        """UserDirectory of the current snapshot, built once per snapshot and then kept up to date"""
+        data = self.snapshot()
+        with self._directory_lock:
+            if self._directory is None or self._directory.data is not data:
+                self._directory = UserDirectory(data)
+            return self._directory
+    
+    def find_user(self, name: str):
+        """The user entry with this name (case-insensitive), or None"""
+        directory = self._user_directory()
+        with self._directory_lock:
+            return directory.get(name)
+    
+    def list_users(self, prefix: str = "", offset: int = 0, limit: int = None):
+        """(total, [(name, registered_at, image), ...]) of users whose name starts with prefix, in name order
+        
+        Only the requested page is materialized, so listing costs do not grow
+        with the gallery.
+        """
+        directory = self._user_directory()
+        with self._directory_lock:
+            total, users = directory.page(prefix, offset, limit)
+        return total, [(u["name"], u.get("registered_at", "Unknown"), u["image"]) for u in users]
+    
+    def get_all_users(self):
+        # Pick up users written since the last call (a stat when nothing changed)
+        users = self.snapshot()["users"]
+        return [(u["name"], u.get("registered_at", "Unknown"), u["image"]) for u in users]
+
+FACES_DIR = "faces"
+
+def __getattr__(name):
+    # The shared database is opened on first use of `database.db`, not at import
+    if name == "db":
+        global db
+        db = FaceDatabase()
+        return db
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
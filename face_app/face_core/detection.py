@@ -0,0 +1,205 @@
+"""
+Face detection
+Haar cascade detector and the image enhancement tiers applied around it
+"""
+import threading
+
+import cv2
+import numpy as np
+
+from .buffers import frame_context
+from .metrics import metrics
+
+
+# Face detection
+CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+# Detection stages, tried in order until one finds a face. Sizes are in
+# full-frame pixels. The defaults are the original primary and fallback passes.
+DETECTION_STAGES = (
+    {"scale_factor": 1.05, "min_neighbors": 5, "min_size": 120},
+    {"scale_factor": 1.1, "min_neighbors": 4, "min_size": 100},
+)
+# Frames are downscaled to at most this side before detection (None = full res)
+DETECTION_MAX_SIDE = 640
+# Answer all stages from a single cascade pass (the loosest stage) instead of
+# one pass per stage: cheaper when no face is present, dearer when the first
+# stage would have succeeded on its own
+DETECTION_SINGLE_PASS = False
+
+def scaled_shape(shape, scale):
+    """(rows, cols) of cv2.resize(image, None, fx=scale, fy=scale), for its dst buffer"""
+    return (int(round(shape[0] * scale)), int(round(shape[1] * scale))) + tuple(shape[2:])
+
+class FaceDetector:
+    """Haar cascade face detector, safe to share between threads
+    
+    The cascade is loaded once per thread (CascadeClassifier is not safe for
+    concurrent use) and large frames are downscaled before detection, with
+    boxes mapped back to full-frame coordinates. The grayscale working images
+    live in the thread's FrameContext buffers.
+    """
+    def __init__(self, cascade_path: str = CASCADE_PATH, stages=DETECTION_STAGES,
+                 max_side=DETECTION_MAX_SIDE, single_pass: bool = DETECTION_SINGLE_PASS):
+        self.cascade_path = cascade_path
+        self.stages = stages
+        self.max_side = max_side
+        self.single_pass = single_pass
+        self._local = threading.local()
+    
+    def _cascade(self):
+        cascade = getattr(self._local, "cascade", None)
+        if cascade is None:
+            cascade = self._local.cascade = cv2.CascadeClassifier(self.cascade_path)
+            if cascade.empty():
+                raise RuntimeError(f"Could not load face cascade from {self.cascade_path}")
+        return cascade
+    
+    def _run(self, gray, scale_factor, min_neighbors, min_size):
+        faces, hits = self._cascade().detectMultiScale2(
+            gray,
+            scaleFactor=scale_factor,
+            minNeighbors=min_neighbors,
+            minSize=(min_size, min_size),
+            flags=cv2.CASCADE_SCALE_IMAGE
+        )
+        return np.asarray(faces, dtype=np.float64).reshape(-1, 4), np.asarray(hits).ravel()
+    
+    @metrics.timed("detect")
+    def detect(self, image, scale: float = 1.0):
+        """Face boxes (x, y, w, h) in full-frame coordinates (RGB or grayscale input)
+        
+        `scale` is the factor by which `image` was already downscaled from the
+        full frame (as the fast enhancement tier does), so stage sizes and the
+        returned boxes stay in full-frame pixels.
+        """
+        context = frame_context()
+        gray = image if image.ndim == 2 else cv2.cvtColor(
+            image, cv2.COLOR_RGB2GRAY, dst=context.buffer("detect_gray", image.shape[:2]))
+        if self.max_side and max(gray.shape) > self.max_side:
+            shrink = self.max_side / max(gray.shape)
+            gray = cv2.resize(gray, None, dst=context.buffer("detect_small", scaled_shape(gray.shape, shrink)),
+                              fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA)
+            scale *= shrink
+        gray = cv2.equalizeHist(gray, dst=context.buffer("detect_equalized", gray.shape))
+        
+        if self.single_pass:
+            # numDetections is the merged hit count, so every stage's
+            # min_neighbors can be applied to the loosest pass afterwards
+            faces, hits = self._run(
+                gray,
+                self.stages[0]["scale_factor"],
+                min(stage["min_neighbors"] for stage in self.stages),
+                int(round(min(stage["min_size"] for stage in self.stages) * scale))
+            )
+            for stage in self.stages:
+                keep = (hits > stage["min_neighbors"]) & (np.minimum(faces[:, 2], faces[:, 3]) >= stage["min_size"] * scale - 0.5)
+                if keep.any():
+                    return np.round(faces[keep] / scale).astype(np.int32)
+        else:
+            for stage in self.stages:
+                faces, _ = self._run(gray, stage["scale_factor"], stage["min_neighbors"], int(round(stage["min_size"] * scale)))
+                if len(faces) > 0:
+                    return np.round(faces / scale).astype(np.int32)
+        return np.empty((0, 4), dtype=np.int32)
+
+face_detector = FaceDetector()
+
+def detect_face(image):
+    """Advanced face detection"""
+    return face_detector.detect(image)
+
+def detect_blur(image):
+    """Detect if image is blurry using Laplacian variance"""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    return laplacian_var
+
+# Enhancement tiers
+#   "full": CLAHE on L, colour denoise and sharpen (the original enhancement)
+#   "fast": CLAHE on a downscaled luma only, enough for the face detector
+#   "none": image returned unchanged
+ENHANCE_TIERS = ("none", "fast", "full")
+
+# Enhancement mode per call site
+#   "legacy": full tier on the whole frame, detection and crop from it
+#   "tiered": fast tier for detection, full tier on the face crop only
+#   "none":   no enhancement at all (register_user's original behaviour)
+# The verify mode also builds the gallery templates, so probes and templates
+# always go through the same path. It stays on "legacy": on `benchmark.py
+# enhance` tiered is ~5x faster but agrees with legacy on only 86% of rank-1
+# matches, so switching needs a recognition check first. Stream frames only
+# feed the quality checks and take the fast path.
+ENHANCEMENT_MODES = {"stream": "tiered", "verify": "legacy", "register": "none"}
+
+def enhance_image_quality(image, tier="full"):
+    """Enhance image for better recognition
+    
+    The "fast" tier returns a single-channel image scaled down to at most
+    DETECTION_MAX_SIDE; the other tiers keep the input size and channels.
+    """
+    if tier == "none":
+        return image
+    if tier == "fast":
+        return _enhance_fast(image)
+    if tier == "full":
+        return _enhance_full(image)
+    raise ValueError(f"Unknown enhancement tier '{tier}', expected one of {ENHANCE_TIERS}")
+
+CLAHE_CLIP_LIMIT = 3.0
+SHARPEN_KERNEL = np.array([[-1,-1,-1],
+                           [-1, 9,-1],
+                           [-1,-1,-1]], dtype=np.float32)
+SHARPEN_KERNEL.flags.writeable = False
+
+@metrics.timed("enhance", tier="fast")
+def _enhance_fast(image, keep=False):
+    # With `keep` the result stays in the thread's buffers (valid until its next fast enhancement)
+    context = frame_context()
+    luma = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY, dst=context.buffer("fast_luma", image.shape[:2]))
+    if DETECTION_MAX_SIDE and max(luma.shape) > DETECTION_MAX_SIDE:
+        scale = DETECTION_MAX_SIDE / max(luma.shape)
+        luma = cv2.resize(luma, None, dst=context.buffer("fast_small", scaled_shape(luma.shape, scale)),
+                          fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    clahe = context.clahe(CLAHE_CLIP_LIMIT)
+    return clahe.apply(luma, dst=context.buffer("fast_out", luma.shape) if keep else None)
+
+@metrics.timed("enhance", tier="full")
+def _enhance_full(image):
+    context = frame_context()
+    # Convert to LAB color space
+    lab = cv2.cvtColor(image, cv2.COLOR_RGB2LAB, dst=context.buffer("full_lab", image.shape))
+    l = cv2.extractChannel(lab, 0, dst=context.buffer("full_l", image.shape[:2]))
+    
+    # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization) to L, in place in the LAB image
+    l = context.clahe(CLAHE_CLIP_LIMIT).apply(l, dst=context.buffer("full_l_clahe", image.shape[:2]))
+    cv2.insertChannel(l, lab, 0)
+    enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB, dst=context.buffer("full_rgb", image.shape))
+    
+    # Denoise
+    enhanced = cv2.fastNlMeansDenoisingColored(enhanced, context.buffer("full_denoised", image.shape), 10, 10, 7, 21)
+    
+    # Sharpen (the only fresh array: it is the result)
+    return cv2.filter2D(enhanced, -1, SHARPEN_KERNEL)
+
+def detect_faces(image, mode, detector=None):
+    """Face boxes for an enhancement mode, and the frame to crop them from
+    
+    Boxes are always in the coordinates of `image`.
+    """
+    detector = detector or face_detector
+    if mode == "legacy":
+        enhanced = enhance_image_quality(image, "full")
+        return detector.detect(enhanced), enhanced
+    if mode == "tiered":
+        # The luma only feeds the detector, so it can stay in the thread's buffers
+        luma = _enhance_fast(image, keep=True)
+        return detector.detect(luma, luma.shape[1] / image.shape[1]), image
+    if mode == "none":
+        return detector.detect(image), image
+    raise ValueError(f"Unknown enhancement mode '{mode}'")
+
+def face_crop(source, box, mode):
+    """Face region of the frame returned by detect_faces, enhanced as the mode requires"""
+    (x, y, w, h) = box
+    crop = source[y:y+h, x:x+w]
+    return enhance_image_quality(crop, "full") if mode == "tiered" else crop
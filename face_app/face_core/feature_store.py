@@ -0,0 +1,187 @@
+"""
+Binary feature store for the face gallery
+Fixed-width descriptor rows in memory-mapped files + a small layout sidecar
+"""
+import os
+import json
+import numpy as np
+
+
+class FeatureStore:
+    """Append-only matrix store, one memory-mapped file per descriptor field
+
+    Every field (lbp_hist, ..., face_normalized) is a contiguous
+    (rows, *shape) array in `<field>.<generation>.bin`. Rows are only ever
+    appended; deleting a user just stops referencing its row (tombstone) and
+    `compact()` rewrites the live rows into a new generation. Opening the store
+    maps the files without reading them, so startup cost does not grow with
+    the number of descriptors.
+    """
+    LAYOUT_FILE = "layout.json"
+
+    def __init__(self, store_dir: str = "gallery", generation: int = None):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self.generation = 0
+        self.fields = {}
+        self._maps = None
+        self.reload(generation)
+
+    def reload(self, generation: int = None):
+        """Re-read the layout sidecar and drop the current mappings
+
+        `generation` is the generation the caller's metadata refers to. If a
+        compaction was interrupted after the metadata was committed but before
+        the layout switch, the switch is completed here.
+        """
+        layout_path = os.path.join(self.store_dir, self.LAYOUT_FILE)
+        if os.path.exists(layout_path):
+            with open(layout_path, 'r') as f:
+                layout = json.load(f)
+            self.generation = layout["generation"]
+            self.fields = {
+                name: (np.dtype(spec["dtype"]), tuple(spec["shape"]))
+                for name, spec in layout["fields"].items()
+            }
+        if (generation is not None and generation != self.generation and self.fields
+                and all(os.path.exists(self._field_path(name, generation)) for name in self.fields)):
+            self.generation = generation
+            self._write_layout()
+        self._maps = None
+        self._remove_stale_generations()
+
+    def _field_path(self, name, generation=None):
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.store_dir, f"{name}.{generation}.bin")
+
+    @staticmethod
+    def _row_bytes(dtype, shape):
+        return int(dtype.itemsize * np.prod(shape, dtype=np.int64))
+
+    def _write_layout(self):
+        layout = {
+            "generation": self.generation,
+            "fields": {
+                name: {"dtype": dtype.str, "shape": list(shape)}
+                for name, (dtype, shape) in self.fields.items()
+            }
+        }
+        layout_path = os.path.join(self.store_dir, self.LAYOUT_FILE)
+        tmp_path = layout_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(layout, f, indent=2)
+        os.replace(tmp_path, layout_path)
+
+    def _remove_stale_generations(self):
+        for filename in os.listdir(self.store_dir):
+            parts = filename.split(".")
+            # Only older generations: a newer one may be a compaction in progress in another process
+            if len(parts) == 3 and parts[2] == "bin" and parts[1].isdigit() and int(parts[1]) < self.generation:
+                try:
+                    os.remove(os.path.join(self.store_dir, filename))
+                except OSError:
+                    # Still mapped elsewhere (Windows); retried on next reload
+                    pass
+
+    @property
+    def rows(self):
+        """Number of complete rows (a torn trailing write is ignored)"""
+        if not self.fields:
+            return 0
+        counts = []
+        for name, (dtype, shape) in self.fields.items():
+            path = self._field_path(name)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            counts.append(size // self._row_bytes(dtype, shape))
+        return min(counts)
+
+    def _open_maps(self):
+        rows = self.rows
+        maps = {}
+        for name, (dtype, shape) in self.fields.items():
+            if rows == 0:
+                maps[name] = np.empty((0,) + shape, dtype=dtype)
+            else:
+                maps[name] = np.memmap(self._field_path(name), dtype=dtype, mode='r', shape=(rows,) + shape)
+        self._maps = maps
+
+    def matrix(self, name: str):
+        """Read-only (rows, *shape) view of one field"""
+        if self._maps is None:
+            self._open_maps()
+        return self._maps[name]
+
+    def matrices(self, min_rows: int = 0):
+        """Read-only views of all fields, remapped if they hold fewer than `min_rows`"""
+        if self._maps is not None and min_rows > len(next(iter(self._maps.values()))):
+            # Appended since the files were mapped (possibly by another process)
+            self._maps = None
+        return {name: self.matrix(name) for name in self.fields}
+
+    def get(self, row: int):
+        """All fields of one row as read-only arrays"""
+        return {name: matrix[row] for name, matrix in self.matrices(row + 1).items()}
+
+    def _check_record(self, record):
+        if not self.fields:
+            # First write defines the layout
+            self.fields = {
+                name: (np.asarray(value).dtype if np.asarray(value).dtype == np.uint8 else np.dtype(np.float64),
+                       np.asarray(value).shape)
+                for name, value in record.items()
+            }
+            self._write_layout()
+        if set(record) != set(self.fields):
+            raise ValueError(f"Record fields {sorted(record)} do not match store fields {sorted(self.fields)}")
+        for name, (dtype, shape) in self.fields.items():
+            if np.asarray(record[name]).shape != shape:
+                raise ValueError(
+                    f"Field '{name}' has shape {np.asarray(record[name]).shape}, store expects {shape}. "
+                    "Re-register users after changing the feature pipeline."
+                )
+
+    def append_many(self, records):
+        """Append records (dicts of field -> array), returns their row indices"""
+        records = list(records)
+        if not records:
+            return []
+        for record in records:
+            self._check_record(record)
+        start = self.rows
+        for name, (dtype, shape) in self.fields.items():
+            block = np.stack([np.asarray(record[name], dtype=dtype) for record in records])
+            path = self._field_path(name)
+            # Position explicitly so a torn write from a crash gets overwritten
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+                f.seek(start * self._row_bytes(dtype, shape))
+                f.write(block.tobytes())
+        self._maps = None
+        return list(range(start, start + len(records)))
+
+    def append(self, record: dict):
+        """Append one record, returns its row index"""
+        return self.append_many([record])[0]
+
+    def compact(self, live_rows, commit=None):
+        """Rewrite only `live_rows` (in that order) into a new generation
+
+        `commit(mapping, generation)` is called once the new files are written
+        and before the layout switches to them, so the caller can persist the
+        remapped row indices first. Returns the old row -> new row mapping.
+        """
+        live_rows = list(live_rows)
+        new_generation = self.generation + 1
+        # Map every live row, including rows appended by other processes since the last read
+        sources = self.matrices(max(live_rows, default=-1) + 1)
+        for name in self.fields:
+            source = sources[name]
+            with open(self._field_path(name, new_generation), 'wb') as f:
+                for row in live_rows:
+                    f.write(np.ascontiguousarray(source[row]).tobytes())
+        mapping = {old: new for new, old in enumerate(live_rows)}
+        if commit is not None:
+            commit(mapping, new_generation)
+        self.generation = new_generation
+        self._write_layout()
+        self.reload()
+        return mapping
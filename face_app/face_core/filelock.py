@@ -0,0 +1,90 @@
+"""
+Inter-process file lock
+Exclusive lock on a sidecar file: fcntl.flock on POSIX, msvcrt.locking on Windows
+"""
+import os
+import threading
+import time
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock(f, blocking):
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.005)
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(f, blocking):
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class FileLock:
+    """Exclusive lock shared by threads and processes, re-entrant within a thread
+
+    The lock file is opened per acquisition, so threads of one process exclude
+    each other as well as other processes. The lock is released if the
+    holding process dies.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._file = None
+        self._depth = 0
+
+    def acquire(self, blocking: bool = True):
+        """Take the lock; with blocking=False returns False instead of waiting"""
+        if not self._thread_lock.acquire(blocking):
+            return False
+        if self._depth == 0:
+            f = None
+            try:
+                f = open(self.path, 'a+b')
+                locked = _lock(f, blocking)
+            except BaseException:
+                if f is not None:
+                    f.close()
+                self._thread_lock.release()
+                raise
+            if not locked:
+                f.close()
+                self._thread_lock.release()
+                return False
+            self._file = f
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                _unlock(self._file)
+            finally:
+                self._file.close()
+                self._file = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,299 @@
+"""
+Batched 1:N matching
+Vectorized fused scores of one probe against the stacked gallery matrices
+"""
+import numpy as np
+
+from .ann_index import ann_vectors
+from .features import downsample_face
+from .metrics import metrics
+
+
+# Batched 1:N matching
+# Fusion weights of compare_advanced_features
+MATCH_WEIGHTS = {
+    'lbp_hist': 0.30, 'hog_hist': 0.25, 'color_hist': 0.15,
+    'gray_hist': 0.10, 'edges_hist': 0.10, 'face_normalized': 0.10
+}
+BASE_THRESHOLD = 0.60  # Lowered from 0.68 for better recognition
+UNCERTAIN_GAP = 0.05
+MATCH_CHUNK_ROWS = 256
+
+# Galleries of ANN_MIN_GALLERY users or more are first narrowed to an IVF
+# shortlist of ANN_SHORTLIST candidates, which is then scored exactly
+ANN_MIN_GALLERY = 2000
+ANN_SHORTLIST = 256
+ANN_WEIGHTS = {field: weight for field, weight in MATCH_WEIGHTS.items() if field != 'face_normalized'}
+
+def _positive(values):
+    # max(0, x) as in compare_advanced_features, where NaN also gives 0
+    return np.where(values > 0, values, 0.0)
+
+def _row_correlations(probe, gallery):
+    """Pearson correlation (np.corrcoef) of a probe vector with every gallery row"""
+    probe = np.asarray(probe, dtype=np.float64).ravel()
+    gallery = np.asarray(gallery, dtype=np.float64).reshape(len(gallery), -1)
+    p = probe - probe.mean()
+    g = gallery - gallery.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (g @ p) / np.sqrt(np.einsum('ij,ij->i', g, g) * (p @ p))
+
+def _row_chi_square(probe, gallery):
+    """cv2.HISTCMP_CHISQR(probe, row) for every gallery row"""
+    # compareHist sees float32 inputs and skips bins where the probe is zero
+    p = np.asarray(probe, dtype=np.float32).astype(np.float64).ravel()
+    g = np.asarray(gallery, dtype=np.float32).astype(np.float64)
+    mask = np.abs(p) > np.finfo(np.float64).eps
+    diff = g[:, mask] - p[mask]
+    return (diff * diff) @ (1.0 / p[mask])
+
+def fuse_scores(components):
+    """Fused 0..1 score from per-component arrays, same weighting as compare_advanced_features"""
+    lbp_score = (components['lbp_corr'] + (1 - np.minimum(components['lbp_chi'] / 100, 1))) / 2
+    total = lbp_score * MATCH_WEIGHTS['lbp_hist']
+    for field in ('hog_hist', 'color_hist', 'gray_hist', 'edges_hist', 'face_normalized'):
+        total = total + _positive(components[field]) * MATCH_WEIGHTS[field]
+    return np.nan_to_num(np.clip(total, 0, 1), nan=0.0)
+
+def centered_norms(matrix):
+    """L2 norm of every row after subtracting its mean (chunked, float64)"""
+    matrix = matrix.reshape(len(matrix), -1)
+    norms = np.empty(len(matrix), dtype=np.float64)
+    for start in range(0, len(matrix), MATCH_CHUNK_ROWS):
+        chunk = matrix[start:start + MATCH_CHUNK_ROWS].astype(np.float64)
+        sums = chunk.sum(axis=1)
+        squares = np.einsum('ij,ij->i', chunk, chunk)
+        norms[start:start + len(chunk)] = np.sqrt(np.maximum(squares - sums * sums / chunk.shape[1], 0))
+    return norms
+
+def score_gallery(probe, gallery, rows=None):
+    """Fused scores of one probe against gallery rows in one vectorized pass
+    
+    `gallery` maps each field to a stacked (N, ...) matrix, e.g. the feature
+    store matrices; `rows` selects the rows to score (all by default). An
+    optional 'face_normalized_norm' entry holds precomputed centered_norms of
+    the face matrix. The gallery is read in chunks, so memory-mapped matrices
+    are never copied whole.
+    
+    Compact galleries (see compact.py) are scored as they are: histograms
+    of any dtype, '<field>_scale' row scales of uint8 histograms, and face
+    templates smaller than the probe's, which is downsampled to match.
+    """
+    n_total = len(gallery['lbp_hist'])
+    rows = np.arange(n_total) if rows is None else np.asarray(rows, dtype=np.int64)
+    scores = np.empty(len(rows), dtype=np.float64)
+    face_norms = gallery.get('face_normalized_norm')
+    
+    # Zero-mean probe: its dot product with a raw row equals the one with the centered row
+    face = downsample_face(np.asarray(probe['face_normalized']), gallery['face_normalized'].shape[1:])
+    face = face.astype(np.float64).ravel()
+    face = face - face.mean()
+    face_norm = np.sqrt(face @ face)
+    face = face.astype(np.float32)
+    # Correlations ignore a row's scale; the chi-square needs the real values
+    lbp_scale = gallery.get('lbp_hist_scale')
+    
+    for start in range(0, len(rows), MATCH_CHUNK_ROWS):
+        chunk = rows[start:start + MATCH_CHUNK_ROWS]
+        lbp = gallery['lbp_hist'][chunk]
+        components = {
+            'lbp_corr': _row_correlations(probe['lbp_hist'], lbp),
+            'lbp_chi': _row_chi_square(probe['lbp_hist'], lbp if lbp_scale is None else lbp * lbp_scale[chunk, None]),
+        }
+        for field in ('hog_hist', 'color_hist', 'gray_hist', 'edges_hist'):
+            components[field] = _row_correlations(probe[field], gallery[field][chunk])
+        # TM_CCOEFF_NORMED between equal-size images is the pixel correlation
+        faces = gallery['face_normalized'][chunk].reshape(len(chunk), -1)
+        norms = face_norms[chunk] if face_norms is not None else centered_norms(faces)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            components['face_normalized'] = (faces.astype(np.float32) @ face) / (norms * face_norm)
+        scores[start:start + len(chunk)] = fuse_scores(components)
+    return scores
+
+def match_gallery(probe, gallery, rows=None, top_k=5):
+    """Score a probe against the whole gallery and rank the results
+    
+    Returns a dict with all `scores` (aligned with `rows`), the `top` k
+    (position, score) pairs best first, and the best-vs-second `gap` used for
+    the UNCERTAIN decision (None with fewer than two candidates).
+    """
+    scores = score_gallery(probe, gallery, rows)
+    # Stable sort keeps the first row on ties, like the old loop
+    order = np.argsort(-scores, kind='stable')[:top_k]
+    top = [(int(i), float(scores[i])) for i in order]
+    gap = top[0][1] - top[1][1] if len(top) >= 2 else None
+    return {"scores": scores, "top": top, "gap": gap}
+
+def _matrix_correlations(probes, gallery):
+    """Pearson correlations of (M, d) probe vectors with (N, d) gallery rows: (N, M)"""
+    probes = np.asarray(probes, dtype=np.float64).reshape(len(probes), -1)
+    gallery = np.asarray(gallery, dtype=np.float64).reshape(len(gallery), -1)
+    p = probes - probes.mean(axis=1, keepdims=True)
+    g = gallery - gallery.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (g @ p.T) / np.sqrt(np.outer(np.einsum('ij,ij->i', g, g), np.einsum('ij,ij->i', p, p)))
+
+def score_matrix(probes, gallery, rows=None):
+    """Fused scores of several probes against gallery rows: (len(probes), len(rows))
+    
+    score_gallery for a batch of probes (e.g. every face of a frame): each
+    gallery chunk is read once and the correlations and face terms of all
+    probes come out of one matrix product per field, instead of one
+    matrix-vector product per probe. Scores equal score_gallery's up to
+    float rounding.
+    """
+    n_total = len(gallery['lbp_hist'])
+    rows = np.arange(n_total) if rows is None else np.asarray(rows, dtype=np.int64)
+    scores = np.empty((len(probes), len(rows)), dtype=np.float64)
+    if not len(probes):
+        return scores
+    face_norms = gallery.get('face_normalized_norm')
+    
+    faces_probe = np.stack([downsample_face(np.asarray(probe['face_normalized']), gallery['face_normalized'].shape[1:])
+                            for probe in probes]).reshape(len(probes), -1).astype(np.float64)
+    faces_probe = faces_probe - faces_probe.mean(axis=1, keepdims=True)
+    faces_probe_norm = np.sqrt(np.einsum('ij,ij->i', faces_probe, faces_probe))
+    faces_probe = faces_probe.astype(np.float32).T
+    lbp_scale = gallery.get('lbp_hist_scale')
+    stacked = {field: np.stack([np.asarray(probe[field]).ravel() for probe in probes])
+               for field in ('lbp_hist', 'hog_hist', 'color_hist', 'gray_hist', 'edges_hist')}
+    
+    for start in range(0, len(rows), MATCH_CHUNK_ROWS):
+        chunk = rows[start:start + MATCH_CHUNK_ROWS]
+        lbp = gallery['lbp_hist'][chunk]
+        lbp_real = lbp if lbp_scale is None else lbp * lbp_scale[chunk, None]
+        components = {
+            'lbp_corr': _matrix_correlations(stacked['lbp_hist'], lbp),
+            # The probe's zero bins are skipped, so the chi-square stays per probe
+            'lbp_chi': np.stack([_row_chi_square(probe['lbp_hist'], lbp_real) for probe in probes], axis=1),
+        }
+        for field in ('hog_hist', 'color_hist', 'gray_hist', 'edges_hist'):
+            components[field] = _matrix_correlations(stacked[field], gallery[field][chunk])
+        faces = gallery['face_normalized'][chunk].reshape(len(chunk), -1)
+        norms = face_norms[chunk] if face_norms is not None else centered_norms(faces)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            components['face_normalized'] = (faces.astype(np.float32) @ faces_probe) / np.outer(norms, faces_probe_norm)
+        scores[:, start:start + len(chunk)] = fuse_scores(components).T
+    return scores
+
+# Cascaded matching: components from cheapest to most expensive, with the
+# descriptor values read per row as their cost
+CASCADE_STAGES = (('small', ('hog_hist', 'color_hist', 'gray_hist', 'edges_hist')), ('lbp', ('lbp_hist',)),
+                  ('face', ('face_normalized',)))
+CASCADE_MIN_ROWS = 64  # smaller scans are scored in full
+CASCADE_SEED = 32      # best-bounded rows scored in full first, to set the running top-k bound
+# Bound slack per unit of match weight. The face correlation is a float32 dot product and
+# can exceed 1 by a few float32 ulps (measured up to 6), so a row's exact score can top the
+# bound that assumes at most the face weight; a row is dropped only when clearly out
+CASCADE_SLACK = 64 * float(np.finfo(np.float32).eps)
+
+def match_gallery_cascade(probe, gallery, rows=None, top_k=5, floor=None):
+    """match_gallery's top-k and gap, skipping rows that provably cannot make the top-k
+    
+    Components are computed cheapest first (the four small histograms, then
+    LBP, then the face template). Every component adds at most its weight,
+    so after each step a row's fused score is bounded by its known part plus
+    the weights still missing. Rows whose bound is below the k-th best exact
+    score so far are dropped; the survivors are scored exactly as
+    score_gallery scores them, so top and gap equal match_gallery's. A
+    `floor` also drops rows that cannot reach it, which shortens the top-k
+    when fewer rows do. Returns {"top", "gap", "work_skipped"}, the last being
+    the fraction of descriptor values never read.
+    """
+    n_total = len(gallery['lbp_hist'])
+    rows = np.arange(n_total) if rows is None else np.asarray(rows, dtype=np.int64)
+    if len(rows) < CASCADE_MIN_ROWS:
+        match = match_gallery(probe, gallery, rows, top_k)
+        return {"top": match["top"], "gap": match["gap"], "work_skipped": 0.0}
+    
+    face = downsample_face(np.asarray(probe['face_normalized']), gallery['face_normalized'].shape[1:])
+    face = face.astype(np.float64).ravel()
+    face = face - face.mean()
+    face_norm = np.sqrt(face @ face)
+    face = face.astype(np.float32)
+    face_norms = gallery.get('face_normalized_norm')
+    lbp_scale = gallery.get('lbp_hist_scale')
+    costs = {stage: sum(int(np.prod(gallery[field].shape[1:])) for field in fields) for stage, fields in CASCADE_STAGES}
+    
+    n = len(rows)
+    components = {name: np.full(n, np.nan) for name in
+                  ('lbp_corr', 'lbp_chi', 'hog_hist', 'color_hist', 'gray_hist', 'edges_hist', 'face_normalized')}
+    
+    def compute(stage, positions):
+        for start in range(0, len(positions), MATCH_CHUNK_ROWS):
+            chunk = positions[start:start + MATCH_CHUNK_ROWS]
+            selected = rows[chunk]
+            if stage == 'small':
+                for field in ('hog_hist', 'color_hist', 'gray_hist', 'edges_hist'):
+                    components[field][chunk] = _row_correlations(probe[field], gallery[field][selected])
+            elif stage == 'lbp':
+                lbp = gallery['lbp_hist'][selected]
+                components['lbp_corr'][chunk] = _row_correlations(probe['lbp_hist'], lbp)
+                components['lbp_chi'][chunk] = _row_chi_square(
+                    probe['lbp_hist'], lbp if lbp_scale is None else lbp * lbp_scale[selected, None])
+            else:
+                faces = gallery['face_normalized'][selected].reshape(len(selected), -1)
+                norms = face_norms[selected] if face_norms is not None else centered_norms(faces)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    components['face_normalized'][chunk] = (faces.astype(np.float32) @ face) / (norms * face_norm)
+    
+    def small_part(positions):
+        return sum(_positive(components[field][positions]) * MATCH_WEIGHTS[field]
+                   for field in ('hog_hist', 'color_hist', 'gray_hist', 'edges_hist'))
+    
+    def lbp_part(positions):
+        chi = components['lbp_chi'][positions]
+        return (components['lbp_corr'][positions] + (1 - np.minimum(chi / 100, 1))) / 2 * MATCH_WEIGHTS['lbp_hist']
+    
+    # NaN bounds (a constant histogram) compare False below, so such rows are never dropped
+    slack = CASCADE_SLACK * sum(MATCH_WEIGHTS.values())
+    scores = np.full(n, -np.inf)
+    done = np.zeros(n, dtype=bool)
+    
+    def bound_value():
+        kth = np.partition(scores[done], -top_k)[-top_k] if done.sum() >= top_k else -np.inf
+        return max(kth, -np.inf if floor is None else floor) - slack
+    
+    def finish(positions):
+        compute('face', positions)
+        scores[positions] = fuse_scores({name: values[positions] for name, values in components.items()})
+        done[positions] = True
+    
+    everything = np.arange(n)
+    compute('small', everything)
+    upper = small_part(everything) + MATCH_WEIGHTS['lbp_hist'] + MATCH_WEIGHTS['face_normalized']
+    seed = np.argsort(-upper, kind='stable')[:max(top_k, CASCADE_SEED)]
+    compute('lbp', seed)
+    finish(seed)
+    
+    alive = np.flatnonzero(~done & ~(upper < bound_value()))
+    compute('lbp', alive)
+    upper = small_part(alive) + lbp_part(alive) + MATCH_WEIGHTS['face_normalized']
+    keep = ~(upper < bound_value())
+    alive, upper = alive[keep], upper[keep]
+    # Best bounds first, so the top-k bound rises as early as possible
+    order = np.argsort(-upper, kind='stable')
+    alive, upper = alive[order], upper[order]
+    lbp_rows = len(seed) + len(alive)
+    face_rows = len(seed)
+    while len(alive):
+        finish(alive[:MATCH_CHUNK_ROWS])
+        face_rows += len(alive[:MATCH_CHUNK_ROWS])
+        alive, upper = alive[MATCH_CHUNK_ROWS:], upper[MATCH_CHUNK_ROWS:]
+        keep = ~(upper < bound_value())
+        alive, upper = alive[keep], upper[keep]
+    
+    scored = np.flatnonzero(done & (scores >= (-np.inf if floor is None else floor)))
+    # Score, then position, as match_gallery's stable sort orders ties
+    order = scored[np.lexsort((scored, -scores[scored]))][:top_k]
+    top = [(int(i), float(scores[i])) for i in order]
+    gap = top[0][1] - top[1][1] if len(top) >= 2 else None
+    total = n * sum(costs.values())
+    work = n * costs['small'] + lbp_rows * costs['lbp'] + face_rows * costs['face']
+    metrics.inc("cascade_work_total", work, part="computed")
+    metrics.inc("cascade_work_total", total - work, part="skipped")
+    return {"top": top, "gap": gap, "work_skipped": 1 - work / total}
+
+def probe_vector(features):
+    """ANN descriptor of a probe, comparable with FaceDatabase.ann_index()"""
+    return ann_vectors({field: np.asarray(features[field])[None] for field in ANN_WEIGHTS}, ANN_WEIGHTS)[0]
@@ -0,0 +1,261 @@
+"""
+Runtime metrics for the recognition pipeline
+Stage latency histograms, counters and gauges in Prometheus text format, plus sampled request traces
+"""
+import os
+import json
+import time
+import random
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_METRIC = "stage_duration_seconds"
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics)"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, cumulative count) pairs, ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+def _label_text(labels, extra=None):
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Thread-safe metrics store with a near-free disabled mode
+
+    Stages are timed with the `timed` decorator or the `timer` context
+    manager; both record into one `stage_duration_seconds` histogram labelled
+    by stage. When disabled, `timed` costs one attribute check per call and
+    nothing is recorded. A sampled fraction of `traced` requests also dumps
+    its stage spans and attributes as one JSON line to `trace_path`.
+    """
+    def __init__(self, enabled: bool = True, prefix: str = "face_", trace_sample_rate: float = 0.0,
+                 trace_path: str = "traces.jsonl"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.trace_sample_rate = trace_sample_rate
+        self.trace_path = trace_path
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._help = {STAGE_METRIC: "Time spent in each pipeline stage"}
+        self._local = threading.local()
+
+    def describe(self, name: str, text: str):
+        """HELP text for a metric"""
+        self._help[name] = text
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def _record(self, stage, start, labels):
+        elapsed = time.perf_counter() - start
+        self.observe(STAGE_METRIC, elapsed, stage=stage, **labels)
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace["spans"].append(dict(labels, stage=stage, start_ms=round((start - trace["start"]) * 1000, 3),
+                                       ms=round(elapsed * 1000, 3)))
+
+    def timed(self, stage: str, **labels):
+        """Decorator recording each call's latency under `stage`"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self._record(stage, start, labels)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def timer(self, stage: str, **labels):
+        """Context manager recording the block's latency under `stage`"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(stage, start, labels)
+
+    def outcome(self, kind: str, outcome: str):
+        """Count a request outcome (e.g. verify/granted), also noted on the current trace"""
+        self.inc(f"{kind}_outcomes_total", outcome=outcome)
+        self.annotate(outcome=outcome)
+
+    def annotate(self, **attributes):
+        """Attach attributes to the current sampled trace, if any"""
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace["attributes"].update(attributes)
+
+    def traced(self, request: str):
+        """Decorator: sample calls for a per-request trace dump
+
+        Stages timed while a sampled request runs (on the same thread) become
+        its spans. Nested traced calls join the outer trace.
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if (not self.enabled or self.trace_sample_rate <= 0
+                        or getattr(self._local, "trace", None) is not None
+                        or random.random() >= self.trace_sample_rate):
+                    return fn(*args, **kwargs)
+                self._local.trace = {"start": time.perf_counter(), "spans": [], "attributes": {}}
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    trace, self._local.trace = self._local.trace, None
+                    self._dump(request, trace)
+            return wrapper
+        return decorator
+
+    def _dump(self, request, trace):
+        line = json.dumps({
+            "request": request,
+            "at": datetime.now().isoformat(timespec="milliseconds"),
+            "total_ms": round((time.perf_counter() - trace["start"]) * 1000, 3),
+            "attributes": trace["attributes"],
+            "spans": trace["spans"]
+        }, default=str)
+        with self._lock:
+            with open(self.trace_path, 'a') as f:
+                f.write(line + "\n")
+
+    def snapshot(self):
+        """Plain-dict copy of all metrics (for JSON reports)"""
+        with self._lock:
+            return {
+                "histograms": {
+                    name + _label_text(labels): {"count": h.count, "sum": h.sum}
+                    for (name, labels), h in self._histograms.items()
+                },
+                "counters": {name + _label_text(labels): v for (name, labels), v in self._counters.items()},
+                "gauges": {name + _label_text(labels): v for (name, labels), v in self._gauges.items()}
+            }
+
+    def drain(self):
+        """Raw values recorded since the last drain, cleared here (for merge() in another process)"""
+        with self._lock:
+            delta = {
+                "histograms": {key: (h.counts, h.sum, h.count) for key, h in self._histograms.items()},
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges)
+            }
+            self._histograms = {}
+            self._counters = {}
+            self._gauges = {}
+        return delta
+
+    def merge(self, delta):
+        """Add a drain() result from another process: histograms and counters add up, gauges are replaced"""
+        if not self.enabled:
+            return
+        with self._lock:
+            for key, (counts, total, count) in delta["histograms"].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram()
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+            for key, value in delta["counters"].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            self._gauges.update(delta["gauges"])
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, series in (("counter", self._counters), ("gauge", self._gauges), ("histogram", self._histograms)):
+                for name in sorted({name for name, _ in series}):
+                    full_name = self.prefix + name
+                    if name in self._help:
+                        lines.append(f"# HELP {full_name} {self._help[name]}")
+                    lines.append(f"# TYPE {full_name} {kind}")
+                    for (series_name, labels), value in sorted(series.items(), key=lambda item: item[0]):
+                        if series_name != name:
+                            continue
+                        if kind != "histogram":
+                            lines.append(f"{full_name}{_label_text(labels)} {_number(value)}")
+                            continue
+                        for bound, count in value.cumulative():
+                            lines.append(f"{full_name}_bucket{_label_text(labels, {'le': _number(bound)})} {count}")
+                        lines.append(f"{full_name}_sum{_label_text(labels)} {_number(value.sum)}")
+                        lines.append(f"{full_name}_count{_label_text(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+# Configured from the environment: FACE_METRICS=0 disables recording,
+# FACE_TRACE_SAMPLE=0.01 dumps 1% of requests to FACE_TRACE_FILE
+metrics = MetricsRegistry(
+    enabled=os.environ.get("FACE_METRICS", "1") != "0",
+    trace_sample_rate=float(os.environ.get("FACE_TRACE_SAMPLE", "0")),
+    trace_path=os.environ.get("FACE_TRACE_FILE", "traces.jsonl")
+)
@@ -0,0 +1,134 @@
+"""
+Probe result cache
+Recent verify results, reused for near-duplicate probes of an unchanged gallery
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from .metrics import metrics
+
+
+HASH_SIZE = 8  # pHash bits per side: 64-bit hashes
+
+
+def face_hash(face_img):
+    """64-bit perceptual hash (pHash) of a face image (verify hashes the normalize_face() template)
+
+    Low-frequency DCT coefficients of the equalized 32x32 grayscale face
+    against their median: stable under re-encoding, sensor noise and small
+    shifts. Hashing the normalized template rather than the enhanced crop
+    keeps the hash independent of the enhancement mode, and the template is
+    reused by the feature extraction of a miss.
+    """
+    gray = cv2.cvtColor(face_img, cv2.COLOR_RGB2GRAY) if face_img.ndim == 3 else face_img
+    small = cv2.equalizeHist(cv2.resize(gray, (HASH_SIZE * 4, HASH_SIZE * 4), interpolation=cv2.INTER_AREA))
+    low = cv2.dct(np.float32(small))[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term only carries the mean brightness
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_distance(a: int, b: int):
+    """Number of differing bits"""
+    return bin(a ^ b).count("1")
+
+
+class ProbeCache:
+    """Bounded LRU of verify results keyed by the probe's face hash
+
+    A probe within `max_distance` bits of a cached hash, verified against the
+    same gallery generation less than `ttl` seconds ago, gets the cached
+    result back. Any database write (add, delete, template refresh, by any
+    process) changes the generation and empties the cache. `ttl` <= 0
+    disables it.
+
+    Only outcomes that do not grant access are cached: two different faces
+    with close hashes can at worst make a genuine user wait out the TTL,
+    never pass as someone else. recognition.probe_cache_report() measures
+    how often distinct faces of a gallery fall within `max_distance`.
+    """
+    EVENTS = ("hit", "miss", "expired", "eviction", "invalidation")
+    UNCACHED_OUTCOMES = ("granted",)
+
+    def __init__(self, ttl: float = 0.0, size: int = 256, max_distance: int = 2):
+        self.ttl = ttl
+        self.size = size
+        self.max_distance = max_distance
+        self.generation = None
+        self.counts = dict.fromkeys(self.EVENTS, 0)
+        self._entries = OrderedDict()  # hash -> (expires at, result)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _count(self, event, n=1):
+        self.counts[event] += n
+        metrics.inc("probe_cache_total", n, event=event)
+
+    def _use_generation(self, generation):
+        if generation != self.generation:
+            if self._entries:
+                self._count("invalidation", len(self._entries))
+                self._entries.clear()
+            self.generation = generation
+
+    def get(self, probe_hash: int, generation):
+        """Cached result of the closest matching probe, or None"""
+        if self.ttl <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._use_generation(generation)
+            best, best_distance = None, self.max_distance + 1
+            for key, (expires, _) in list(self._entries.items()):
+                if expires <= now:
+                    del self._entries[key]
+                    self._count("expired")
+                    continue
+                distance = hash_distance(key, probe_hash)
+                if distance < best_distance:
+                    best, best_distance = key, distance
+            if best is None:
+                self._count("miss")
+                return None
+            self._entries.move_to_end(best)
+            self._count("hit")
+            return dict(self._entries[best][1])
+
+    def put(self, probe_hash: int, generation, result: dict):
+        if self.ttl <= 0 or result["outcome"] in self.UNCACHED_OUTCOMES:
+            return
+        with self._lock:
+            self._use_generation(generation)
+            self._entries[probe_hash] = (time.monotonic() + self.ttl, dict(result))
+            self._entries.move_to_end(probe_hash)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self._count("eviction")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, entries=len(self._entries), ttl=self.ttl, max_distance=self.max_distance)
+
+
+metrics.describe("probe_cache_total", "Verify probe cache events (hit, miss, expired, eviction, invalidation)")
+
+# Configured from the environment: FACE_PROBE_CACHE_TTL seconds (0, the
+# default, disables it), FACE_PROBE_CACHE_SIZE entries, FACE_PROBE_CACHE_DISTANCE
+# hash bits of tolerance
+probe_cache = ProbeCache(
+    ttl=float(os.environ.get("FACE_PROBE_CACHE_TTL", "0")),
+    size=int(os.environ.get("FACE_PROBE_CACHE_SIZE", "256")),
+    max_distance=int(os.environ.get("FACE_PROBE_CACHE_DISTANCE", "2"))
+)
@@ -0,0 +1,401 @@
+"""
+Verification and enrollment
+Headless verify / enroll flows over the shared gallery database
+"""
+import os
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from . import compact, database
+from .ann_index import recall_at_k
+from .database import build_template
+from .detection import ENHANCEMENT_MODES, detect_faces, face_crop
+from .features import extract_advanced_features, normalize_face
+from .matching import (ANN_MIN_GALLERY, ANN_SHORTLIST, BASE_THRESHOLD, UNCERTAIN_GAP, centered_norms,
+                       match_gallery, match_gallery_cascade, probe_vector, score_gallery)
+from .metrics import metrics
+from .probe_cache import face_hash, probe_cache
+from .sharding import SHARD_MIN_ROWS, sharded_scorer
+
+
+def ann_recall_report(k=10, n_queries=100, shortlist=ANN_SHORTLIST):
+    """recall@k of the ANN shortlist against the exact gallery scan
+    
+    Uses stored users as queries. Also reports how often the exact re-ranking
+    of the shortlist finds the same best match as the full scan.
+    """
+    db = database.db
+    users = [u for u in db.snapshot()["users"] if (u.get("template") or {}).get("has_face")]
+    if not users:
+        return {"users": 0}
+    rows = np.array([u["row"] for u in users])
+    gallery = db.gallery()
+    index = db.ann_index()
+    queries = np.random.default_rng(0).choice(len(users), min(n_queries, len(users)), replace=False)
+    approx, exact, same_best = [], [], 0
+    start = time.perf_counter()
+    for q in queries:
+        probe = db.get_features(users[q])
+        approx.append(index.search(probe_vector(probe), shortlist))
+        full = match_gallery(probe, gallery, rows, top_k=k)
+        exact.append(rows[[i for i, _ in full["top"]]])
+        short_rows = np.intersect1d(approx[-1], rows)
+        reranked = match_gallery(probe, gallery, short_rows, top_k=1)
+        same_best += bool(reranked["top"]) and short_rows[reranked["top"][0][0]] == exact[-1][0]
+    return {
+        "users": len(users),
+        "queries": len(queries),
+        "shortlist": shortlist,
+        f"recall@{k}": recall_at_k(approx, exact, k),
+        "top1_agreement": same_best / len(queries),
+        "seconds": time.perf_counter() - start
+    }
+
+def decide(best, gap):
+    """Verify decision for the best score and its gap to the runner-up (None without one)"""
+    if best < BASE_THRESHOLD:
+        return "not_recognized"
+    if gap is not None and gap < UNCERTAIN_GAP:
+        return "uncertain"
+    return "granted"
+
+def _outcome(scores):
+    # (decision, best position) of a score vector, as identify() decides without the sample fallback
+    order = np.argsort(-scores, kind='stable')[:2]
+    gap = scores[order[0]] - scores[order[1]] if len(order) > 1 else None
+    return decide(scores[order[0]], gap), int(order[0])
+
+COMPACT_REPORT_CONFIGS = (("float16", None), ("uint8", None), ("uint8", 80), ("uint8", 40))
+
+def compact_report(configs=COMPACT_REPORT_CONFIGS, n_queries=100):
+    """Memory, fused scores and decisions of compact galleries against the full-precision one
+    
+    Uses stored users as queries, scored against every candidate, for each
+    (precision, face size) config. Decisions are reported twice: with the
+    query's own entry in the gallery (an enrolled user coming back) and
+    without it (an unknown face), as a count of queries whose decision changed.
+    """
+    db = database.db
+    candidates = [u for u in db.snapshot()["users"] if (u.get("template") or {}).get("has_face")]
+    if len(candidates) < 2:
+        return {"users": len(candidates)}
+    rows = np.array([u["row"] for u in candidates])
+    # Full precision straight from the store, whatever gallery() is configured to hold
+    full = {name: matrix[:rows.max() + 1] for name, matrix in db.store.matrices(rows.max() + 1).items()}
+    full["face_normalized_norm"] = centered_norms(full["face_normalized"])
+    queries = np.random.default_rng(0).choice(len(candidates), min(n_queries, len(candidates)), replace=False)
+    probes = [db.get_features(candidates[q]) for q in queries]
+    start = time.perf_counter()
+    reference = [score_gallery(probe, full, rows) for probe in probes]
+    stored = len(full["lbp_hist"])
+    
+    report = {"users": len(candidates), "queries": len(queries),
+              "full_bytes_per_row": compact.gallery_bytes(full) / stored,
+              "full_score_ms_per_query": (time.perf_counter() - start) * 1000 / len(queries), "configs": []}
+    for precision, face_size in configs:
+        gallery = compact.compact_gallery(full, precision, face_size)
+        start = time.perf_counter()
+        scores = [score_gallery(probe, gallery, rows) for probe in probes]
+        elapsed = time.perf_counter() - start
+        deltas = np.abs(np.concatenate(scores) - np.concatenate(reference))
+        changed = {"with_self": 0, "without_self": 0}
+        for q, before, after in zip(queries, reference, scores):
+            others = np.arange(len(rows)) != q
+            changed["with_self"] += _outcome(before) != _outcome(after)
+            changed["without_self"] += _outcome(before[others]) != _outcome(after[others])
+        report["configs"].append({
+            "precision": precision,
+            "face_size": face_size or full["face_normalized"].shape[1],
+            "bytes_per_row": compact.gallery_bytes(gallery) / stored,
+            "memory_saved": 1 - compact.gallery_bytes(gallery) / compact.gallery_bytes(full),
+            "score_delta_mean": float(deltas.mean()),
+            "score_delta_max": float(deltas.max()),
+            "decisions_changed": changed,
+            "score_ms_per_query": elapsed * 1000 / len(queries)
+        })
+    return report
+
+def probe_cache_report(max_users=1000, distances=range(0, 9)):
+    """How often the probe cache would confuse two faces of the gallery, per hash tolerance
+    
+    Hashes the stored face templates as verify hashes a probe. For every
+    tolerance it reports the share of pairs of distinct users whose hashes
+    are that close (a probe of one answered from a cache entry of the other)
+    and the chance that a full cache holds at least one such entry for a
+    probe. Pairs of samples of one multi-sample user give the share of
+    genuine repeat captures the tolerance would still catch.
+    """
+    db = database.db
+    users = [u for u in db.snapshot()["users"] if (u.get("template") or {}).get("has_face")]
+    if len(users) < 2:
+        return {"users": len(users)}
+    if len(users) > max_users:
+        users = [users[i] for i in np.random.default_rng(0).choice(len(users), max_users, replace=False)]
+    faces = db.store.matrix("face_normalized")
+    
+    def pair_distances(rows):
+        # Hamming distances between the hashes of all pairs of rows
+        packed = b"".join(face_hash(np.asarray(faces[row])).to_bytes(8, "big") for row in rows)
+        bits = np.unpackbits(np.frombuffer(packed, dtype=np.uint8).reshape(len(rows), 8), axis=1).astype(np.int32)
+        distances = bits @ (1 - bits).T + (1 - bits) @ bits.T
+        return distances[np.triu_indices(len(rows), 1)]
+    
+    distinct = pair_distances([u["row"] for u in users])
+    same = np.concatenate([pair_distances([sample["row"] for sample in u["samples"]])
+                           for u in users if len(u.get("samples", ())) > 1] or [np.empty(0)])
+    
+    report = {"users": len(users), "distinct_pairs": len(distinct), "same_user_pairs": len(same),
+              "cache_size": probe_cache.size, "max_distance": probe_cache.max_distance, "tolerances": []}
+    for distance in distances:
+        false_hits = float(np.mean(distinct <= distance))
+        report["tolerances"].append({
+            "max_distance": distance,
+            "distinct_pair_hit_rate": false_hits,
+            "full_cache_false_hit": 1 - (1 - false_hits) ** probe_cache.size,
+            "same_user_hit_rate": float(np.mean(same <= distance)) if len(same) else None
+        })
+    return report
+
+VERIFY_MIN_FACE = 150  # smallest face side (px) accepted for verification
+
+# Candidate list of the last snapshot: (database, snapshot id, users)
+_candidates = (None, None, [])
+
+def gallery_candidates():
+    """Users of the current snapshot that can be matched: stored image present and a face in its template
+    
+    Built once per snapshot: stale templates are rebuilt first (a stat per
+    image, which writes a new snapshot if any changed) and the image and
+    has_face checks are kept with the list. Later calls on an unchanged
+    snapshot cost one stat of faces.json. The list is shared, do not modify it.
+    """
+    global _candidates
+    db = database.db
+    db.snapshot()
+    cached_db, cached_id, candidates = _candidates
+    if cached_db is db and cached_id == db.snapshot_id():
+        return candidates
+    with metrics.timer("verify_templates"):
+        # Precomputed at registration, rebuilt only if the image or pipeline changed
+        db.refresh_templates()
+        candidates = [
+            user for user in db.data["users"]
+            if os.path.exists(user["image"]) and (user.get("template") or {}).get("has_face")
+        ]
+    _candidates = (db, db.snapshot_id(), candidates)
+    return candidates
+
+def load_gallery():
+    """Refresh the snapshot and build the shared gallery caches, returns gallery_candidates()
+    
+    Callers that match from several threads (or keep a warm gallery across
+    requests) call this first, so the caches are never built concurrently.
+    """
+    db = database.db
+    db.snapshot()
+    candidates = gallery_candidates()
+    if candidates:
+        db.gallery()
+        if len(candidates) >= ANN_MIN_GALLERY:
+            db.ann_index()
+        elif len(candidates) >= SHARD_MIN_ROWS and sharded_scorer():
+            # Exact scans this large are sharded: start the pool's workers now
+            sharded_scorer().warm_up()
+    return candidates
+
+# Multi-sample users are matched on their aggregate template first; when the
+# call is close, the top users' individual samples are scored as well
+SAMPLE_FALLBACK_MARGIN = 0.05  # best score this close to the threshold, or to the runner-up
+SAMPLE_FALLBACK_USERS = 3      # users re-checked on their samples
+
+def _rescore_samples(features, gallery, top):
+    """Re-rank (user, score) pairs by the best of aggregate and per-sample scores"""
+    rescored = []
+    for user, score in top:
+        if "samples" in user:
+            rows = [sample["row"] for sample in user["samples"] if sample["template"]["has_face"]]
+            if rows:
+                score = max(score, float(score_gallery(features, gallery, rows).max()))
+        rescored.append((user, score))
+    return sorted(rescored, key=lambda pair: -pair[1])
+
+def ann_shortlist(features, candidates, min_users=SAMPLE_FALLBACK_USERS):
+    """Candidates in the probe's ANN shortlist, for galleries of ANN_MIN_GALLERY users or more
+    
+    When fewer than `min_users` candidates are in the shortlist (an index
+    behind the snapshot, or shortlisted users without a usable template),
+    all candidates are returned for an exact scan instead.
+    """
+    if len(candidates) < ANN_MIN_GALLERY:
+        return candidates
+    shortlist = set(database.db.ann_index().search(probe_vector(features), ANN_SHORTLIST).tolist())
+    shortlisted = [u for u in candidates if u["row"] in shortlist]
+    if len(shortlisted) < min_users:
+        metrics.inc("ann_fallback_total")
+        return candidates
+    return shortlisted
+
+def identify(features, candidates):
+    """Best matches of probe features among candidate users, and the verify decision
+    
+    Returns {"decision": "granted" | "uncertain" | "not_recognized" | "no_match",
+    "top": [(name, score), ...], "gap", "candidates"}; candidates is the
+    number of users actually scored (after the ANN shortlist). no_match
+    (empty top) only comes back without any candidate to score.
+    """
+    db = database.db
+    with metrics.timer("verify_match"):
+        candidates = ann_shortlist(features, candidates)
+        if not candidates:
+            return {"decision": "no_match", "top": [], "gap": None, "candidates": 0}
+        
+        # Compare with all (shortlisted) users, split across processes for large exact scans; the
+        # cascade skips users who cannot make the top SAMPLE_FALLBACK_USERS, same result as a full scan
+        gallery = db.gallery()
+        rows = [u["row"] for u in candidates]
+        scorer = sharded_scorer() if len(rows) >= SHARD_MIN_ROWS else None
+        if scorer is not None:
+            match = scorer.match(features, rows, top_k=SAMPLE_FALLBACK_USERS)
+        else:
+            match = match_gallery_cascade(features, gallery, rows, top_k=SAMPLE_FALLBACK_USERS)
+            metrics.annotate(work_skipped=match["work_skipped"])
+        top = [(candidates[i], score) for i, score in match["top"]]
+        if not top:
+            return {"decision": "no_match", "top": [], "gap": None, "candidates": len(candidates)}
+        best = top[0][1]
+        if abs(best - BASE_THRESHOLD) < SAMPLE_FALLBACK_MARGIN or (
+                match["gap"] is not None and match["gap"] < SAMPLE_FALLBACK_MARGIN):
+            top = _rescore_samples(features, gallery, top)
+            match["gap"] = top[0][1] - top[1][1] if len(top) >= 2 else None
+    top_matches = [(user["name"], score) for user, score in top[:2]]
+    decision = decide(top_matches[0][1], match["gap"])
+    return {"decision": decision, "top": top_matches, "gap": match["gap"], "candidates": len(candidates)}
+
+@metrics.traced("verify")
+@metrics.timed("verify")
+def verify_image(image, candidates=None):
+    """Headless verification of one RGB image
+    
+    Returns {"outcome", "box", "top", "gap", "cached"}; outcome is one of
+    no_face, multiple_faces, face_too_small, no_users, error, no_match,
+    granted, uncertain or not_recognized. `candidates` (from
+    gallery_candidates()) can be passed by callers that keep a warm gallery;
+    by default the database is reloaded first. With the probe cache on, a
+    near-duplicate of a recent probe that was not granted gets that probe's
+    decision back (cached=True) without feature extraction or matching.
+    """
+    db = database.db
+    result = {"outcome": None, "box": None, "top": [], "gap": None, "cached": False}
+    
+    def done(outcome, **fields):
+        metrics.outcome("verify", outcome)
+        result.update(fields, outcome=outcome)
+        return result
+    
+    # Detect face (enhancement as configured for this call site)
+    mode = ENHANCEMENT_MODES["verify"]
+    faces, source = detect_faces(image, mode)
+    
+    if len(faces) == 0:
+        return done("no_face")
+    
+    if len(faces) > 1:
+        return done("multiple_faces")
+    
+    # Check face size (quality)
+    (x, y, w, h) = faces[0]
+    result["box"] = [int(x), int(y), int(w), int(h)]
+    if w < VERIFY_MIN_FACE or h < VERIFY_MIN_FACE:
+        return done("face_too_small")
+    
+    # Extract face
+    face_img = face_crop(source, faces[0], mode)
+    
+    # Pick up users written since the last call (a stat when nothing changed)
+    users = (db.snapshot() if candidates is None else db.data)["users"]
+    
+    metrics.set("gallery_users", len(users))
+    metrics.annotate(gallery_users=len(users))
+    
+    # Check database
+    if len(users) == 0:
+        return done("no_users")
+    
+    # Repeated captures of the same face reuse the last decision (if the cache is on)
+    normalized = probe_hash = None
+    generation = db.snapshot_id()
+    if probe_cache.enabled:
+        normalized = normalize_face(face_img)
+        probe_hash = face_hash(normalized)
+        cached = probe_cache.get(probe_hash, generation)
+        if cached is not None:
+            metrics.annotate(cached=True)
+            return done(cached["outcome"], top=cached["top"], gap=cached["gap"], cached=True)
+    
+    # Extract features
+    try:
+        captured_features = extract_advanced_features(face_img, normalized)
+    except Exception as e:
+        return done("error", error=str(e))
+    
+    if candidates is None:
+        candidates = gallery_candidates()
+    if not candidates:
+        if probe_hash is not None:
+            probe_cache.put(probe_hash, generation, {"outcome": "no_match", "top": [], "gap": None})
+        return done("no_match")
+    
+    match = identify(captured_features, candidates)
+    metrics.annotate(candidates=match["candidates"])
+    if probe_hash is not None:
+        probe_cache.put(probe_hash, generation, {"outcome": match["decision"], "top": match["top"], "gap": match["gap"]})
+    return done(match["decision"], top=match["top"], gap=match["gap"])
+
+REGISTER_MIN_FACE = 120  # smallest face side (px) accepted for enrollment
+
+def enrollment_features(image):
+    """(features, None) for an enrollment image, or (None, reason) if it is rejected
+    
+    Reasons are no_face, multiple_faces and face_too_small. Used by register_user and
+    bulk enrollment so both apply the same checks.
+    """
+    mode = ENHANCEMENT_MODES["register"]
+    faces, source = detect_faces(image, mode)
+    
+    if len(faces) == 0:
+        return None, "no_face"
+    
+    if len(faces) > 1:
+        return None, "multiple_faces"
+    
+    (x, y, w, h) = faces[0]
+    if w < REGISTER_MIN_FACE or h < REGISTER_MIN_FACE:
+        return None, "face_too_small"
+    
+    return extract_advanced_features(face_crop(source, faces[0], mode)), None
+
+def prepare_enrollment(name, image):
+    """Checks, features, stored image and gallery template of a new user
+    
+    Returns (entry, None) with an entry for FaceDatabase.add_users, or
+    (None, reason) if the image is rejected. Nothing is written to the
+    database, so the heavy part can run in a worker process.
+    """
+    features, rejection = enrollment_features(image)
+    if rejection is not None:
+        return None, rejection
+    
+    # Microseconds keep quick extra samples of one user from overwriting each other
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    filename = f"{name.replace(' ', '_')}_{timestamp}.jpg"
+    os.makedirs(database.FACES_DIR, exist_ok=True)
+    filepath = os.path.join(database.FACES_DIR, filename)
+    
+    img_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    cv2.imwrite(filepath, img_bgr)
+    
+    template, face_normalized = build_template(filepath)
+    return (name, filepath, features, template, face_normalized), None
@@ -0,0 +1,124 @@
+"""
+Sharded gallery scoring
+One probe scored on several processes, each over a shard of the gallery rows
+
+Off unless FACE_SHARD_WORKERS is set above 1. Workers read the gallery from
+the feature store's memory-mapped files, so they share the OS page cache
+instead of a shared-memory segment: the descriptors are not copied or
+pickled, but each worker keeps its own small per-row caches (template
+norms) and, with a compact gallery configured, its own compact copy.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from . import database
+from .matching import match_gallery_cascade
+from .metrics import metrics
+
+
+# Configured from the environment: FACE_SHARD_WORKERS=4 scores large exact
+# scans on 4 processes; the default 0 (or 1) keeps scoring in the calling thread
+SHARD_WORKERS = int(os.environ.get("FACE_SHARD_WORKERS", "0"))
+SHARD_MIN_ROWS = 4096  # smaller scans are faster in-process than a round trip to the pool
+
+# Worker process state: a read-only view of the caller's database
+_db = None
+
+
+def _init_worker(db_path, store_dir):
+    global _db
+    _db = database.FaceDatabase(db_path, store_dir)
+
+
+def _score_shard(generation, probe, rows, top_k):
+    """Worker: local top-k (position in `rows`, score) of one shard, None if the store moved on
+
+    The store files are memory-mapped, so every worker reads the same
+    page-cache copy of the gallery. The snapshot check picks up rows added
+    and removed since the last task; a compaction (new generation)
+    renumbers rows, so the caller falls back to scoring in-process.
+    """
+    _db.snapshot()
+    if _db.store.generation != generation:
+        return None
+    return match_gallery_cascade(probe, _db.gallery(), rows, top_k=top_k)["top"]
+
+
+class ShardedScorer:
+    """Persistent process pool scoring gallery shards in parallel
+
+    Each call splits the rows into one contiguous shard per worker; workers
+    return their local top-k (exact, from the cascaded scan) and the merge
+    keeps the global top-k, ordered as match_gallery orders them (score,
+    then position). Only the probe and the row indices are sent per call;
+    workers map the store files themselves.
+    """
+    def __init__(self, workers: int, db=None):
+        self.workers = workers
+        self.db = db or database.db
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                 initargs=(self.db.db_path, self.db.store_dir))
+            return self._pool
+
+    def warm_up(self):
+        """Start every worker now (each opens the database) rather than on the first scan"""
+        pool = self._executor()
+        list(pool.map(_noop, range(self.workers)))
+
+    def match(self, probe, rows, top_k=5):
+        """match_gallery(probe, db.gallery(), rows, top_k) without the full score array"""
+        rows = np.asarray(rows, dtype=np.int64)
+        generation = self.db.store.generation
+        shards = [shard for shard in np.array_split(np.arange(len(rows)), self.workers) if len(shard)]
+        try:
+            with metrics.timer("verify_shards"):
+                futures = [self._executor().submit(_score_shard, generation, probe, rows[shard], top_k)
+                           for shard in shards]
+                results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            self.close()
+            results = [None]
+        if any(result is None for result in results):
+            metrics.inc("shard_fallback_total")
+            match = match_gallery_cascade(probe, self.db.gallery(), rows, top_k=top_k)
+            return {"top": match["top"], "gap": match["gap"]}
+        merged = [(int(shard[position]), score) for shard, top in zip(shards, results) for position, score in top]
+        top = sorted(merged, key=lambda pair: (-pair[1], pair[0]))[:top_k]
+        gap = top[0][1] - top[1][1] if len(top) >= 2 else None
+        return {"top": top, "gap": gap}
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def _noop(_):
+    return None
+
+
+_scorer = None
+
+
+def sharded_scorer():
+    """The shared ShardedScorer of database.db, or None when sharding is off"""
+    global _scorer
+    if SHARD_WORKERS <= 1:
+        return None
+    db = database.db
+    if _scorer is None or _scorer.db is not db or _scorer.workers != SHARD_WORKERS:
+        if _scorer is not None:
+            _scorer.close()
+        _scorer = ShardedScorer(SHARD_WORKERS, db)
+    return _scorer
@@ -0,0 +1,173 @@
+"""
+Live camera feedback
+Frame dropping, periodic detection and ROI tracking for the webcam stream
+"""
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from .buffers import frame_context
+from .detection import ENHANCEMENT_MODES, detect_faces, face_crop, face_detector
+from .recognition import VERIFY_MIN_FACE
+
+
+# Streaming
+STREAM_MAX_FPS = 10           # frames arriving faster than this are dropped
+STREAM_DETECT_EVERY = 5       # full detection every N processed frames, tracking in between
+STREAM_TRACK_MIN_SCORE = 0.6  # template match score below which the track is lost
+
+class RoiTracker:
+    """Cheap single-face tracker
+    
+    Template-matches the last face patch inside a window around the previous
+    box, at a reduced working resolution. The box size is kept; periodic
+    re-detection corrects it.
+    """
+    def __init__(self, search_margin: float = 0.5, work_size: int = 64, min_score: float = STREAM_TRACK_MIN_SCORE):
+        self.search_margin = search_margin
+        self.work_size = work_size
+        self.min_score = min_score
+        self.box = None
+        self._template = None
+        self._scale = 1.0
+    
+    def start(self, gray, box):
+        x, y, w, h = [int(v) for v in box]
+        self._scale = self.work_size / max(w, h)
+        self._template = cv2.resize(gray[y:y+h, x:x+w], None, fx=self._scale, fy=self._scale, interpolation=cv2.INTER_AREA)
+        self.box = (x, y, w, h)
+    
+    def reset(self):
+        self.box = None
+        self._template = None
+    
+    def update(self, gray):
+        """New box for this frame, or None when the face is lost"""
+        if self.box is None:
+            return None
+        x, y, w, h = self.box
+        margin = int(max(w, h) * self.search_margin)
+        x0, y0 = max(0, x - margin), max(0, y - margin)
+        x1, y1 = min(gray.shape[1], x + w + margin), min(gray.shape[0], y + h + margin)
+        window = cv2.resize(gray[y0:y1, x0:x1], None, fx=self._scale, fy=self._scale, interpolation=cv2.INTER_AREA)
+        if window.shape[0] < self._template.shape[0] or window.shape[1] < self._template.shape[1]:
+            self.reset()
+            return None
+        
+        result = cv2.matchTemplate(window, self._template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (lx, ly) = cv2.minMaxLoc(result)
+        if score < self.min_score:
+            self.reset()
+            return None
+        nx = min(max(0, x0 + int(round(lx / self._scale))), gray.shape[1] - w)
+        ny = min(max(0, y0 + int(round(ly / self._scale))), gray.shape[0] - h)
+        self.start(gray, (nx, ny, w, h))
+        return self.box
+
+class StreamProcessor:
+    """Real-time feedback for one camera stream
+    
+    Drops frames that arrive while it is still busy or faster than max_fps,
+    runs the full detector every `detect_every` frames (or when the track is
+    lost) and follows the face with a RoiTracker in between. Quality checks
+    only look at the face crop.
+    """
+    def __init__(self, max_fps: float = STREAM_MAX_FPS, detect_every: int = STREAM_DETECT_EVERY, detector=None,
+                 mode: str = None):
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.detect_every = detect_every
+        self.detector = detector or face_detector
+        self.mode = mode or ENHANCEMENT_MODES["stream"]
+        self.tracker = RoiTracker()
+        self.frames = 0
+        self.dropped = 0
+        self.detections = 0
+        self.latencies = deque(maxlen=200)
+        self._since_detect = 0
+        self._last_start = -float("inf")
+        self._last_status = "💡 Waiting for camera..."
+        self._lock = threading.Lock()
+    
+    def process(self, image):
+        """Status message for a frame (the previous one if the frame is dropped)"""
+        self.frames += 1
+        start = time.perf_counter()
+        if start - self._last_start < self.min_interval or not self._lock.acquire(blocking=False):
+            self.dropped += 1
+            return self._last_status
+        try:
+            self._last_start = start
+            self._last_status = self._check(image)
+            self.latencies.append(time.perf_counter() - start)
+            return self._last_status
+        finally:
+            self._lock.release()
+    
+    def _gray(self, image):
+        # Only read while locating this frame, so it can live in the thread's buffers
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY, dst=frame_context().buffer("stream_gray", image.shape[:2]))
+    
+    def _locate(self, image):
+        """Face boxes, the frame to crop them from and the crop's enhancement mode"""
+        if self.tracker.box is not None and self._since_detect < self.detect_every:
+            self._since_detect += 1
+            box = self.tracker.update(self._gray(image))
+            if box is not None:
+                # Tracked frames are never enhanced as a whole
+                return [box], image, "none" if self.mode == "none" else "tiered"
+        faces, source = detect_faces(image, self.mode, self.detector)
+        self.detections += 1
+        self._since_detect = 1
+        if len(faces) == 1:
+            self.tracker.start(self._gray(image), faces[0])
+        else:
+            self.tracker.reset()
+        return faces, source, self.mode
+    
+    def _check(self, image):
+        faces, source, crop_mode = self._locate(image)
+        
+        if len(faces) == 0:
+            return "❌ No face detected - Position yourself in frame"
+        
+        if len(faces) > 1:
+            return "⚠️ Multiple faces detected - Only one person should be visible"
+        
+        (x, y, w, h) = faces[0]
+        
+        # Check face size
+        if w < VERIFY_MIN_FACE or h < VERIFY_MIN_FACE:
+            return f"⚠️ Face too small ({w}x{h}) - Move closer to camera"
+        
+        # Check blur on the (enhanced) crop only
+        face_img = face_crop(source, faces[0], crop_mode)
+        gray_face = cv2.cvtColor(face_img, cv2.COLOR_RGB2GRAY)
+        blur_score = cv2.Laplacian(gray_face, cv2.CV_64F).var()
+        
+        if blur_score < 100:
+            return f"⚠️ Image blurry (score: {blur_score:.0f}) - Hold still"
+        
+        # Check brightness
+        brightness = np.mean(gray_face)
+        if brightness < 60:
+            return "⚠️ Too dark - Improve lighting"
+        if brightness > 200:
+            return "⚠️ Too bright - Reduce lighting"
+        
+        # All checks passed
+        return f"✅ Face detected! Good quality - Click 'Capture & Verify' (Face: {w}x{h}, Clarity: {blur_score:.0f})"
+    
+    def stats(self):
+        """Per-frame latency (processed frames) and drop rate"""
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "drop_rate": self.dropped / self.frames if self.frames else 0.0,
+            "detections": self.detections,
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None
+        }
@@ -0,0 +1,70 @@
+"""
+Multi-face tracking across video frames
+Greedy IoU association of per-frame detections to persistent track IDs
+"""
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU of (x, y, w, h) boxes, shape (len(a), len(b))"""
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    ax1, ay1, ax2, ay2 = a[:, 0:1], a[:, 1:2], a[:, 0:1] + a[:, 2:3], a[:, 1:2] + a[:, 3:4]
+    bx1, by1, bx2, by2 = b[:, 0], b[:, 1], b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    inter = np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None) * \
+        np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None)
+    union = a[:, 2:3] * a[:, 3:4] + b[:, 2] * b[:, 3] - inter
+    return inter / np.maximum(union, 1e-12)
+
+
+class Track:
+    """One face followed across frames, with whatever the caller caches on it"""
+    def __init__(self, track_id: int, box):
+        self.id = track_id
+        self.box = tuple(int(v) for v in box)
+        self.hits = 1
+        self.missed = 0
+        self.decision = None
+        self.quality = None
+        self.recognitions = 0
+
+
+class IoUTracker:
+    """Assigns persistent IDs to face boxes across consecutive frames
+
+    Each frame's detections are matched to live tracks greedily by IoU
+    (highest first, at least `min_iou`); unmatched detections start new
+    tracks and tracks unmatched for more than `max_missed` frames end.
+    """
+    def __init__(self, min_iou: float = 0.3, max_missed: int = 5):
+        self.min_iou = min_iou
+        self.max_missed = max_missed
+        self.tracks = []
+        self.started = 0
+
+    def update(self, boxes):
+        """Tracks for this frame's boxes, in the same order"""
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        assigned = [None] * len(boxes)
+        if self.tracks and boxes:
+            overlap = iou_matrix([t.box for t in self.tracks], boxes)
+            for flat in np.argsort(-overlap, axis=None, kind='stable'):
+                ti, bi = np.unravel_index(flat, overlap.shape)
+                if overlap[ti, bi] < self.min_iou:
+                    break
+                track = self.tracks[ti]
+                if assigned[bi] is None and track.missed >= 0:
+                    assigned[bi] = track
+                    track.box, track.hits, track.missed = boxes[bi], track.hits + 1, -1
+
+        for track in self.tracks:
+            # -1 marks tracks matched this frame
+            track.missed = 0 if track.missed < 0 else track.missed + 1
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+
+        for bi, box in enumerate(boxes):
+            if assigned[bi] is None:
+                self.started += 1
+                assigned[bi] = Track(self.started, box)
+                self.tracks.append(assigned[bi])
+        return assigned
@@ -0,0 +1,340 @@
+"""
+Offline batch identification
+Runs recognition over a video file or an image folder and writes one row per face (or faceless frame):
+    python identify.py footage.mp4 --output results.csv
+    python identify.py photos/ --output results.jsonl --extract-workers 4
+    python identify.py footage.mp4 --track        (recognize once per tracked face)
+    python identify.py footage.mp4 --crowd        (all faces of a frame at once, one face per identity)
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+
+import face_core as core
+
+QUEUE_SIZE = 8  # frames buffered between stages; bounds memory for any input length
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png", "*.bmp")
+FIELDS = ("source", "frame", "timestamp_ms", "face", "x", "y", "w", "h", "name", "score", "decision",
+          "track", "recognized")
+TRACK_QUALITY_GAIN = 1.25   # re-recognize a track when sharpness or face area improves by this factor
+TRACK_MAX_RECOGNITIONS = 3  # full recognitions per track at most
+
+_DONE = object()
+
+
+def iter_frames(source, stride=1):
+    """(frame index, timestamp ms, source name, RGB frame) from a video file or image folder
+
+    Folder timestamps are None. Unreadable images are skipped.
+    """
+    if os.path.isdir(source):
+        paths = sorted(path for pattern in IMAGE_PATTERNS for path in glob.glob(os.path.join(source, pattern)))
+        for index, path in enumerate(paths[::stride]):
+            image = cv2.imread(path)
+            if image is not None:
+                yield index * stride, None, os.path.basename(path), cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise IOError(f"Cannot open video {source}")
+    name = os.path.basename(source)
+    index = 0
+    try:
+        while True:
+            # grab() skips decoding of the frames the stride drops
+            if not capture.grab():
+                break
+            if index % stride == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    yield index, capture.get(cv2.CAP_PROP_POS_MSEC), name, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            index += 1
+    finally:
+        capture.release()
+
+
+def _row(frame_info, face=None, box=None, decision="", name="", score=None, track="", recognized=""):
+    index, timestamp, source = frame_info
+    x, y, w, h = (int(v) for v in box) if box is not None else ("", "", "", "")
+    return {
+        "source": source, "frame": index,
+        "timestamp_ms": round(timestamp, 1) if timestamp is not None else "",
+        "face": face if face is not None else "", "x": x, "y": y, "w": w, "h": h,
+        "name": name, "score": round(score, 4) if score is not None else "", "decision": decision,
+        "track": track, "recognized": recognized
+    }
+
+
+def _extract(frame_info, frame, min_face, crowd=False):
+    """Faces of one frame, as verify_image sees them: (info, [(face, box, features or rejection)])
+
+    With `crowd`, the features of all the frame's faces are extracted as one batch.
+    """
+    mode = core.ENHANCEMENT_MODES["verify"]
+    faces, source = core.detect_faces(frame, mode)
+    found = []
+    for face, box in enumerate(faces):
+        (x, y, w, h) = box
+        if w < min_face or h < min_face:
+            found.append((face, box, "face_too_small"))
+            continue
+        found.append((face, box, core.face_crop(source, box, mode)))
+    crops = [item for item in found if not isinstance(item[2], str)]
+    if crowd:
+        batch = core.extract_features_batch([crop for _, _, crop in crops])
+    else:
+        batch = [core.extract_advanced_features(crop) for _, _, crop in crops]
+    features = {face: f for (face, _, _), f in zip(crops, batch)}
+    return frame_info, [(face, box, features.get(face, item)) for face, box, item in found]
+
+
+def _decide(features, candidates):
+    """(decision, name, score) for one face's features"""
+    if not candidates:
+        return "no_match", "", None
+    result = core.identify(features, candidates)
+    if not result["top"]:
+        return result["decision"], "", None
+    name, score = result["top"][0]
+    return result["decision"], name if result["decision"] != "not_recognized" else "", score
+
+
+def _decide_crowd(features_list, candidates):
+    """(decision, name, score) per face, identities assigned one-to-one across the frame"""
+    if not candidates:
+        return [("no_match", "", None)] * len(features_list)
+    decisions = []
+    for result in core.identify_crowd(features_list, candidates):
+        name, score = result["top"][0] if result["top"] else ("", None)
+        decisions.append((result["decision"], name if result["decision"] != "not_recognized" else "", score))
+    return decisions
+
+
+def _match(frame_info, found, candidates, crowd=False):
+    if not found:
+        return [_row(frame_info, decision="no_face")]
+    extracted = [features for _, _, features in found if not isinstance(features, str)]
+    decisions = iter(_decide_crowd(extracted, candidates) if crowd else
+                     [_decide(features, candidates) for features in extracted])
+    rows = []
+    for face, box, features in found:
+        if isinstance(features, str):
+            rows.append(_row(frame_info, face, box, decision=features))
+        else:
+            rows.append(_row(frame_info, face, box, *next(decisions)))
+    return rows
+
+
+class TrackedIdentifier:
+    """Frame-by-frame identification that recognizes each tracked face once
+
+    Detections get persistent IDs from an IoUTracker. Features and the
+    gallery match only run for a new track, or when a frame shows the face
+    noticeably sharper (detect_blur) or larger than the frame the cached
+    decision came from, up to TRACK_MAX_RECOGNITIONS times per track.
+    Every other frame reuses the track's cached decision. Frames must be
+    fed in order, from one thread.
+    """
+    def __init__(self, candidates, min_face=core.VERIFY_MIN_FACE, quality_gain=TRACK_QUALITY_GAIN,
+                 max_recognitions=TRACK_MAX_RECOGNITIONS, tracker=None):
+        self.candidates = candidates
+        self.min_face = min_face
+        self.quality_gain = quality_gain
+        self.max_recognitions = max_recognitions
+        self.tracker = tracker or core.IoUTracker()
+        self.faces = 0
+        self.recognitions = 0
+
+    def _needs_recognition(self, track, quality):
+        if track.decision is None:
+            return True
+        if track.recognitions >= self.max_recognitions:
+            return False
+        blur, area = quality
+        best_blur, best_area = track.quality
+        return blur >= best_blur * self.quality_gain or area >= best_area * self.quality_gain
+
+    def process(self, frame_info, frame):
+        mode = core.ENHANCEMENT_MODES["verify"]
+        faces, source = core.detect_faces(frame, mode)
+        tracks = self.tracker.update(faces)
+        if len(faces) == 0:
+            return [_row(frame_info, decision="no_face")]
+        rows = []
+        for face, (box, track) in enumerate(zip(faces, tracks)):
+            (x, y, w, h) = box
+            if w < self.min_face or h < self.min_face:
+                rows.append(_row(frame_info, face, box, decision="face_too_small", track=track.id, recognized=0))
+                continue
+            self.faces += 1
+            quality = (core.detect_blur(frame[y:y+h, x:x+w]), int(w) * int(h))
+            recognized = self._needs_recognition(track, quality)
+            if recognized:
+                features = core.extract_advanced_features(core.face_crop(source, box, mode))
+                track.decision = _decide(features, self.candidates)
+                track.quality = quality
+                track.recognitions += 1
+                self.recognitions += 1
+            rows.append(_row(frame_info, face, box, *track.decision, track=track.id, recognized=int(recognized)))
+        return rows
+
+    def stats(self):
+        return {
+            "tracks": self.tracker.started,
+            "tracked_faces": self.faces,
+            "recognitions": self.recognitions,
+            "recognitions_avoided": self.faces - self.recognitions
+        }
+
+
+class _Writer:
+    """CSV or JSONL output, chosen by the file extension"""
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8') if path else sys.stdout
+        self.jsonl = bool(path) and path.lower().endswith((".jsonl", ".json"))
+        self.csv = None if self.jsonl else csv.DictWriter(self.file, fieldnames=FIELDS)
+        if self.csv:
+            self.csv.writeheader()
+
+    def write(self, row):
+        if self.jsonl:
+            self.file.write(json.dumps(row) + "\n")
+        else:
+            self.csv.writerow(row)
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def run_pipeline(source, output=None, extract_workers=2, match_workers=1, queue_size=QUEUE_SIZE,
+                 stride=1, min_face=core.VERIFY_MIN_FACE, track=False, crowd=False):
+    """Decode -> detect/extract -> match -> write, each stage in its own threads
+
+    Stages hand frames over through bounded queues, so a slow stage blocks
+    the ones before it instead of buffering the input. Rows are written in
+    completion order (each carries its frame index). With `track`, detection
+    and matching run in one ordered TrackedIdentifier stage instead. Returns
+    a summary. With `crowd`, each frame's faces are extracted as one batch
+    and never two of them get the same identity (see core.identify_crowd).
+    """
+    # Build the shared caches once, before the match threads race for them
+    candidates = core.load_gallery()
+
+    frames_q = queue.Queue(maxsize=queue_size)
+    faces_q = queue.Queue(maxsize=queue_size)
+    rows_q = queue.Queue(maxsize=queue_size * 4)
+    errors = []
+
+    def decode():
+        try:
+            for index, timestamp, name, frame in iter_frames(source, stride):
+                frames_q.put(((index, timestamp, name), frame))
+        except Exception as e:
+            errors.append(f"decode: {e}")
+
+    def worker(fn, inbox, outbox, *args):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                return
+            try:
+                outbox.put(fn(*item, *args))
+            except Exception as e:
+                rows_q.put([_row(item[0], decision="error")])
+                errors.append(f"{fn.__name__.strip('_')} frame {item[0][0]}: {e}")
+
+    def close_after(threads, outbox, count):
+        # A stage's queue is closed once every thread feeding it has finished
+        for thread in threads:
+            thread.join()
+        for _ in range(count):
+            outbox.put(_DONE)
+
+    decoders = [threading.Thread(target=decode, daemon=True)]
+    tracked = None
+    if track:
+        # Tracking needs frames in order: a single stage detects, tracks and matches
+        tracked = TrackedIdentifier(candidates, min_face)
+        extractors = [threading.Thread(target=worker, args=(tracked.process, frames_q, rows_q), daemon=True)]
+        matchers = []
+        closers = [
+            threading.Thread(target=close_after, args=(decoders, frames_q, 1), daemon=True),
+            threading.Thread(target=close_after, args=(extractors, rows_q, 1), daemon=True)
+        ]
+    else:
+        extractors = [threading.Thread(target=worker, args=(_extract, frames_q, faces_q, min_face, crowd), daemon=True)
+                      for _ in range(extract_workers)]
+        matchers = [threading.Thread(target=worker, args=(_match, faces_q, rows_q, candidates, crowd), daemon=True)
+                    for _ in range(match_workers)]
+        closers = [
+            threading.Thread(target=close_after, args=(decoders, frames_q, extract_workers), daemon=True),
+            threading.Thread(target=close_after, args=(extractors, faces_q, match_workers), daemon=True),
+            threading.Thread(target=close_after, args=(matchers, rows_q, 1), daemon=True)
+        ]
+
+    start = time.perf_counter()
+    for thread in decoders + extractors + matchers + closers:
+        thread.start()
+
+    writer = _Writer(output)
+    frames, faces, decisions = 0, 0, {}
+    try:
+        while True:
+            rows = rows_q.get()
+            if rows is _DONE:
+                break
+            for row in rows:
+                writer.write(row)
+                # Each frame has one faceless row or rows for faces 0..n-1
+                frames += row["face"] in ("", 0)
+                faces += row["face"] != ""
+                decisions[row["decision"]] = decisions.get(row["decision"], 0) + 1
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    report = {
+        "frames": frames,
+        "faces": faces,
+        "decisions": decisions,
+        "gallery_users": len(candidates),
+        "seconds": elapsed,
+        "frames_per_second": frames / elapsed if elapsed > 0 else None,
+        "errors": errors[:20]
+    }
+    if tracked is not None:
+        report.update(tracked.stats())
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="video file or folder of images")
+    parser.add_argument("--output", help=".csv or .jsonl results file (default: CSV on stdout)")
+    parser.add_argument("--extract-workers", type=int, default=2, help="detection + feature extraction threads")
+    parser.add_argument("--match-workers", type=int, default=1, help="gallery matching threads")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="frames buffered between stages")
+    parser.add_argument("--stride", type=int, default=1, help="process every Nth frame")
+    parser.add_argument("--min-face", type=int, default=core.VERIFY_MIN_FACE, help="smallest face side to identify")
+    parser.add_argument("--track", action="store_true", help="track faces and recognize each track once (video)")
+    parser.add_argument("--crowd", action="store_true",
+                        help="recognize all faces of a frame as one batch, one face per identity")
+    args = parser.parse_args(argv)
+
+    report = run_pipeline(args.source, args.output, args.extract_workers, args.match_workers,
+                          args.queue_size, args.stride, args.min_face, args.track, args.crowd)
+    print(json.dumps(report, indent=2), file=sys.stderr if not args.output else sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,10 +5,11 @@ import os
 # Add current directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# Import and run the main app
+# Run the main app (importing it only builds the UI)
 if __name__ == "__main__":
     try:
-        import app_perfect
+        import runpy
+        runpy.run_module("app_perfect", run_name="__main__")
     except KeyboardInterrupt:
         print("\n\n⏹️ Server stopped by user")
         sys.exit(0)
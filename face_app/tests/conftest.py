@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the app modules (face_core, ...) the way the scripts do, from face_app/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,99 @@
+"""
+Concurrent writers on one gallery database
+Several processes add, delete and verify users on the same faces.json and
+feature store; afterwards the database must hold exactly the users that
+were added and not deleted, each on its own descriptors.
+"""
+import json
+import multiprocessing
+import os
+import zlib
+
+import cv2
+import numpy as np
+
+from face_core import database, recognition
+from face_core.database import FaceDatabase, build_template
+from face_core.features import extract_advanced_features
+
+WORKERS = 4
+USERS_PER_WORKER = 12
+KEEP_EVERY = 3   # each worker keeps every third user it added and deletes the others,
+                 # enough dead rows for the store to be compacted while they write
+
+
+def _face(name):
+    # Deterministic noise "face", so the parent can recompute every user's descriptors
+    rng = np.random.default_rng(zlib.crc32(name.encode()))
+    return rng.integers(0, 256, (160, 160, 3), dtype=np.uint8)
+
+
+def _entry(root, name):
+    image = _face(name)
+    path = os.path.join(root, "faces", f"{name}.png")
+    cv2.imwrite(path, image)
+    features = extract_advanced_features(image)
+    # Noise has no detectable face; the test template stands in for one
+    template, _ = build_template(path)
+    template["has_face"] = True
+    return (name, path, features, template, features["face_normalized"]), features
+
+
+def _worker(root, worker):
+    FaceDatabase.COMPACT_MIN_DEAD = 4
+    db = database.db = FaceDatabase(os.path.join(root, "faces.json"), os.path.join(root, "gallery"))
+    added, deleted, errors = [], [], []
+    for i in range(USERS_PER_WORKER):
+        name = f"w{worker}_u{i:02d}"
+        entry, features = _entry(root, name)
+        db.add_users([entry])
+        added.append(name)
+
+        with open(db.db_path) as f:
+            json.load(f)  # readers never see a partial file
+        result = recognition.identify(features, recognition.gallery_candidates())
+        if not result["top"] or result["top"][0][0] != name:
+            errors.append(f"{name} verified as {result['top'][:1]}")
+
+        if i and (i - 1) % KEEP_EVERY:
+            victim = added[i - 1]
+            if db.delete_users([victim]) != [victim]:
+                errors.append(f"{victim} not deleted")
+            deleted.append(victim)
+
+        # The name index follows this process's writes and is rebuilt after the others'
+        directory = db._user_directory()
+        positions = {user["name"].lower(): i for i, user in enumerate(directory.data["users"])}
+        if directory.keys != sorted(positions) or directory.positions != positions:
+            errors.append(f"user directory out of date after {name}")
+    return added, deleted, errors
+
+
+def test_concurrent_add_delete_verify(tmp_path):
+    root = str(tmp_path)
+    os.makedirs(os.path.join(root, "faces"))
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(WORKERS) as pool:
+        results = pool.starmap(_worker, [(root, worker) for worker in range(WORKERS)])
+
+    expected = set()
+    for added, deleted, errors in results:
+        assert errors == []
+        expected.update(set(added) - set(deleted))
+
+    with open(os.path.join(root, "faces.json")) as f:
+        data = json.load(f)
+    names = [user["name"] for user in data["users"]]
+    assert len(names) == len(set(names)), "duplicated user entries"
+    assert set(names) == expected, "lost or resurrected users"
+
+    db = FaceDatabase(os.path.join(root, "faces.json"), os.path.join(root, "gallery"))
+    rows = [user["row"] for user in db.data["users"]]
+    assert len(set(rows)) == len(rows)
+    assert max(rows) < db.store.rows
+    assert db.store.generation > 0, "the store was never compacted"
+    for user in db.data["users"]:
+        stored = db.get_features(user)
+        features = extract_advanced_features(_face(user["name"]))
+        np.testing.assert_allclose(stored["lbp_hist"], features["lbp_hist"], rtol=1e-6)
+        assert np.array_equal(stored["face_normalized"], features["face_normalized"])
@@ -0,0 +1,37 @@
+"""
+Batched gallery scores against the pairwise comparison
+score_gallery must give compare_advanced_features' score for every row.
+"""
+import numpy as np
+
+from face_core.database import FaceDatabase
+from face_core.features import compare_advanced_features, extract_advanced_features
+from face_core.matching import MATCH_CHUNK_ROWS, centered_norms, score_gallery
+
+FIELDS = FaceDatabase.HIST_FIELDS + ("face_normalized",)
+
+
+def _stored(features):
+    # The row as the feature store keeps it
+    return {field: np.asarray(features[field], dtype=np.float32 if field != "face_normalized" else np.uint8)
+            for field in FIELDS}
+
+
+def test_score_gallery_matches_pairwise():
+    rng = np.random.default_rng(7)
+    faces = [rng.integers(0, 256, (160, 160, 3), dtype=np.uint8) for _ in range(6)]
+    # Noisy copies score high, the others low; repeated over more rows than one chunk
+    noisy = [np.clip(faces[i % 6] + rng.normal(0, 4 * (i // 6), faces[0].shape), 0, 255).astype(np.uint8)
+             for i in range(24)]
+    distinct = [_stored(extract_advanced_features(img)) for img in noisy]
+    rows = [distinct[i % len(distinct)] for i in range(MATCH_CHUNK_ROWS + 18)]
+    gallery = {field: np.stack([row[field] for row in rows]) for field in FIELDS}
+    for probe in (extract_advanced_features(faces[0]), extract_advanced_features(faces[3])):
+        expected = [compare_advanced_features(probe, row) for row in rows]
+        np.testing.assert_allclose(score_gallery(probe, gallery), expected, rtol=0, atol=1e-7)
+        # Precomputed face norms and a row subset score the same
+        gallery["face_normalized_norm"] = centered_norms(gallery["face_normalized"])
+        picked = rng.permutation(len(rows))[:40]
+        np.testing.assert_allclose(score_gallery(probe, gallery, picked), np.asarray(expected)[picked],
+                                   rtol=0, atol=1e-7)
+        del gallery["face_normalized_norm"]
@@ -0,0 +1,62 @@
+"""
+The cascaded gallery scan against the full one
+match_gallery_cascade must return exactly match_gallery's top-k and gap,
+including when many rows tie with the k-th best score.
+"""
+import numpy as np
+
+from face_core.database import FaceDatabase
+from face_core.features import extract_advanced_features
+from face_core.matching import CASCADE_MIN_ROWS, centered_norms, match_gallery, match_gallery_cascade
+
+FIELDS = FaceDatabase.HIST_FIELDS + ("face_normalized",)
+
+
+def _features(rng, n):
+    return [extract_advanced_features(rng.integers(0, 256, (160, 160, 3), dtype=np.uint8)) for _ in range(n)]
+
+
+def _gallery(rows):
+    gallery = {field: np.stack([np.asarray(row[field], dtype=np.float32 if field != "face_normalized" else np.uint8)
+                                for row in rows]) for field in FIELDS}
+    gallery["face_normalized_norm"] = centered_norms(gallery["face_normalized"])
+    return gallery
+
+
+def _assert_same(probe, gallery, top_k):
+    full = match_gallery(probe, gallery, top_k=top_k)
+    cascade = match_gallery_cascade(probe, gallery, top_k=top_k)
+    assert [i for i, _ in cascade["top"]] == [i for i, _ in full["top"]]
+    np.testing.assert_allclose([s for _, s in cascade["top"]], [s for _, s in full["top"]], rtol=0, atol=1e-12)
+
+
+def test_cascade_matches_full_scan_on_tied_scores():
+    rng = np.random.default_rng(0)
+    distinct = _features(rng, 24)
+    # Every identity several times over: each probe ties with its copies at the top,
+    # and the k-th best score is shared by rows the cascade has to keep or drop
+    rows = [distinct[i % len(distinct)] for i in rng.permutation(CASCADE_MIN_ROWS * 4)]
+    gallery = _gallery(rows)
+    for probe in distinct[:8]:
+        for top_k in (1, 3, 5, 12):
+            _assert_same(probe, gallery, top_k)
+
+
+def test_cascade_matches_full_scan_on_near_ties():
+    rng = np.random.default_rng(1)
+    for _ in range(3):
+        probe, other = _features(rng, 2)
+        rows = []
+        for i in range(CASCADE_MIN_ROWS * 6):
+            # Blends of two faces scoring within float32 rounding of each other: the probe's own
+            # face template, whose float32 correlation can exceed 1, or one pixel away from it
+            row = {field: np.asarray(probe[field]) * 0.6 + np.asarray(other[field]) * 0.4 for field in FIELDS[:-1]}
+            row["face_normalized"] = np.asarray(probe["face_normalized"]).copy()
+            if i % 2:
+                row["face_normalized"][rng.integers(0, 160), rng.integers(0, 160)] ^= 1
+            for field in ("hog_hist", "color_hist"):
+                row[field] = row[field] + 1e-7 * row[field].std() * rng.standard_normal(row[field].shape)
+            rows.append(row)
+        gallery = _gallery(rows)
+        for top_k in (1, 5, 40):
+            _assert_same(probe, gallery, top_k)